@@ -0,0 +1,198 @@
+import numpy as np
+
+SECONDS_PER_HOUR = 60 * 60
+SECONDS_PER_DAY = 24 * SECONDS_PER_HOUR
+
+# Daily Air Quality Index (DEFRA) - the running mean each pollutant is banded on, in hours, and the
+# top of bands 1 to 9 in µg/m³. Anything above the band 9 limit is band 10.
+DAQI_BANDS = {
+    "Nitrogen dioxide": (1, [67, 134, 200, 267, 334, 400, 467, 534, 600]),
+    "Ozone": (8, [33, 66, 100, 120, 140, 160, 187, 213, 240]),
+    "PM10 Particulate matter": (24, [16, 33, 50, 58, 66, 75, 83, 91, 100]),
+    "PM2.5 Particulate matter": (24, [11, 23, 35, 41, 47, 53, 58, 64, 70]),
+}
+# Highest band in each DAQI level
+DAQI_LEVELS = ((3, "Low"), (6, "Moderate"), (9, "High"), (10, "Very High"))
+
+# Annual mean limit values in µg/m³ (Air Quality Standards Regulations 2010)
+ANNUAL_LIMITS = {
+    "Nitrogen dioxide": 40,
+    "PM10 Particulate matter": 40,
+    "PM2.5 Particulate matter": 20,
+}
+
+# Short term objectives - (statistic, threshold in µg/m³, exceedances allowed per year, description).
+# The statistic is "reading" for each reading, "daily_mean" for each day's mean or "daily_max_8h"
+# for each day's highest 8-hour running mean.
+EXCEEDANCE_LIMITS = {
+    "Nitrogen dioxide": ("reading", 200, 18, "1-hour mean > 200 µg/m³"),
+    "PM10 Particulate matter": ("daily_mean", 50, 35, "24-hour mean > 50 µg/m³"),
+    "Ozone": ("daily_max_8h", 100, 10, "Max daily 8-hour mean > 100 µg/m³"),
+}
+
+
+def running_mean(seconds, values, hours: int):
+    """Mean of the readings in the window of hours ending at each reading.
+
+    Windows are by time rather than by number of readings, so gaps in a series are handled: each
+    window covers (t - hours, t]. Uses one cumulative sum and a binary search for where each
+    window starts, so it's linear in the length of the series whatever the window.
+
+    Args:
+        seconds (numpy.ndarray): Reading times as int64 seconds, ascending
+        values (numpy.ndarray): Reading values
+        hours (int): Length of the window
+
+    Returns:
+        numpy.ndarray: The running mean at each reading
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return values
+    starts = np.searchsorted(seconds, seconds - hours * SECONDS_PER_HOUR, side="right")
+    # Summing the differences from the mean keeps the running total, and so the rounding error
+    # in each window's difference of totals, small over long series
+    centre = values.mean()
+    sums = np.concatenate(([0.0], np.cumsum(values - centre)))
+    ends = np.arange(1, len(values) + 1)
+    return centre + (sums[ends] - sums[starts]) / (ends - starts)
+
+
+def daqi_index(concentrations, pollutant: str):
+    """Band concentrations on the Daily Air Quality Index.
+
+    Args:
+        concentrations (numpy.ndarray): Running means of the pollutant's DAQI averaging period
+        pollutant (str): Pollutant name
+
+    Returns:
+        numpy.ndarray: Index from 1 to 10 for each concentration, 0 where it can't be banded
+        (the pollutant isn't on the index or the value is missing)
+    """
+    concentrations = np.asarray(concentrations, dtype=np.float64)
+    if pollutant not in DAQI_BANDS:
+        return np.zeros(len(concentrations), dtype=np.int8)
+    # Bands are set on whole µg/m³ - round first so e.g. 33.4 is band 1 and 33.6 band 2
+    index = np.searchsorted(DAQI_BANDS[pollutant][1], np.rint(concentrations), side="left") + 1
+    return np.where(np.isfinite(concentrations), index, 0).astype(np.int8)
+
+
+def daqi_level(index: int):
+    """Name of the DAQI level (Low, Moderate, High, Very High) for an index, None if there isn't one."""
+    for top, level in DAQI_LEVELS:
+        if 0 < index <= top:
+            return level
+    return None
+
+
+def summarise_series(measured_at, values, pollutant: str):
+    """Air quality statistics for one location's readings of a pollutant.
+
+    Args:
+        measured_at (numpy.ndarray): Reading times (datetime64), ascending
+        values (numpy.ndarray): Reading values
+        pollutant (str): Pollutant name - picks the DAQI bands, limit value and objective
+
+    Returns:
+        dict | None: None if there are no readings, otherwise:
+            latest_date (str): Date of the last reading
+            running_mean_hours (int|None): DAQI averaging period
+            running_mean (float|None): Running mean at the last reading
+            daqi (int|None): Highest DAQI index on the latest day
+            daqi_level (str|None): Level of that index
+            year (int): Latest calendar year with readings
+            annual_mean (float): Mean of that year's readings
+            annual_limit (float|None): Annual mean limit value
+            annual_exceeded (bool|None): Whether the annual mean is over the limit
+            exceedances (int|None): Times the short term objective was exceeded in the year
+            exceedances_allowed (int|None): Exceedances the objective allows per year
+            exceedance_rule (str|None): Description of the objective
+
+    Notes:
+        - The statistics work on whatever resolution the readings are at. With daily readings each
+          running mean is just that day's value, and the 1-hour objective counts daily values.
+        - No data capture threshold is applied, a mean is taken over the readings present
+    """
+    measured_at = np.asarray(measured_at, dtype="datetime64[s]")
+    values = np.asarray(values, dtype=np.float64)
+    present = np.isfinite(values)
+    if not present.all():
+        measured_at, values = measured_at[present], values[present]
+    if not len(values):
+        return None
+
+    seconds = measured_at.astype(np.int64)
+    days = seconds // SECONDS_PER_DAY
+    day_starts = np.flatnonzero(np.concatenate(([True], days[1:] != days[:-1])))
+
+    # Everything from the start of the latest year on - the year always starts on a day boundary
+    year = measured_at[-1].astype("datetime64[Y]")
+    year_start = int(np.searchsorted(seconds, year.astype("datetime64[s]").astype(np.int64)))
+    year_values = values[year_start:]
+    year_day_starts = day_starts[day_starts >= year_start] - year_start
+
+    summary = {
+        "latest_date": str(measured_at[-1].astype("datetime64[D]")),
+        "running_mean_hours": None,
+        "running_mean": None,
+        "daqi": None,
+        "daqi_level": None,
+        "year": int(str(year)),
+        "annual_mean": float(year_values.mean()),
+        "annual_limit": ANNUAL_LIMITS.get(pollutant),
+        "annual_exceeded": None,
+        "exceedances": None,
+        "exceedances_allowed": None,
+        "exceedance_rule": None,
+    }
+    if summary["annual_limit"] is not None:
+        summary["annual_exceeded"] = summary["annual_mean"] > summary["annual_limit"]
+
+    if pollutant in DAQI_BANDS:
+        hours = DAQI_BANDS[pollutant][0]
+        means = running_mean(seconds, values, hours)
+        index = int(daqi_index(means[day_starts[-1]:], pollutant).max())
+        summary.update(running_mean_hours=hours, running_mean=float(means[-1]), daqi=index or None,
+                       daqi_level=daqi_level(index))
+
+    if pollutant in EXCEEDANCE_LIMITS:
+        statistic, threshold, allowed, rule = EXCEEDANCE_LIMITS[pollutant]
+        if statistic == "reading":
+            checked = year_values
+        elif statistic == "daily_mean":
+            checked = np.add.reduceat(year_values, year_day_starts) / np.diff(
+                np.append(year_day_starts, len(year_values)))
+        else:
+            checked = np.maximum.reduceat(running_mean(seconds, values, 8)[year_start:], year_day_starts)
+        summary.update(exceedances=int(np.count_nonzero(checked > threshold)), exceedances_allowed=allowed,
+                       exceedance_rule=rule)
+
+    return summary
+
+
+def air_quality_summary(series):
+    """Summarise each location/pollutant series - see summarise_series().
+
+    Args:
+        series (iterable[tuple]): (location name, sub-location name, pollutant name, measured_at,
+            values) for each series, from database_helpers.iter_series() or SeriesStore.iter_series().
+            measured_at can be datetime64 or date strings.
+
+    Returns:
+        list[dict]: One record per series with readings - location, sub_location and pollutant
+        followed by the summarise_series() fields
+    """
+    summaries = []
+    for loc_name, sub_name, pollutant_name, measured_at, values in series:
+        measured_at = np.asarray(measured_at)
+        if measured_at.dtype.kind != "M":
+            # Dates and date-times can be mixed, e.g. daily Oxford and hourly London readings
+            import pandas as pd
+
+            measured_at = pd.to_datetime(pd.Series(measured_at, dtype=str), format="ISO8601")
+            measured_at = measured_at.to_numpy(dtype="datetime64[s]")
+        summary = summarise_series(measured_at, values, pollutant_name)
+        if summary is not None:
+            summaries.append({"location": loc_name, "sub_location": sub_name, "pollutant": pollutant_name,
+                              **summary})
+    return summaries
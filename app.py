@@ -1,11 +1,24 @@
-from flask import Flask, flash, redirect, render_template, request, session, send_file, url_for
+from flask import Flask, Response, flash, jsonify, redirect, render_template, request, send_file, session, url_for
 from flask_session import Session
 from werkzeug.security import check_password_hash, generate_password_hash
 from helpers import apology, login_required
-from database_helpers import get_filtered_results, close_db, get_db, generate_csv
-from graphing import build_graph, create_interactive_graph
-from table_helpers import basic_table
+from http_helpers import init_http_caching
+from metrics import METRICS_CONTENT_TYPE, init_metrics, record_stages, render_metrics, stage
+from analytics import air_quality_summary
+from database_helpers import ARROW_BATCH_ROWS, DATASET_PARAM, DATASETS, EXPORT_FORMATS, get_filtered_results, \
+    acquire_db, close_db, current_dataset, decode_cursor, get_data_version, get_dataset_summary, get_db, \
+    get_filtered_page, get_reference_data, iter_filtered_results, iter_series, release_db, stream_arrow, stream_csv
+from cache_helpers import DataVersionCache
+from export_jobs import DEFAULT_EXPORT_DIR, ExportJobs
+from graphing import MAX_POINTS_PER_TRACE, create_interactive_graph, points_per_trace, prewarm, read_graph_data
+from render_pool import RenderPool, RenderPoolBusy, RenderTimeout, render_graph, render_table
+from series_store import SeriesStore
+from table_helpers import TABLE_COLUMNS, basic_table, plotly_js_path, plotly_js_version, table_columns
 from datetime import datetime
+from threading import Thread
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Configure the flask application
 app = Flask(__name__)
@@ -16,6 +29,241 @@ app.config["SESSION_PERMANENT"] = False
 app.config["SESSION_TYPE"] = "filesystem"
 Session(app)
 
+# Request and stage timings, served at /metrics. Set SERVER_TIMING to also send each request's
+# stage timings in a Server-Timing header (shown in the browser dev tools network tab).
+app.config["SERVER_TIMING"] = False
+init_metrics(app)
+
+# HTTP caching for the data pages - each endpoint's Cache-Control, with a weak ETag built from the
+# data version and query parameters so repeat requests get a 304 without the page being rebuilt.
+# Pages are private as the layout depends on the session, API / export responses can be shared.
+app.config["HTTP_CACHE_CONTROL"] = {
+    "explore": "private, no-cache",
+    "graphs": "private, no-cache",
+    "table": "private, no-cache",
+    "graphs_zoom": "public, no-cache",
+    "api_measurements": "public, no-cache",
+    "api_air_quality": "public, no-cache",
+    "download": "public, no-cache",
+    "plotly_js": "public, max-age=31536000, immutable",
+}
+init_http_caching(app, lambda: get_data_version(get_db()))
+
+# Server-side caches, one per dataset as each dataset's database has its own data version
+# Serialised figures - rebuilt when ingest changes the data version. The /graphs overview has a
+# cache to itself, so a run of zoom windows can't evict it.
+figure_caches = {dataset: DataVersionCache(max_entries=1) for dataset in DATASETS}
+app.config["ZOOM_FIGURE_CACHE_SIZE"] = 32
+zoom_figure_caches = {dataset: DataVersionCache(max_entries=app.config["ZOOM_FIGURE_CACHE_SIZE"])
+                      for dataset in DATASETS}
+# Locations / sub-locations / pollutants for the explore dropdowns - only change on ingest
+reference_caches = {dataset: DataVersionCache(max_entries=1) for dataset in DATASETS}
+# Running means, DAQI bands, annual means and exceedances per filter selection
+analytics_caches = {dataset: DataVersionCache(max_entries=32) for dataset in DATASETS}
+
+# In-memory columnar copy of the measurements - serves /explore, the table API and the graphs
+# without SQL. Set to False to read everything from the db instead (e.g. when memory is tight).
+app.config["SERIES_STORE"] = True
+# Snapshots written by data/export_snapshot.py after ingest - workers start from them with the arrays
+# memory-mapped, sharing one copy of the data through the OS page cache
+app.config["SERIES_SNAPSHOT_PATHS"] = {
+    "oxford": "data/snapshot",
+    "london": "data/snapshot-london",
+}
+series_stores = {dataset: SeriesStore() for dataset in DATASETS}
+
+# plotly and pandas are imported on the first graph / table request. Set PREWARM_FIGURES to import
+# them in the background as the worker starts instead, so the first graph doesn't wait for them.
+app.config["PREWARM_FIGURES"] = False
+
+# Figures and tables are built in a pool of processes, so a heavy graph doesn't hold up the other
+# requests on this worker. Concurrent requests for the same figure share one build. Set
+# RENDER_POOL_WORKERS to 0 to build them in the request thread instead (None: one per CPU).
+app.config["RENDER_POOL_WORKERS"] = None
+app.config["RENDER_POOL_MAX_PENDING"] = 16  # Builds in flight before requests get a 503
+app.config["RENDER_TIMEOUT"] = 30  # Seconds a request waits for its build before a 503
+render_pool = RenderPool(workers=app.config["RENDER_POOL_WORKERS"],
+                         max_pending=app.config["RENDER_POOL_MAX_PENDING"],
+                         timeout=app.config["RENDER_TIMEOUT"],
+                         initializer=prewarm if app.config["PREWARM_FIGURES"] else None)
+# The table page's empty Plotly table - the same until the code changes
+table_cache = DataVersionCache(max_entries=1)
+
+# Exports started from the explore page are written to files in EXPORT_DIR in the background, and
+# downloaded once finished. The same export (filters, format and data version) is only written once.
+app.config["EXPORT_DIR"] = DEFAULT_EXPORT_DIR
+app.config["EXPORT_WORKERS"] = 2  # Exports written at once, the rest queue
+app.config["EXPORT_MAX_AGE"] = 3600  # Seconds a finished export is kept after it was last asked for
+export_jobs = ExportJobs(directory=app.config["EXPORT_DIR"], workers=app.config["EXPORT_WORKERS"],
+                         max_age=app.config["EXPORT_MAX_AGE"])
+
+
+@app.context_processor
+def inject_plotly_js_version():
+    """Make the plotly version available to templates for versioning the plotly.js URL."""
+    return {"plotly_js_version": plotly_js_version()}
+
+
+def parse_num_records(num_records, default: int = 14):
+    """Validate the number of records requested, falling back to the default if it's invalid.
+
+    Manages the default behaviour of the number of records selected so it doesn't mess with
+    the other filters.
+
+    Returns:
+        int: Number of records between 1 and 10000
+    """
+    try:
+        num_records = int(num_records)
+        if num_records < 1 or num_records > 10000:
+            num_records = default
+    except (ValueError, TypeError):
+        num_records = default
+    return num_records
+
+
+def current_series_store(db, data_version):
+    """Return the in-memory series store for the connection's dataset, brought up to date with the db.
+
+    Args:
+        db (DatasetConnection): Database connection object
+        data_version (int): Current data version (see get_data_version())
+
+    Returns:
+        SeriesStore | None: The loaded store, or None if it's turned off or fails to load, in which
+        case callers read from the db
+    """
+    if not app.config["SERIES_STORE"]:
+        return None
+    try:
+        with stage("store_refresh"):
+            series_stores[db.dataset].refresh(db, data_version, app.config["SERIES_SNAPSHOT_PATHS"].get(db.dataset))
+    except Exception:
+        logger.exception("Series store refresh failed, reading from the db")
+        return None
+    return series_stores[db.dataset]
+
+
+def current_air_quality(db, data_version, main_location=None, sub_location=None, pollutant=None):
+    """Return the air quality summary of the series matching the filters, cached per data version.
+
+    Args:
+        db (sqlite3.Connection): Database connection object
+        data_version (int): Current data version (see get_data_version())
+        main_location (str, optional): Main location name to filter by. Defaults to None.
+        sub_location (str, optional): Sub-location name to filter by. Defaults to None.
+        pollutant (str, optional): Pollutant name to filter by. Defaults to None.
+
+    Returns:
+        list[dict]: One record per series, see analytics.air_quality_summary()
+    """
+    filters = {"main_location": main_location or None, "sub_location": sub_location or None,
+               "pollutant": pollutant or None}
+
+    def build():
+        store = current_series_store(db, data_version)
+        series = store.iter_series(**filters) if store is not None else iter_series(db, **filters)
+        with stage("analytics"):
+            return air_quality_summary(series)
+
+    return analytics_caches[db.dataset].get_or_build(("air_quality", *filters.values()), data_version, build)
+
+
+def current_graph(db, data_version, start_date: str = None, end_date: str = None,
+                  max_points: int = MAX_POINTS_PER_TRACE):
+    """Return the graph figure JSON for the connection's dataset, cached per data version.
+
+    Built in the render pool when it's enabled - concurrent requests for the same figure wait for
+    one build - otherwise in the request thread. The daily means are read from this worker's series
+    store and sent to the pool, so the render processes don't load stores of their own.
+
+    Args:
+        db (DatasetConnection): Database connection object
+        data_version (int): Current data version (see get_data_version())
+        start_date (str, optional): First date to include. Defaults to None (the first date held).
+        end_date (str, optional): Last date to include. Defaults to None (the last date held).
+        max_points (int, optional): Maximum points per trace, see graphing.points_per_trace().
+            Defaults to MAX_POINTS_PER_TRACE.
+
+    Returns:
+        str: JSON-encoded Plotly figure
+
+    Raises:
+        RenderPoolBusy: If the render pool is full
+        RenderTimeout: If the build takes longer than app.config["RENDER_TIMEOUT"]
+    """
+    def build():
+        if not render_pool.enabled:
+            return create_interactive_graph(db, start_date=start_date, end_date=end_date, max_points=max_points,
+                                            store=current_series_store(db, data_version))
+        store = current_series_store(db, data_version)
+        # Without a store the render process reads the rollups itself
+        daily_means = read_graph_data(db, start_date, end_date, store) if store is not None else None
+        with stage("render_pool"):
+            fig_data, stages = render_pool.render(("graphs", db.dataset, data_version, start_date, end_date,
+                                                   max_points), render_graph, db.dataset, start_date, end_date,
+                                                  daily_means, max_points)
+        record_stages(stages)
+        return fig_data
+
+    if start_date is None and end_date is None and max_points == MAX_POINTS_PER_TRACE:
+        return figure_caches[db.dataset].get_or_build("graphs", data_version, build)
+    return zoom_figure_caches[db.dataset].get_or_build((start_date, end_date, max_points), data_version, build)
+
+
+def render_busy_headers():
+    """Headers for a 503 from a full or slow render pool - clients retry after the render timeout."""
+    return {"Retry-After": str(int(app.config["RENDER_TIMEOUT"]))}
+
+
+def dropdown_options(reference, main_location=None, sub_location=None):
+    """Work out the dropdown options that are valid for the current selection.
+
+    Sub-locations are scoped to the selected main location and pollutants to the selected
+    sub-location (or main location), so every choice offered returns some data.
+
+    Args:
+        reference (dict): {location: {sub-location: [pollutants]}} from get_reference_data()
+        main_location (str, optional): Selected main location
+        sub_location (str, optional): Selected sub-location
+
+    Returns:
+        tuple[list[str], list[str], list[str]]: Main location, sub-location and pollutant names
+    """
+    locations = list(reference)
+    scoped = [reference[main_location]] if main_location in reference else list(reference.values())
+
+    # dict.fromkeys keeps the first-seen order while dropping names repeated across locations
+    sub_locations = list(dict.fromkeys(name for subs in scoped for name in subs))
+    pollutants = list(dict.fromkeys(
+        pollutant
+        for subs in scoped
+        for name, sub_pollutants in subs.items()
+        if sub_location not in sub_locations or name == sub_location
+        for pollutant in sub_pollutants
+    ))
+    return locations, sub_locations, pollutants
+
+
+# Load the series stores at startup so the first requests don't wait for them
+if app.config["SERIES_STORE"]:
+    for startup_dataset in DATASETS:
+        try:
+            startup_db = acquire_db(startup_dataset)
+        except Exception as e:
+            logger.warning(f"Series store for {startup_dataset} not loaded at startup: {e}")
+            continue
+        try:
+            current_series_store(startup_db, get_data_version(startup_db))
+        except Exception as e:
+            logger.warning(f"Series store for {startup_dataset} not loaded at startup: {e}")
+        finally:
+            release_db(startup_db)
+
+if app.config["PREWARM_FIGURES"] and not render_pool.enabled:
+    # With the render pool, its processes prewarm as they start instead
+    Thread(target=prewarm, name="prewarm-figures", daemon=True).start()
+
 
 @app.route("/")
 def home():
@@ -42,57 +290,63 @@ def explore():
     main_location (str, optional): Name of the main location to filter by
     sub_location (str, optional): Name of the sub-location to filter by
     pollutant (str, optional): Name of the pollutant to filter by
-    num_records (str, optional): Number of records to display (default: "14")
+    num_records (str, optional): Number of records to display per page (default: "14")
     location-data-selection (str, optional): Dataset selection ("oxford" or "london")
     sort_order (str, optional): Sort direction for results ("asc" or "desc", default: "desc")
+    after (str, optional): Keyset cursor - show the page after this record
+    before (str, optional): Keyset cursor - show the page before this record
 
     Returns:
     flask.Response: Rendered explore_data.html template with the following context:
         data (list): Filtered measurement results
+        air_quality (list[dict]): DAQI, annual mean and exceedance summary of the filtered series
         sort_order (str): Current sort direction ("ASC" or "DESC")
         location (str): Currently selected dataset location ("Oxford" or "London")
-        locations (list): Available main locations for filtering
-            sub_locations (list): Available sub-locations for filtering
-            pollutants (list): Available pollutants for filtering
-            selected_main_location (str|None): Currently selected main location
+            locations (list[str]): Main locations that have data
+        sub_locations (list[str]): Sub-locations with data under the selected main location
+        pollutants (list[str]): Pollutants with data for the selected (sub-)location
+        selected_main_location (str|None): Currently selected main location
         selected_sub_location (str|None): Currently selected sub-location
         selected_pollutant (str|None): Currently selected pollutant
+        selected_num_records (int): Number of records per page
+        prev_url (str|None): Link to the previous page of results, None on the first page
+        next_url (str|None): Link to the next page of results, None on the last page
 
     Notes:
     - Only handles GET requests
-    - Defaults to Oxford dataset if location selection fails
+    - Each dataset is read from its own database, defaulting to Oxford if the selection is missing
+      or the selected dataset hasn't been loaded yet
     - Validates num_records to be between 1 and 10000, defaulting to 14 if invalid
-    - Database exceptions are caught and result in empty lists for the relevant dropdowns
+    - Database exceptions are caught and result in empty dropdowns
+    - The dropdown options are cached until the data version changes, and a selection that is no
+      longer valid (e.g. a sub-location from another main location) is cleared before querying
     - Results are sorted by measurement date in the specified order
+    - Pages use keyset cursors (date + measurement id) so deep pages cost the same as the first
     """
 
     # Establish database connection
     db = get_db()
 
-    # Populate the drop-down menus - dynamic db query - Might need to be updated to manage London case - tbc
-    try:
-        main_locations = db.execute("SELECT * FROM locations")
-    except Exception as e:
-        main_locations = []
-        print(e)
+    # Reference data for the drop-down menus - cached until ingest changes the data
     try:
-        sub_locations = db.execute("SELECT * FROM sub_locations")
-    except Exception as e:
-        sub_locations = []
-        print(e)
-    try:
-        pollutants = db.execute("SELECT * FROM pollutants")
-    except Exception as e:
-        pollutants = []
-        print(e)
+        reference = reference_caches[db.dataset].get_or_build("reference", get_data_version(db),
+                                                              lambda: get_reference_data(db))
+    except Exception:
+        reference = {}
+        logger.exception("Reference data failed to load, showing the page without the filter options")
+    main_locations, sub_locations, pollutants = dropdown_options(reference)
 
     # Addressing variables when there is no user input - default states - I think this could be removed with try blocks
     filtered_results = []
+    air_quality = []
     selected_main_location = None
     selected_sub_location = None
     selected_pollutant = None
-    location_data = "Oxford"
+    location_data = db.dataset.title()
     sort_order = "DESC"
+    selected_num_records = 14
+    prev_url = None
+    next_url = None
 
     # Manage the get requests - user inputs generated by using the filters
     if request.method == "GET":
@@ -100,37 +354,49 @@ def explore():
         selected_main_location = request.args.get("main_location")
         selected_sub_location = request.args.get("sub_location")
         selected_pollutant = request.args.get("pollutant")
-        selected_num_records = request.args.get("num_records", "14")
+        selected_num_records = parse_num_records(request.args.get("num_records"))
         sort_order = request.args.get('sort_order', 'desc')
 
-        # Manage the default behaviour of the number of records selected to not mess with other filters
-        try:
-            selected_num_records = int(selected_num_records)
-            if selected_num_records < 1 or selected_num_records > 10000:
-                selected_num_records = 14
-        except (ValueError, TypeError):
-            selected_num_records = 14
+        # Scope the drop-downs to the selection, dropping choices that no longer apply
+        main_locations, sub_locations, pollutants = dropdown_options(
+            reference, selected_main_location, selected_sub_location)
+        if selected_sub_location not in sub_locations:
+            selected_sub_location = None
+        if selected_pollutant not in pollutants:
+            selected_pollutant = None
 
         # TODO: Create drop-down for sort by - desc or asc order
-        # Query the databased for the data based on filters
-        filtered_results = get_filtered_results(db,
-                                                main_location=selected_main_location,
-                                                sub_location=selected_sub_location,
-                                                pollutant=selected_pollutant,
-                                                limit=selected_num_records,
-                                                sort=sort_order
-                                                )
-
-        # Set a variable to contain the location that is selected - Oxford or London
+        # Query the databased for the data based on filters - one page from the cursor position
+        filtered_results, prev_cursor, next_cursor = get_filtered_page(
+            db,
+            store=current_series_store(db, get_data_version(db)),
+            main_location=selected_main_location,
+            sub_location=selected_sub_location,
+            pollutant=selected_pollutant,
+            limit=selected_num_records,
+            sort=sort_order,
+            after=decode_cursor(request.args.get("after")),
+            before=decode_cursor(request.args.get("before")),
+        )
+
+        # Running means, DAQI and limit values for the selected series, over all their readings
         try:
-            location_data = request.args.get("location-data-selection").title()
-        except Exception as e:
-            print(f"Exception raised for location selection - Oxford vs London: {e}")
-            location_data = "Oxford"
+            air_quality = current_air_quality(db, get_data_version(db), selected_main_location,
+                                              selected_sub_location, selected_pollutant)
+        except Exception:
+            logger.exception("Air quality analytics failed, showing the page without them")
+
+        # Build the previous / next page links, keeping the current filters
+        page_args = {key: value for key, value in request.args.items() if key not in ("after", "before")}
+        if prev_cursor:
+            prev_url = url_for("explore", **page_args, before=prev_cursor)
+        if next_cursor:
+            next_url = url_for("explore", **page_args, after=next_cursor)
 
     # Render the page and pass the dynamically created data
     return render_template("explore_data.html",
                            data=filtered_results,
+                           air_quality=air_quality,
                            sort_order=sort_order,
                            location=location_data,
                            locations=main_locations,
@@ -139,6 +405,9 @@ def explore():
                            selected_main_location=selected_main_location,
                            selected_sub_location=selected_sub_location,
                            selected_pollutant=selected_pollutant,
+                           selected_num_records=selected_num_records,
+                           prev_url=prev_url,
+                           next_url=next_url,
                            )
 
 
@@ -153,103 +422,440 @@ def graphs():
     Returns:
         flask.Response: Rendered graphs.html template with the following context:
             fig (str): JSON-encoded Plotly figure data for the interactive graph
+            air_quality (list[dict]): DAQI, annual mean and exceedance summary of every series
+            dataset (str): Dataset shown, picked with the location-data-selection parameter
+            datasets (list[str]): Every dataset, for the dataset links
+            dataset_param (str): Name of the dataset request parameter
 
     Notes:
         - Only accepts GET requests
         - Requires a working database connection
         - Depends on create_interactive_graph() for visualization generation
+        - The figure JSON is cached until the data version changes, so repeat views skip
+          the query and figure build entirely
+        - The figure is built in the render pool, a 503 is returned if it's full or the build times out
+        - Long series are downsampled, the page fetches full resolution data from /graphs/zoom
     """
     db = get_db()
-    fig_data = create_interactive_graph(db)
-    return render_template("graphs.html", fig=fig_data)
+    data_version = get_data_version(db)
+    try:
+        fig_data = current_graph(db, data_version)
+    except (RenderPoolBusy, RenderTimeout) as e:
+        logger.warning(f"Graphs not rendered: {e}")
+        return Response("Graphs are busy, try again shortly", status=503, mimetype="text/plain",
+                        headers=render_busy_headers())
+
+    try:
+        air_quality = current_air_quality(db, data_version)
+    except Exception:
+        air_quality = []
+        logger.exception("Air quality analytics failed, showing the graphs without them")
+    return render_template("graphs.html", fig=fig_data, air_quality=air_quality, dataset=db.dataset,
+                           datasets=list(DATASETS), dataset_param=DATASET_PARAM)
+
+
+@app.route("/graphs/zoom", methods=["GET"])
+def graphs_zoom():
+    """Return the graph figure for a narrower date window, for the zoom on the graphs page.
+
+    The overview figure on /graphs is downsampled to keep the payload small. When the user
+    zooms in, the page fetches the figure for just the visible dates from here, downsampled to
+    suit the window and the plot's width (see graphing.points_per_trace()) - narrow windows come
+    back at full daily resolution.
+
+    Request Parameters:
+        start (str, optional): First date to include (YYYY-MM-DD). Defaults to the first date held.
+        end (str, optional): Last date to include (YYYY-MM-DD). Defaults to the last date held.
+        width (int, optional): Width of the plot in pixels. Defaults to graphing.DEFAULT_PLOT_WIDTH.
+
+    Returns:
+        flask.Response: JSON-encoded Plotly figure, or
+        flask.Response: JSON error message with a 400 status if a date is invalid, or a 503 status
+        if the render pool is full or the build times out
+
+    Notes:
+        - Only accepts GET requests
+        - Windows with more days than the plot has room for are still downsampled
+        - Figures are cached per window until the data version changes
+    """
+    try:
+        # Plotly sends the range as a datetime string, only the date part is needed
+        start = request.args.get("start")
+        end = request.args.get("end")
+        start = datetime.strptime(start[:10], "%Y-%m-%d").strftime("%Y-%m-%d") if start else None
+        end = datetime.strptime(end[:10], "%Y-%m-%d").strftime("%Y-%m-%d") if end else None
+    except ValueError as e:
+        return jsonify(error=f"Invalid date: {e}"), 400
+
+    db = get_db()
+    try:
+        fig_data = current_graph(db, get_data_version(db), start_date=start, end_date=end,
+                                 max_points=points_per_trace(start, end, request.args.get("width", type=int)))
+    except (RenderPoolBusy, RenderTimeout) as e:
+        return jsonify(error=str(e)), 503, render_busy_headers()
+    return Response(fig_data, mimetype="application/json")
 
 
 @app.route("/plotly_table", methods=["GET"])
 def table():
     """Render a Plotly-enhanced data table page.
 
-    This Flask route handler generates an interactive table view of air quality data.
-    It retrieves filtered data from the database, converts it to a Plotly table,
-    and renders it as HTML in the template.
+    This Flask route handler renders the table page with an empty, styled Plotly table.
+    The rows are loaded lazily in the browser from the /api/measurements endpoint, one
+    page at a time, and plotly.js is loaded from the cacheable /vendor/plotly.min.js asset.
+
+    Request Parameters:
+        Same filter and sort parameters as /explore, passed on to /api/measurements
 
     Returns:
         flask.Response: Rendered plotly_table.html template with the following context:
-            table (str): HTML string of the Plotly-formatted data table
+            table (str): JSON-encoded Plotly table figure with no rows
+
+    Notes:
+        - Only accepts GET requests
+        - Uses basic_table() for Plotly table formatting, built once in the render pool and cached
+        - Pages through the data with the same keyset cursors as /explore
+    """
+    def build():
+        if not render_pool.enabled:
+            with stage("figure"):
+                table_data = basic_table(data=[])
+            with stage("serialize"):
+                return table_data.to_json()
+        with stage("render_pool"):
+            return render_pool.render(("table",), render_table)
+
+    # Create the table - styling and headers only, the data is fetched by the page
+    try:
+        table_json = table_cache.get_or_build("table", 0, build)
+    except (RenderPoolBusy, RenderTimeout) as e:
+        logger.warning(f"Table not rendered: {e}")
+        return Response("The table is busy, try again shortly", status=503, mimetype="text/plain",
+                        headers=render_busy_headers())
+
+    return render_template("plotly_table.html", table=table_json)
+
+
+@app.route("/api/measurements", methods=["GET"])
+def api_measurements():
+    """Return one page of filtered air quality measurements as JSON.
+
+    Backs the Plotly table page. Takes the same filter, sort and paging parameters as
+    /explore and returns the rows column by column, ready to drop into a Plotly table.
+
+    Request Parameters:
+        main_location (str, optional): Name of the main location to filter by
+        sub_location (str, optional): Name of the sub-location to filter by
+        pollutant (str, optional): Name of the pollutant to filter by
+        num_records (str, optional): Number of records per page, 1 to 10000 (default: "100")
+        sort_order (str, optional): Sort direction for results ("asc" or "desc", default: "desc")
+        after (str, optional): Keyset cursor - return the page after this record
+        before (str, optional): Keyset cursor - return the page before this record
+
+    Returns:
+        flask.Response: JSON object with the following fields:
+            columns (list[str]): Column names
+            values (list[list]): One list of values per column
+            prev (str|None): Cursor for the previous page, None on the first page
+            next (str|None): Cursor for the next page, None on the last page
 
     Notes:
         - Only accepts GET requests
-        - Retrieves up to 10,000 records from the database
-        - Uses basic_table() for Plotly table formatting
-        - Returns a partial HTML string that doesn't include the full HTML document
     """
-    # DB connection
     db = get_db()
-    # get data for the table
-    data = get_filtered_results(db, limit=10000)
+    rows, prev_cursor, next_cursor = get_filtered_page(
+        db,
+        store=current_series_store(db, get_data_version(db)),
+        main_location=request.args.get("main_location"),
+        sub_location=request.args.get("sub_location"),
+        pollutant=request.args.get("pollutant"),
+        limit=parse_num_records(request.args.get("num_records"), default=100),
+        sort=request.args.get("sort_order", "desc"),
+        after=decode_cursor(request.args.get("after")),
+        before=decode_cursor(request.args.get("before")),
+    )
 
-    # Create the table
-    table_data = basic_table(data=data)
+    with stage("serialize"):
+        return jsonify(columns=TABLE_COLUMNS, values=table_columns(rows), prev=prev_cursor, next=next_cursor)
 
-    # Convert table to HTML
-    table_html = table_data.to_html(
-        full_html=False,
-        include_plotlyjs=True,
+
+@app.route("/api/air-quality", methods=["GET"])
+def api_air_quality():
+    """Return the air quality summary of the filtered series as JSON.
+
+    For each location/pollutant series: the DAQI running mean and index for the latest day, the
+    latest year's annual mean against its limit value, and the number of times the short term
+    objective was exceeded that year.
+
+    Request Parameters:
+        main_location (str, optional): Name of the main location to filter by
+        sub_location (str, optional): Name of the sub-location to filter by
+        pollutant (str, optional): Name of the pollutant to filter by
+
+    Returns:
+        flask.Response: JSON object with the following fields:
+            series (list[dict]): One record per series, see analytics.air_quality_summary()
+
+    Notes:
+        - Only accepts GET requests
+        - Cached per filter selection until the data version changes
+    """
+    db = get_db()
+    air_quality = current_air_quality(
+        db,
+        get_data_version(db),
+        main_location=request.args.get("main_location"),
+        sub_location=request.args.get("sub_location"),
+        pollutant=request.args.get("pollutant"),
     )
+    return jsonify(series=air_quality)
+
+
+@app.route("/api/datasets", methods=["GET"])
+def api_datasets():
+    """Return the size and date range of every dataset as JSON.
+
+    Reads every region's database in one query, with the other databases attached to an Oxford
+    connection (see attach_datasets()).
+
+    Returns:
+        flask.Response: JSON object with the following fields:
+            datasets (list[dict]): Per dataset - dataset, series, measurements, first_measured_at
+            and last_measured_at
+
+    Notes:
+        - Only accepts GET requests
+        - Datasets whose database hasn't been created yet are left out
+    """
+    db = acquire_db()
+    try:
+        datasets = get_dataset_summary(db)
+    finally:
+        # Closed rather than pooled, as it has the other databases attached
+        release_db(db)
+    return jsonify(datasets=datasets)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Return the request and stage timings in the Prometheus text format, for scraping.
+
+    Returns:
+        flask.Response: Plain text with the following metrics:
+            airaware_request_duration_seconds: Histogram of request latency by endpoint, method and status
+            airaware_stage_duration_seconds: Histogram of time in each stage (sql_execute, sql_fetch,
+            dataframe, figure, serialize, render, ...) by endpoint
+            airaware_rows_total: Rows read by each endpoint
+            airaware_response_bytes_total: Bytes sent by each endpoint, after compression
+            airaware_render_rejections_total: Figure / table builds refused by the render pool
 
-    return render_template("plotly_table.html", table=table_html)
+    Notes:
+        - Only accepts GET requests
+        - Counts are per worker process, from when it started
+    """
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route("/vendor/plotly.min.js", methods=["GET"])
+def plotly_js():
+    """Serve the plotly.js bundle that ships with the installed plotly package.
+
+    Returns:
+        flask.Response: plotly.min.js, cacheable by the browser for a year
+
+    Notes:
+        - Templates link to it with the plotly version in the query string, so upgrading
+          plotly gives a new URL and browsers fetch the new bundle
+        - Read into the response rather than passed straight through so it can be compressed -
+          the compressed copy is kept and reused
+    """
+    response = send_file(plotly_js_path(), mimetype="text/javascript", max_age=60 * 60 * 24 * 365)
+    response.direct_passthrough = False
+    return response
 
 
 @app.route("/download", methods=["GET"])
-def download(file_name: str = "Oxford"):
-    """Generate and serve a CSV download of filtered air quality data.
+def download(file_name: str = None):
+    """Stream a CSV, Parquet or Arrow download of filtered air quality data.
 
-    This Flask route handler retrieves filtered data based on URL parameters,
-    converts it to CSV format, and serves it as a downloadable file. The file
-    name includes the location and current date.
+    This Flask route handler retrieves filtered data based on URL parameters and
+    streams it to the client as a downloadable file. Rows are read from the
+    database cursor in chunks and encoded as they go, so the whole export is never
+    held in memory. The file name includes the location and current date.
 
     Args:
-        file_name (str, optional): Base name for the downloaded file. Defaults to "Oxford".
+        file_name (str, optional): Base name for the downloaded file. Defaults to the dataset, e.g. "Oxford".
 
     Request Parameters:
         main_location (str, optional): Main location to filter by
         sub_location (str, optional): Sub-location to filter by
         pollutant (str, optional): Pollutant type to filter by
+        sort_order (str, optional): Sort direction for results ("asc" or "desc", default: "desc")
+        format (str, optional): File format - "csv", "parquet" or "arrow" (default: "csv")
 
     Returns:
-        flask.Response: CSV file download response with the filtered data, or
+        flask.Response: Streamed file download response with the filtered data, or
         flask.Response: Redirect to explore page if download fails
 
     Notes:
         - Only accepts GET requests
-        - Filename format: "Air Quality Data for: {file_name}_{YYYY-MM-DD}"
+        - Filename format: "Air Quality Data for: {file_name}_{YYYY-MM-DD}.{csv|parquet|arrow}"
         - Returns all matching records without pagination
-        - Redirects to explore page on any error
-        - Requires database connection and working CSV generation
+        - Parquet and Arrow files have typed value and date columns and dictionary encoded names,
+          written a row group / record batch of ARROW_BATCH_ROWS rows at a time. They need pyarrow.
+        - Redirects to explore page, keeping the filters and showing why, if the query fails before
+          streaming starts, or the format is unknown or unavailable
+        - The explore page starts background exports instead (see start_export()), this is the
+          fallback without JavaScript and for direct links
+        - Uses its own db connection, as the request one is closed before the stream finishes
     """
 
     timestamp = datetime.today().strftime("%Y-%m-%d")
+    db = None
     try:
-        # Open the db connection
-        db = get_db()
+        # Take a db connection that lives for as long as the stream
+        db = acquire_db(current_dataset())
 
         # Create filters group for passing to the db query
         filters = {
             "main_location": request.args.get("main_location"),
             "sub_location": request.args.get("sub_location"),
             "pollutant": request.args.get("pollutant"),
+            "sort": request.args.get("sort_order", "desc"),
         }
 
-        # send the query to the db & then generate the csv for downloading
-        query_data = get_filtered_results(db=db, **filters)
-        download_data = generate_csv(query_data=query_data)
+        file_format = request.args.get("format", "csv").lower()
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown download format: {file_format}")
+        mimetype, extension = EXPORT_FORMATS[file_format]
+
+        # send the query to the db & then stream the file out a chunk of rows at a time
+        if file_format == "csv":
+            row_chunks = iter_filtered_results(db=db, **filters)
+            file_data = stream_csv(row_chunks)
+        else:
+            row_chunks = iter_filtered_results(db=db, chunk_size=ARROW_BATCH_ROWS, **filters)
+            file_data = stream_arrow(row_chunks, file_format)
+        download_name = f"Air Quality Data for: {file_name or db.dataset.title()}_{timestamp}{extension}"
+
+        def generate(db=db):
+            try:
+                yield from file_data
+            finally:
+                # Finish with the query before the connection goes back to the pool
+                file_data.close()
+                row_chunks.close()
+                release_db(db)
 
         # return the download with filename
-        return send_file(download_data,
-                         mimetype="text/csv",
-                         as_attachment=True,
-                         download_name=f"Air Quality Data for: {file_name}_{timestamp}",
-                         )
+        return Response(generate(),
+                        mimetype=mimetype,
+                        headers={"Content-Disposition": f'attachment; filename="{download_name}"'},
+                        )
 
     except Exception as e:
-        print(f"Data Download Failed with code: {e}")
-        return redirect(url_for("explore"))
+        logger.exception("Download failed")
+        if db is not None:
+            release_db(db)
+        flash(f"Download failed: {e}")
+        return redirect(url_for("explore", **request.args))
+
+
+def export_response(job):
+    """JSON status of an export job, with the links to poll it and download it once it's done."""
+    job = dict(job, status_url=url_for("export_status", job_id=job["id"]))
+    job["download_url"] = url_for("export_file", job_id=job["id"]) if job["status"] == "done" else None
+    return job
+
+
+@app.route("/exports", methods=["POST"])
+def start_export():
+    """Start a background export of filtered air quality data, or reuse a matching one.
+
+    The export is written to a file by a background thread while the client polls its status
+    from /exports/<job_id>, then downloads it from /exports/<job_id>/file.
+
+    Request Parameters:
+        Same filter, sort, format and dataset parameters as /download, in the query string
+
+    Returns:
+        flask.Response: JSON status of the export (see export_status()), with a 202 status while
+        it's being written or a 200 status if a finished export of the same data was reused, or
+        flask.Response: JSON error message with a 400 status if the format is unknown
+
+    Notes:
+        - Only accepts POST requests
+        - Exports are identified by dataset, data version, filters and format, so the same export
+          is written once and shared until ingest changes the data
+    """
+    db = get_db()
+    filters = {
+        "main_location": request.args.get("main_location"),
+        "sub_location": request.args.get("sub_location"),
+        "pollutant": request.args.get("pollutant"),
+        "sort": request.args.get("sort_order", "desc"),
+    }
+    try:
+        job = export_jobs.start(db.dataset, get_data_version(db), filters,
+                                request.args.get("format", "csv").lower())
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    job = export_response(job)
+    return jsonify(job), 200 if job["status"] == "done" else 202, {"Location": job["status_url"]}
+
+
+@app.route("/exports/<job_id>", methods=["GET"])
+def export_status(job_id):
+    """Return the progress of an export started with POST /exports.
+
+    Returns:
+        flask.Response: JSON object with the following fields:
+            id (str): Export id
+            status (str): "queued", "running", "done" or "failed"
+            rows (int): Rows written so far
+            total_rows (int|None): Rows in the export, None until they have been counted
+            progress (float): Fraction of the rows written, 0 to 1
+            error (str|None): Why the export failed
+            status_url (str): This status
+            download_url (str|None): Where to download the file, once the export is done
+        or a JSON error message with a 404 status if there's no such export or it has expired
+
+    Notes:
+        - Only accepts GET requests
+        - Never cached, the status changes as the export runs
+    """
+    job = export_jobs.status(job_id)
+    if job is None:
+        return jsonify(error="Unknown or expired export"), 404
+    response = jsonify(export_response(job))
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+@app.route("/exports/<job_id>/file", methods=["GET"])
+def export_file(job_id):
+    """Download the file of a finished export.
+
+    Returns:
+        flask.Response: The export file as an attachment, named as /download names it, or
+        flask.Response: JSON error message with a 404 status if the export isn't finished or has expired
+
+    Notes:
+        - Only accepts GET requests
+        - Served from disk with conditional and range request support
+    """
+    finished = export_jobs.finished(job_id)
+    if finished is None:
+        return jsonify(error="Export not finished, or expired"), 404
+
+    job, path = finished
+    mimetype, extension = EXPORT_FORMATS[job["format"]]
+    timestamp = datetime.today().strftime("%Y-%m-%d")
+    try:
+        return send_file(path, mimetype=mimetype, as_attachment=True,
+                         download_name=f"Air Quality Data for: {job['dataset'].title()}_{timestamp}{extension}",
+                         max_age=0)
+    except FileNotFoundError:
+        # Expired since the status was read
+        return jsonify(error="Export not finished, or expired"), 404
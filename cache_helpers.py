@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class DataVersionCache:
+    """Bounded, thread-safe LRU cache for values built from the database.
+
+    Every entry belongs to the data version it was built from (see get_data_version()).
+    When a lookup arrives with a newer data version all the old entries are dropped, so
+    nothing is served from before the last ingest. Once max_entries is reached the least
+    recently used entry is evicted.
+
+    Args:
+        max_entries (int, optional): Maximum number of entries held. Defaults to 32.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._data_version = None
+        self._lock = Lock()
+
+    def get(self, key, data_version):
+        """Return the cached value for key, or None if it isn't cached for this data version."""
+        with self._lock:
+            self._check_version(data_version)
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, data_version, value):
+        """Cache value for key against the data version it was built from."""
+        with self._lock:
+            self._check_version(data_version)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_build(self, key, data_version, build):
+        """Return the cached value for key, calling build() to create and cache it on a miss.
+
+        Notes:
+            - build() runs outside the lock, so two concurrent misses may both build the value
+        """
+        value = self.get(key, data_version)
+        if value is None:
+            value = build()
+            self.set(key, data_version, value)
+        return value
+
+    def clear(self):
+        """Drop every cached entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def _check_version(self, data_version):
+        # Caller holds the lock - drop everything built from an older version of the data
+        if data_version != self._data_version:
+            self._entries.clear()
+            self._data_version = data_version
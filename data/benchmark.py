@@ -0,0 +1,332 @@
+"""Benchmarks for the query, figure and export hot paths.
+
+Builds dummy databases at several scales with dummy_data_generation.py (cached in data/bench/ and
+reused between runs), then times each path against them: the filtered measurement queries, each
+stage of the graph build, the Plotly table and the CSV export. The median wall time and peak memory
+of every case are written to a JSON file and compared against a stored baseline - the run fails if
+any case got slower or bigger than the baseline by more than the tolerance.
+
+Run from the project root:
+    python -m data.benchmark                                  (every scale, compared to the baseline)
+    python -m data.benchmark --scales 100k 1m --repeat 5
+    python -m data.benchmark --save-baseline                  (record the baseline to compare against)
+
+Timings depend on the machine, so record the baseline on the machine the comparison runs on.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import plotly
+
+from database_helpers import READ_PRAGMAS, generate_csv, get_data_version, get_filtered_results
+from graphing import daily_means_frame, figure_spec, figure_spec_json, orjson, query_daily_means, series_groups
+from series_store import SeriesStore
+from table_helpers import basic_table
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(DATA_DIR, "bench")
+DEFAULT_OUTPUT_PATH = os.path.join(BENCH_DIR, "results.json")
+DEFAULT_BASELINE_PATH = os.path.join(DATA_DIR, "benchmark_baseline.json")
+
+# Hourly dummy data from 2023-01-01 - sites x pollutants x hours, less the sites without Ozone
+SCALES = {
+    "100k": {"sites": 4, "pollutants": 3, "years": 1},     # 105,120 rows
+    "1m": {"sites": 23, "pollutants": 5, "years": 1},      # 1,007,400 rows
+    "10m": {"sites": 50, "pollutants": 12, "years": 2},    # 9,666,744 rows
+}
+SEED = 1
+
+# Filter combinations timed for get_filtered_results - names from the dummy reference data
+FILTERS = [
+    {},
+    {"main_location": "Oxford"},
+    {"main_location": "Oxford", "sub_location": "High Street"},
+    {"pollutant": "Nitrogen dioxide"},
+    {"main_location": "Oxford", "sub_location": "High Street", "pollutant": "Nitrogen dioxide"},
+]
+SORT_ORDERS = ["DESC", "ASC"]
+# Default explore page and the largest page the routes allow
+LIMITS = [14, 10000]
+# Rows in the Plotly table and the CSV export
+TABLE_ROWS = 1000
+CSV_ROWS = 100000
+
+DEFAULT_REPEAT = 7
+# A case regresses when it is this much slower / bigger than the baseline...
+DEFAULT_TOLERANCE = 0.25
+# ...and by more than these, so timer noise on fast cases isn't reported
+MIN_SECONDS_DELTA = 0.005
+MIN_BYTES_DELTA = 1024 * 1024
+
+
+def bench_db_path(scale: str):
+    """Path of the generated db for a scale - its name holds the settings it was built with"""
+    settings = SCALES[scale]
+    return os.path.join(BENCH_DIR, f"bench-{scale}-s{settings['sites']}-p{settings['pollutants']}"
+                                   f"-y{settings['years']}-seed{SEED}.db")
+
+
+def build_bench_db(scale: str, regenerate: bool = False):
+    """Create the db for a scale with db_setup.py and dummy_data_generation.py, unless it exists
+
+    Returns:
+        str: Path to the db
+    """
+    path = bench_db_path(scale)
+    if os.path.exists(path) and not regenerate:
+        return path
+
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    settings = SCALES[scale]
+    print(f"Generating the {scale} db ...")
+    start = time.perf_counter()
+    # The data scripts run from the data directory, like they are run by hand
+    subprocess.run([sys.executable, "db_setup.py", path], cwd=DATA_DIR, check=True, stdout=subprocess.DEVNULL)
+    subprocess.run([sys.executable, "dummy_data_generation.py", "--db", path, "--start", "2023-01-01",
+                    "--years", str(settings["years"]), "--frequency", "hourly", "--sites", str(settings["sites"]),
+                    "--pollutants", str(settings["pollutants"]), "--seed", str(SEED), "--rebuild-indexes"],
+                   cwd=DATA_DIR, check=True, stdout=subprocess.DEVNULL)
+
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+        # Checkpoint so the benchmarks read from the db file rather than a large WAL
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    if rows == 0:
+        os.remove(path)
+        raise RuntimeError(f"Generating the {scale} db added no measurements")
+    print(f"Generated {rows:,} measurements in {time.perf_counter() - start:.1f}s")
+    return path
+
+
+def connect_bench_db(path: str):
+    """Open a read connection set up the same way as the app's (see connect_db())"""
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    for pragma in READ_PRAGMAS:
+        db.execute(pragma)
+    return db
+
+
+def filter_label(filters: dict):
+    """Short name for a filter combination, e.g. 'main_location+pollutant' or 'none'"""
+    return "+".join(filters) or "none"
+
+
+def bench_cases(db):
+    """The cases to time against a db, in order
+
+    Each case's inputs are built before it is timed, so each graph stage is timed on its own.
+
+    Yields:
+        tuple[str, callable]: Case name and a function running it once
+    """
+    for filters, sort, limit in itertools.product(FILTERS, SORT_ORDERS, LIMITS):
+        yield (f"query.{filter_label(filters)}.{sort.lower()}.{limit}",
+               lambda filters=filters, sort=sort, limit=limit:
+               get_filtered_results(db, limit=limit, sort=sort, **filters))
+
+    # Graph build from the rollups, a stage at a time
+    yield "graph.query", lambda: query_daily_means(db)
+    rows = query_daily_means(db)
+    yield "graph.dataframe", lambda: daily_means_frame(rows)
+    df = daily_means_frame(rows)
+    yield "graph.series_groups", lambda: series_groups(df)
+    groups = series_groups(df)
+    yield "graph.figure_spec", lambda: figure_spec(df, *groups)
+    spec = figure_spec(df, *groups)
+    yield "graph.json", lambda: figure_spec_json(spec)
+    del rows, groups, spec
+
+    # The app's default source for the graph data - the in-memory series store
+    store = SeriesStore()
+    store.refresh(db, get_data_version(db))
+    yield "graph.store_daily_means", lambda: store.daily_means()
+    del store
+
+    table_data = get_filtered_results(db, limit=TABLE_ROWS)
+    yield "table.basic_table", lambda: basic_table(table_data)
+    table = basic_table(table_data)
+    yield "table.to_html", lambda: table.to_html(full_html=False, include_plotlyjs=False)
+    del table_data, table
+
+    yield "csv.query", lambda: get_filtered_results(db, limit=CSV_ROWS)
+    csv_data = get_filtered_results(db, limit=CSV_ROWS)
+    yield "csv.generate_csv", lambda: generate_csv(csv_data)
+
+
+def time_case(run, repeat: int):
+    """Time a case and measure its peak memory
+
+    Runs it once to warm up, repeat times for the timings, then once more under tracemalloc for
+    the peak - tracing slows the code down, so it isn't timed.
+
+    Returns:
+        dict: seconds (median), min_seconds, repeat and peak_bytes
+    """
+    run()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+
+    # Peak of Python allocations, NumPy / pandas buffers included - SQLite's page cache isn't counted
+    tracemalloc.start()
+    try:
+        run()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "repeat": repeat,
+        "peak_bytes": peak_bytes,
+    }
+
+
+def run_scale(scale: str, repeat: int = DEFAULT_REPEAT, regenerate: bool = False):
+    """Build (or reuse) the db for a scale and time every case against it
+
+    Returns:
+        dict: rows and {case name: timings}
+    """
+    path = build_bench_db(scale, regenerate)
+    db = connect_bench_db(path)
+    try:
+        rows = db.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+        print(f"\n{scale} ({rows:,} rows)")
+        cases = {}
+        for name, run in bench_cases(db):
+            cases[name] = time_case(run, repeat)
+            print(f"  {name:<52} {cases[name]['seconds'] * 1000:>10.2f} ms "
+                  f"{cases[name]['peak_bytes'] / 1024 / 1024:>9.1f} MB")
+    finally:
+        db.close()
+    return {"rows": rows, "cases": cases}
+
+
+def environment():
+    """Details of the machine and packages the benchmarks ran with"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=DATA_DIR).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "sqlite": sqlite3.sqlite_version,
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "plotly": plotly.__version__,
+        # The graph JSON is serialised with orjson when it's installed, which changes graph.json
+        "orjson": orjson.__version__ if orjson is not None else None,
+    }
+
+
+def compare(results, baseline, tolerance: float = DEFAULT_TOLERANCE):
+    """Compare results against a baseline, case by case
+
+    Only cases in both are compared, so adding a case or a scale doesn't fail the comparison.
+
+    Returns:
+        list[str]: Description of each regression, empty if there are none
+    """
+    regressions = []
+    for scale, scale_results in results["scales"].items():
+        baseline_cases = baseline.get("scales", {}).get(scale, {}).get("cases", {})
+        for name, case in scale_results["cases"].items():
+            base = baseline_cases.get(name)
+            if base is None:
+                continue
+            if (case["seconds"] > base["seconds"] * (1 + tolerance)
+                    and case["seconds"] - base["seconds"] > MIN_SECONDS_DELTA):
+                regressions.append(f"{scale} {name}: {base['seconds'] * 1000:.2f} ms -> "
+                                   f"{case['seconds'] * 1000:.2f} ms")
+            if (case["peak_bytes"] > base["peak_bytes"] * (1 + tolerance)
+                    and case["peak_bytes"] - base["peak_bytes"] > MIN_BYTES_DELTA):
+                regressions.append(f"{scale} {name}: peak {base['peak_bytes'] / 1024 / 1024:.1f} MB -> "
+                                   f"{case['peak_bytes'] / 1024 / 1024:.1f} MB")
+    return regressions
+
+
+def write_json(path: str, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, mode="w") as json_file:
+        json.dump(data, json_file, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the query, figure and export hot paths")
+    parser.add_argument("--scales", nargs="+", choices=SCALES, default=list(SCALES),
+                        help=f"Database sizes to run (default: {' '.join(SCALES)})")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"Timed runs of each case, the median is kept (default: {DEFAULT_REPEAT})")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH, help="Where to write the results JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Allowed slow down / growth over the baseline, e.g. 0.25 (default: {DEFAULT_TOLERANCE})")
+    parser.add_argument("--regenerate", action="store_true", help="Rebuild the benchmark dbs even if they exist")
+    args = parser.parse_args()
+
+    results = {"environment": environment(), "scales": {}}
+    for scale in args.scales:
+        results["scales"][scale] = run_scale(scale, args.repeat, args.regenerate)
+
+    write_json(args.output, results)
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        write_json(args.baseline, results)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline} - run with --save-baseline to record one")
+        return
+
+    with open(args.baseline, mode="r") as baseline_file:
+        baseline = json.load(baseline_file)
+    for key in ("python", "platform", "cpu_count"):
+        if baseline["environment"].get(key) != results["environment"][key]:
+            print(f"Warning: baseline {key} was {baseline['environment'].get(key)!r}, "
+                  f"now {results['environment'][key]!r} - timings may not be comparable")
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"Benchmark check FAILED - {len(regressions)} regression(s) against {args.baseline}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+    print(f"Benchmark check passed against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Import time budget check for the app and the data scripts.
+
+Imports each module in a fresh interpreter with 'python -X importtime' and fails if it takes longer
+than its budget, or if it pulls in one of the heavy libraries that should only be imported when first
+used (plotly and pandas on the first graph / table, pyarrow on the first Parquet / Arrow download).
+Worker cold starts - and how quickly new workers can be added under load - depend on both.
+
+The imports run from an empty temporary directory, so the app finds no database and skips loading the
+series store - only the imports themselves are timed.
+
+Run from the project root:
+    python -m data.check_import_time
+    python -m data.check_import_time --runs 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds allowed to import each module, taking the fastest of the runs. Generous enough for a slow
+# CI machine - the heavy libraries below add more than a second between them.
+IMPORT_BUDGETS = {
+    "app": 0.75,
+    "data.export_snapshot": 0.5,
+}
+
+# Libraries that must not be imported at start up - they are imported where they are used
+LAZY_MODULES = ("dash", "pandas", "plotly", "pyarrow", "aiohttp")
+
+DEFAULT_RUNS = 3
+
+
+def parse_importtime(output: str):
+    """Parse the stderr of 'python -X importtime'
+
+    Returns:
+        dict: {module name: cumulative seconds} for every module imported
+    """
+    imported = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # The header line
+        # The same module is only listed once - the first time it's imported
+        imported[name.strip()] = int(cumulative) / 1_000_000
+    return imported
+
+
+def time_import(module: str, runs: int = DEFAULT_RUNS):
+    """Import a module in a fresh interpreter runs times
+
+    Returns:
+        tuple[float, set[str]]: Fastest import time in seconds, and the modules it imported
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PROJECT_ROOT, os.environ.get("PYTHONPATH")])))
+    best = None
+    imported = set()
+    with tempfile.TemporaryDirectory() as working_dir:
+        for _ in range(runs):
+            result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                    cwd=working_dir, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+            times = parse_importtime(result.stderr)
+            best = times[module] if best is None else min(best, times[module])
+            imported = set(times)
+    return best, imported
+
+
+def check_import_time(runs: int = DEFAULT_RUNS):
+    """Check every module in IMPORT_BUDGETS
+
+    Returns:
+        list[str]: Description of each failure, empty if all passed
+    """
+    failures = []
+    for module, budget in IMPORT_BUDGETS.items():
+        seconds, imported = time_import(module, runs)
+        print(f"  {module:<24} {seconds * 1000:>8.1f} ms (budget {budget * 1000:.0f} ms)")
+        if seconds > budget:
+            failures.append(f"{module} took {seconds * 1000:.1f} ms to import, over its {budget * 1000:.0f} ms budget")
+
+        eager = sorted(name for name in imported if name in LAZY_MODULES)
+        if eager:
+            failures.append(f"{module} imports {', '.join(eager)} at start up - import where used instead")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the app and data scripts import within their budgets")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS,
+                        help=f"Imports of each module, the fastest is kept (default: {DEFAULT_RUNS})")
+    args = parser.parse_args()
+
+    failures = check_import_time(args.runs)
+    if failures:
+        print("Import time check FAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+    print("Import time check passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Rollback check for the bulk loads that drop the measurements indexes.
+
+Runs each load with rebuild_indexes (ingest_wide_csv.py and dummy_data_generation.py) on a fresh
+in-memory db, makes it fail part way through, and fails if the schema (sqlite_master - indexes
+included) or the measurements aren't back to how they were before the load.
+
+Run from the data directory, same as db_setup.py:
+    python check_ingest_rollback.py
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+import dummy_data_generation
+from db_migrate import migrate
+from ingest_wide_csv import ingest_wide_csv
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_schema.sql")
+
+# A wide export whose second row has a date that can't be parsed - the first row is inserted
+# before the load fails on it
+BAD_CSV = (
+    "Date,Oxford High Street/ Nitric Oxide,Oxford High Street/ Nitric Oxide/ Status\n"
+    "01/01/2024,12.5,P µg/m³\n"
+    "2024-01-02,13.5,P µg/m³\n"
+)
+
+
+def build_test_db():
+    """Create an in-memory db with the current schema"""
+    conn = sqlite3.connect(":memory:")
+    with open(SCHEMA_PATH, mode="r") as sql_schema_file:
+        conn.executescript(sql_schema_file.read())
+    migrate(conn)
+    return conn
+
+
+def db_state(conn):
+    """Everything a failed load must leave unchanged - the schema and the number of measurements"""
+    schema = conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name").fetchall()
+    measurements = conn.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+    return schema, measurements
+
+
+def check_wide_csv_rollback(conn):
+    """Check a failed ingest_wide_csv() load with rebuild_indexes leaves the db as it was
+
+    Returns:
+        list[str]: Description of each failure, empty if the check passed
+    """
+    before = db_state(conn)
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".csv", encoding="utf-8", delete=False) as csv_file:
+        csv_file.write(BAD_CSV)
+    try:
+        ingest_wide_csv(conn, csv_file.name, chunk_size=1, rebuild_indexes=True)
+    except ValueError:
+        pass  # The bad date
+    else:
+        return ["ingest_wide_csv: the load with a bad date didn't fail"]
+    finally:
+        os.remove(csv_file.name)
+    return describe_changes("ingest_wide_csv", before, db_state(conn))
+
+
+def check_dummy_data_rollback(conn):
+    """Check a generate_measurements() load with rebuild_indexes that fails before committing,
+    once it's rolled back, leaves the db as it was
+
+    The failure is injected in the rollups update, after the indexes have been recreated.
+
+    Returns:
+        list[str]: Description of each failure, empty if the check passed
+    """
+    dummy_data_generation.insert_initial_data(conn)
+    conn.commit()
+    before = db_state(conn)
+
+    def fail_rollups(conn):
+        raise RuntimeError("Rollups update failed")
+
+    update_rollups = dummy_data_generation.update_rollups
+    dummy_data_generation.update_rollups = fail_rollups
+    try:
+        dummy_data_generation.generate_measurements(conn, datetime(2024, 1, 1), datetime(2024, 1, 7), seed=1,
+                                                    rebuild_indexes=True)
+    except RuntimeError:
+        conn.rollback()  # As main() does
+    else:
+        return ["dummy_data_generation: the load with a failing rollups update didn't fail"]
+    finally:
+        dummy_data_generation.update_rollups = update_rollups
+    return describe_changes("dummy_data_generation", before, db_state(conn))
+
+
+def describe_changes(load, before, after):
+    """Describe how the db state after a failed load differs from before it"""
+    failures = []
+    if after[0] != before[0]:
+        missing = sorted(name for _, name, _ in set(before[0]) - set(after[0]))
+        added = sorted(name for _, name, _ in set(after[0]) - set(before[0]))
+        failures.append(f"{load}: schema changed by a failed load - missing {missing}, added {added}")
+    if after[1] != before[1]:
+        failures.append(f"{load}: {after[1] - before[1]} measurement(s) left by a failed load")
+    return failures
+
+
+def main():
+    failures = []
+    for check in (check_wide_csv_rollback, check_dummy_data_rollback):
+        conn = build_test_db()
+        try:
+            failures.extend(check(conn))
+        finally:
+            conn.close()
+
+    if failures:
+        print("Ingest rollback check FAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+    print("Ingest rollback check passed")
+
+
+if __name__ == "__main__":
+    main()
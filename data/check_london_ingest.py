@@ -0,0 +1,153 @@
+"""End to end check of ingest_london_api.py against the local API stub (london_api_stub.py).
+
+Serves the sample responses plus a few generated sites on an ephemeral port, with a share of the
+requests failing with a 503 so the retries are exercised, and loads them into a fresh in-memory db.
+Fails if any request is given up on, the measurements or rollups loaded don't match the responses,
+or loading the same dates again inserts anything.
+
+Run from the data directory, same as db_setup.py:
+    python check_london_ingest.py
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+from datetime import date
+from http.server import ThreadingHTTPServer
+
+from db_migrate import migrate
+from ingest_london_api import SPECIES_POLLUTANTS, ingest_london_api
+from london_api_stub import GENERATED_SPECIES, add_generated_sites, generated_readings, load_stub_responses, \
+    make_handler
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_schema.sql")
+
+# The sample responses hold 2024-01-01 and 2024-01-02 only - the generated sites fill the rest of
+# the week, over several request windows
+START_DATE = date(2024, 1, 1)
+END_DATE = date(2024, 1, 8)
+WINDOW_DAYS = 3
+GENERATED_SITES = 3
+# Share of requests answered with a 503 - low enough that none fail every retry
+FAIL_RATE = 0.1
+
+
+def build_test_db():
+    """Create an in-memory db with the current schema"""
+    conn = sqlite3.connect(":memory:")
+    with open(SCHEMA_PATH, mode="r") as sql_schema_file:
+        conn.executescript(sql_schema_file.read())
+    migrate(conn)
+    return conn
+
+
+def start_stub_server(sites, readings):
+    """Serve the stub on an ephemeral port in a background thread
+
+    Returns:
+        tuple[ThreadingHTTPServer, str, list]: The server, its API root and a list the 503s served
+        are appended to
+    """
+    failures = []
+
+    class CountingHandler(make_handler(sites, readings, GENERATED_SITES, fail_rate=FAIL_RATE)):
+        def send_json(self, payload, status: int = 200):
+            if status == 503:
+                failures.append(self.path)
+            super().send_json(payload, status)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+    threading.Thread(target=server.serve_forever, name="london-api-stub", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/AirQuality", failures
+
+
+def expected_readings(sites, readings):
+    """The (site, species, measured_at) of every reading the stub serves for the dates loaded
+
+    The sample series only have readings for their sample days, and sites that had closed by then
+    (Ealing) have none at all - so this is built from the responses rather than assumed.
+    """
+    served = set()
+    for site in sites["Sites"]["Site"]:
+        for species in site["Species"] if isinstance(site["Species"], list) else [site["Species"]]:
+            code = species["@SpeciesCode"]
+            if code not in SPECIES_POLLUTANTS:
+                continue
+            if (site["@SiteCode"], code) in readings:
+                series_readings = readings[(site["@SiteCode"], code)]
+            elif site["@SiteCode"].startswith("GEN") and code in GENERATED_SPECIES:
+                series_readings = generated_readings(site["@SiteCode"], code, START_DATE, END_DATE)
+            else:
+                continue
+            served.update((site["@SiteCode"], code, reading["@MeasurementDateGMT"]) for reading in series_readings
+                          if reading["@Value"] != ""
+                          and START_DATE.isoformat() <= reading["@MeasurementDateGMT"][:10] < END_DATE.isoformat())
+    return served
+
+
+def db_counts(conn):
+    """Measurements, day rollups and measurements counted by the rollups of each period"""
+    measurements = conn.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+    day_rollups = conn.execute("SELECT COUNT(*) FROM measurement_rollups WHERE period = 'day'").fetchone()[0]
+    rolled_up = dict(conn.execute("SELECT period, SUM(count) FROM measurement_rollups GROUP BY period"))
+    return measurements, day_rollups, rolled_up
+
+
+def check_london_ingest(conn, base_url, served):
+    """Load the stub's responses twice, checking what the first load inserts and that the second is a no-op
+
+    Returns:
+        list[str]: Description of each failure, empty if the check passed
+    """
+    failures = []
+    inserted, _, failed = asyncio.run(ingest_london_api(conn, START_DATE, END_DATE, base_url=base_url,
+                                                        concurrency=4, window_days=WINDOW_DAYS))
+    if failed:
+        failures.append(f"{len(failed)} request(s) failed after every retry: {failed}")
+
+    measurements, day_rollups, rolled_up = db_counts(conn)
+    expected_days = len({(site, species, measured_at[:10]) for site, species, measured_at in served})
+    if inserted != len(served) or measurements != len(served):
+        failures.append(f"first load: {inserted} inserted, {measurements} held, {len(served)} expected")
+    if day_rollups != expected_days:
+        failures.append(f"first load: {day_rollups} day rollups, {expected_days} expected")
+    for period, count in rolled_up.items():
+        if count != measurements:
+            failures.append(f"first load: {period} rollups count {count} measurements, {measurements} held")
+
+    inserted, _, failed = asyncio.run(ingest_london_api(conn, START_DATE, END_DATE, base_url=base_url,
+                                                        concurrency=4, window_days=WINDOW_DAYS))
+    if failed:
+        failures.append(f"{len(failed)} request(s) failed after every retry on the second load: {failed}")
+    if inserted or db_counts(conn) != (measurements, day_rollups, rolled_up):
+        failures.append(f"second load of the same dates wasn't a no-op: {inserted} inserted")
+    return failures
+
+
+def main():
+    sites, readings = load_stub_responses()
+    add_generated_sites(sites, GENERATED_SITES)
+    server, base_url, served_503s = start_stub_server(sites, readings)
+    conn = build_test_db()
+    try:
+        failures = check_london_ingest(conn, base_url, expected_readings(sites, readings))
+    finally:
+        conn.close()
+        server.shutdown()
+        server.server_close()
+
+    if not served_503s:
+        failures.append(f"the stub didn't fail any requests at fail rate {FAIL_RATE}, so the retries weren't checked")
+
+    if failures:
+        print("London ingest check FAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+    print(f"London ingest check passed ({len(served_503s)} requests retried)")
+
+
+if __name__ == "__main__":
+    main()
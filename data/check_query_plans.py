@@ -0,0 +1,103 @@
+"""Query plan regression check for the filtered measurement queries.
+
+Runs EXPLAIN QUERY PLAN for every filter combination the /explore route allows and fails if
+SQLite falls back to a full table scan or a temp B-tree sort for any of them.
+
+Run from the project root:
+    python -m data.check_query_plans            (fresh in-memory db from the schema + migrations)
+    python -m data.check_query_plans data/air.db
+"""
+import itertools
+import os
+import sqlite3
+import sys
+
+from data.db_migrate import migrate
+from database_helpers import _build_filtered_query
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_schema.sql")
+
+# Filter values used in place of user input - "Oxford" has several sub-locations and
+# "High Street" exists under two locations, so both the single id and IN list paths are covered
+MAIN_LOCATIONS = [None, "Oxford"]
+SUB_LOCATIONS = [None, "High Street"]
+POLLUTANTS = [None, "Nitric Oxide"]
+SORT_ORDERS = ["DESC", "ASC"]
+# First page, then the next / previous pages from a keyset cursor
+CURSORS = [{}, {"after": ("2024-01-01", 100)}, {"before": ("2024-01-01", 100)}]
+
+# Plan details that mean the query has to read or sort more than the rows it returns
+BAD_PLAN_STEPS = ("USE TEMP B-TREE",)
+
+
+def build_test_db():
+    """Create an in-memory db with the current schema and a little reference data"""
+    conn = sqlite3.connect(":memory:")
+    with open(SCHEMA_PATH, mode="r") as sql_schema_file:
+        conn.executescript(sql_schema_file.read())
+    migrate(conn)
+
+    conn.executemany("INSERT INTO locations (name) VALUES (?)", [("Oxford",), ("SODC",)])
+    conn.executemany("INSERT INTO sub_locations (location_id, name) VALUES (?, ?)", [
+        (1, "High Street"),
+        (1, "St Aldates"),
+        (1, "St Ebbes"),
+        (2, "High Street"),
+    ])
+    conn.executemany("INSERT INTO pollutants (name) VALUES (?)", [("Nitric Oxide",), ("Ozone",)])
+    conn.commit()
+    return conn
+
+
+def is_full_scan(detail):
+    """Return True for a plan step that reads a whole table rather than an index"""
+    return detail.startswith("SCAN") and "USING" not in detail
+
+
+def check_query_plans(conn, limit: int = 14):
+    """Check the query plan of every filter combination
+
+    Returns:
+        list[str]: Description of each failing combination and its plan, empty if all passed
+    """
+    failures = []
+
+    for main_location, sub_location, pollutant, sort, cursor in itertools.product(
+            MAIN_LOCATIONS, SUB_LOCATIONS, POLLUTANTS, SORT_ORDERS, CURSORS):
+        query, params = _build_filtered_query(conn, main_location, sub_location, pollutant, limit, sort,
+                                              **cursor)
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+
+        bad_steps = [detail for detail in plan
+                     if is_full_scan(detail) or any(step in detail for step in BAD_PLAN_STEPS)]
+        if bad_steps:
+            failures.append(
+                f"main_location={main_location!r} sub_location={sub_location!r} "
+                f"pollutant={pollutant!r} sort={sort} cursor={cursor}: {' | '.join(plan)}"
+            )
+
+    return failures
+
+
+def main():
+    if len(sys.argv) > 1:
+        conn = sqlite3.connect(sys.argv[1])
+    else:
+        conn = build_test_db()
+
+    try:
+        failures = check_query_plans(conn)
+    finally:
+        conn.close()
+
+    if failures:
+        print("Query plan check FAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+    print("Query plan check passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+def bump_data_version(conn):
+    """Increment the db data version stored in the meta table
+
+    Should be called, in the same transaction, whenever ingest changes the data the app reads.
+    The app compares the version with the one its caches were built for and rebuilds them when
+    it has changed.
+
+    Returns:
+        int: The new data version
+    """
+    conn.execute('''
+        INSERT INTO meta (key, value) VALUES ('data_version', 1)
+        ON CONFLICT (key) DO UPDATE SET value = value + 1
+    ''')
+    return conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()[0]
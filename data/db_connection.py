@@ -0,0 +1,28 @@
+import sqlite3
+
+# Settings for the ingest / maintenance scripts' writer connection
+WRITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",     # Readers keep serving from the last commit while a load runs
+    "PRAGMA synchronous = NORMAL",   # Safe with WAL, only the last commits can be lost on power failure
+    "PRAGMA cache_size = -262144",   # 256 MB - bulk inserts and index builds
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",
+)
+
+
+def connect_writer(path: str = "air.db"):
+    """Open the writer connection used by the data scripts
+
+    Switches the db to WAL mode (stored in the file, so the app's read connections use it too) so
+    the site keeps serving while ingest writes. Waits up to 30 seconds for another writer to finish.
+
+    Args:
+        path (str, optional): Path to the db. Defaults to "air.db" (run from the data directory).
+
+    Returns:
+        sqlite3.Connection: Database connection object
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    for pragma in WRITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+
+# Migration scripts are named "<number>_<description>.sql" and applied in number order
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def pending_migrations(conn):
+    """Return the migrations that have not been applied to the db yet
+
+    The schema version is tracked with SQLite's user_version pragma, which is 0 for a db
+    created straight from db_schema.sql.
+
+    Returns:
+        list[tuple[int, str]]: (version number, path) of each pending migration, in order
+    """
+    current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    migrations = []
+    for file_name in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not file_name.endswith(".sql"):
+            continue
+        version = int(file_name.split("_", 1)[0])
+        if version > current_version:
+            migrations.append((version, os.path.join(MIGRATIONS_DIR, file_name)))
+
+    return sorted(migrations)
+
+
+def migrate(conn):
+    """Apply any pending migrations to the db
+
+    Each migration runs in its own transaction together with the user_version update, so a
+    failed migration leaves the db at the last good version.
+
+    Returns:
+        int: Number of migrations applied
+    """
+    migrations = pending_migrations(conn)
+
+    for version, path in migrations:
+        with open(path, mode="r") as migration_file:
+            script = migration_file.read()
+
+        try:
+            conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {version};\nCOMMIT;")
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        print(f"Applied migration: {os.path.basename(path)}")
+
+    return len(migrations)
+
+
+if __name__ == "__main__":
+    import sys
+    # Sibling import, as this module is also imported as data.db_migrate
+    from db_connection import connect_writer
+
+    # connect to db - run from the data directory, same as db_setup.py (e.g. 'python db_migrate.py london.db')
+    conn = connect_writer(sys.argv[1] if len(sys.argv) > 1 else "air.db")
+    try:
+        applied = migrate(conn)
+        print(f"Database migration complete - {applied} migration(s) applied")
+    finally:
+        conn.close()
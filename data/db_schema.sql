@@ -32,6 +32,7 @@ CREATE TABLE measurements (
 );
 
 -- Create indices for common query patterns
+-- NOTE: these are replaced by the composite indexes in migrations/ (applied by db_setup.py / db_migrate.py)
 CREATE INDEX idx_measurements_date ON measurements(measured_at);
 CREATE INDEX idx_measurements_location ON measurements(sub_location_id);
 CREATE INDEX idx_measurements_pollutant ON measurements(pollutant_id);
\ No newline at end of file
@@ -1,11 +1,16 @@
-import sqlite3
+import sys
+from db_connection import connect_writer
+from db_migrate import migrate
 
 
-def db_setup():
-    """Create a new db with defined schema"""
+def db_setup(path: str = "air.db"):
+    """Create a new db with defined schema
+
+    Each dataset has its own db with the same schema - air.db (Oxford), london.db (London).
+    """
 
     # connect to db
-    conn = sqlite3.connect("air.db")
+    conn = connect_writer(path)
     db = conn.cursor()
 
     # Read in the sql file so it can be used
@@ -15,11 +20,13 @@ def db_setup():
     # Execute the schema from the read in sql file
     db.executescript(schema)
 
-    # Commit the changes to the db and close
+    # Commit the changes to the db, bring the schema up to the latest version and close
     conn.commit()
+    migrate(conn)
     conn.close()
     print("Database setup Complete")
 
 
 if __name__ == "__main__":
-    db_setup()
+    # e.g. 'python db_setup.py london.db' for the London db
+    db_setup(sys.argv[1] if len(sys.argv) > 1 else "air.db")
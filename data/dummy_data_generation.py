@@ -1,7 +1,31 @@
-import sqlite3
+import argparse
+import sys
+import time
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
+from itertools import repeat
+from db_connection import connect_writer
+from ingest_wide_csv import drop_measurement_indexes
+from rollups import load_watermarks, update_rollups
+
+# Base values for different pollutants (based on sample data), by pollutant_id
+BASE_VALUES = {
+    1: 15,  # Nitric Oxide
+    2: 25,  # Nitrogen dioxide
+    3: 40,  # Oxides of Nitrogen
+    4: 10,  # PM10
+    5: 5,   # PM2.5
+    6: 50,  # Ozone
+}
+# Base value for any extra pollutants added for benchmarking
+DEFAULT_BASE_VALUE = 20
+
+# Supported sampling frequencies - pandas offset alias and measured_at format
+FREQUENCIES = {
+    "daily": ("D", "%Y-%m-%d"),
+    "hourly": ("h", "%Y-%m-%d %H:%M:%S"),
+}
 
 
 def insert_initial_data(conn):
@@ -41,92 +65,153 @@ def insert_initial_data(conn):
         conn.execute('INSERT OR IGNORE INTO pollutants (name) VALUES (?)', pollutant)
 
 
-def generate_measurement(base_value, date_factor):
-    """Generate a realistic measurement with some variation"""
-    # Add seasonal variation (higher in winter)
-    seasonal = np.sin(date_factor * 2 * np.pi + np.pi) * 10
-    # Add random noise
-    noise = np.random.normal(0, base_value * 0.2)
-    return max(1, base_value + seasonal + noise)
-
-
-def generate_measurements(conn, start_date, end_date):
-    """Generate measurements for all locations and pollutants"""
-    # Get all sub_locations and pollutants
-    sub_locations = conn.execute('SELECT sub_location_id FROM sub_locations').fetchall()
-    pollutants = conn.execute('SELECT pollutant_id FROM pollutants').fetchall()
-
-    # Check existing dates to avoid duplicates
-    existing_dates = set(row[0] for row in conn.execute(
-        'SELECT DISTINCT measured_at FROM measurements'
-    ).fetchall())
-
-    measurements = []
-    dates = pd.date_range(start_date, end_date, freq='D')
-
-    # Base values for different pollutants (based on sample data)
-    base_values = {
-        1: 15,  # Nitric Oxide
-        2: 25,  # Nitrogen dioxide
-        3: 40,  # Oxides of Nitrogen
-        4: 10,  # PM10
-        5: 5,   # PM2.5
-        6: 50,  # Ozone
-    }
-
-    for date in dates:
-        date_str = date.strftime('%Y-%m-%d')
-        if date_str in existing_dates:
-            continue
-
-        # Date factor for seasonal variation (0 to 1)
-        date_factor = (date.dayofyear - 1) / 365.0
-
-        for sub_loc in sub_locations:
-            for poll in pollutants:
-                # Skip Ozone for locations that don't measure it
-                if poll[0] == 6 and sub_loc[0] != 3:  # St Ebbes only
-                    continue
-
-                value = generate_measurement(base_values[poll[0]], date_factor)
-                status = 'P' if np.random.random() > 0.3 else 'V'  # 70% P, 30% V
-
-                measurements.append((
-                    sub_loc[0],
-                    poll[0],
-                    round(value, 1),
-                    f"{status} µg/m³",
-                    date_str
-                ))
-
-    # Insert in batches
-    batch_size = 100
-    for i in range(0, len(measurements), batch_size):
-        batch = measurements[i:i + batch_size]
-        conn.executemany('''
-            INSERT INTO measurements 
-            (sub_location_id, pollutant_id, value, status, measured_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', batch)
+def insert_benchmark_data(conn, num_sites: int, num_pollutants: int):
+    """Add numbered sub-locations and pollutants until there are at least num_sites and num_pollutants
+
+    Used to build databases at a larger scale than the real reference data. New sites are
+    shared out across the existing locations.
+    """
+    insert_initial_data(conn)
+
+    location_ids = [row[0] for row in conn.execute('SELECT location_id FROM locations ORDER BY location_id')]
+    existing_sites = conn.execute('SELECT COUNT(*) FROM sub_locations').fetchone()[0]
+    conn.executemany('INSERT OR IGNORE INTO sub_locations (location_id, name) VALUES (?, ?)', [
+        (location_ids[i % len(location_ids)], f'Site {i + 1}') for i in range(existing_sites, num_sites)
+    ])
+
+    existing_pollutants = conn.execute('SELECT COUNT(*) FROM pollutants').fetchone()[0]
+    conn.executemany('INSERT OR IGNORE INTO pollutants (name) VALUES (?)', [
+        (f'Pollutant {i + 1}',) for i in range(existing_pollutants, num_pollutants)
+    ])
+
+
+def generate_measurements(conn, start_date, end_date, frequency: str = "daily", seed: int = None,
+                          num_sites: int = None, num_pollutants: int = None, rebuild_indexes: bool = False):
+    """Generate measurements for all locations and pollutants
+
+    Each series (sub-location x pollutant) is generated as whole NumPy arrays - a seasonal
+    curve (higher in winter) plus normal noise - and bulk inserted with executemany. Only
+    times after the series' high-water mark are generated, so re-running extends the data.
+
+    Runs in the caller's transaction (one is opened if there isn't one) and leaves committing to
+    the caller, so rolling back after a failure also restores any indexes dropped for the load.
+
+    Args:
+        conn (sqlite3.Connection): Database connection object
+        start_date (datetime): First measurement time
+        end_date (datetime): Last measurement time
+        frequency (str, optional): "daily" or "hourly". Defaults to "daily".
+        seed (int, optional): Random seed, for reproducible data. Defaults to None.
+        num_sites (int, optional): Only use the first num_sites sub-locations. Defaults to all.
+        num_pollutants (int, optional): Only use the first num_pollutants pollutants. Defaults to all.
+        rebuild_indexes (bool, optional): Drop the measurements indexes for the load and rebuild them
+            afterwards - much faster for large datasets. Defaults to False.
+
+    Returns:
+        int: Number of measurements inserted
+    """
+    offset, date_format = FREQUENCIES[frequency]
+    rng = np.random.default_rng(seed)
+
+    # Get the sub_locations and pollutants to generate data for
+    sub_locations = [row[0] for row in conn.execute(
+        'SELECT sub_location_id FROM sub_locations ORDER BY sub_location_id LIMIT ?', (num_sites or -1,))]
+    pollutants = [row[0] for row in conn.execute(
+        'SELECT pollutant_id FROM pollutants ORDER BY pollutant_id LIMIT ?', (num_pollutants or -1,))]
+
+    # Latest time already held for each series, so only newer measurements are generated
+    watermarks = load_watermarks(conn)
+
+    times = pd.date_range(start_date, end_date, freq=offset)
+    measured_at = np.array(times.strftime(date_format), dtype=str)
+    # Seasonal variation (higher in winter), shared by every series
+    seasonal = np.sin((times.dayofyear.to_numpy() - 1) / 365.0 * 2 * np.pi + np.pi) * 10
+
+    # Only times after each series' high-water mark are generated, so nothing can clash while
+    # the unique index is dropped and recreated
+    # sqlite3 doesn't open a transaction before DDL - without one each DROP INDEX commits straight
+    # away, and a failed load would leave the unique index that ON CONFLICT inserts rely on dropped
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    index_sql = drop_measurement_indexes(conn, keep_unique=False) if rebuild_indexes else []
+    on_conflict = "" if rebuild_indexes else "ON CONFLICT (sub_location_id, pollutant_id, measured_at) DO NOTHING"
+
+    inserted = 0
+    for sub_loc in sub_locations:
+        for poll in pollutants:
+            # Skip Ozone for locations that don't measure it
+            if poll == 6 and sub_loc != 3:  # St Ebbes only
+                continue
+
+            # Skip times already held for this series (ISO strings sort in time order)
+            first = np.searchsorted(measured_at, watermarks.get((sub_loc, poll), ''), side='right')
+            count = len(measured_at) - first
+            if count == 0:
+                continue
+
+            base_value = BASE_VALUES.get(poll, DEFAULT_BASE_VALUE)
+            noise = rng.normal(0, base_value * 0.2, count)
+            values = np.maximum(1, base_value + seasonal[first:] + noise).round(1)
+            statuses = np.where(rng.random(count) > 0.3, 'P µg/m³', 'V µg/m³')  # 70% P, 30% V
+
+            cursor = conn.executemany(f'''
+                INSERT INTO measurements
+                (sub_location_id, pollutant_id, value, status, measured_at)
+                VALUES (?, ?, ?, ?, ?)
+                {on_conflict}
+            ''', zip(repeat(sub_loc), repeat(poll), values.tolist(), statuses.tolist(),
+                     measured_at[first:].tolist()))
+            inserted += cursor.rowcount
+
+    for sql in index_sql:
+        conn.execute(sql)
+
+    # Merge the new measurements into the daily / weekly / monthly rollups
+    update_rollups(conn)
+
+    return inserted
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Generate dummy measurements for the air quality db")
+    parser.add_argument("--db", default="air.db", help="Path to the db (default: air.db)")
+    parser.add_argument("--start", default="2023-01-01", help="First date, YYYY-MM-DD (default: 2023-01-01)")
+    parser.add_argument("--years", type=int,
+                        help="Number of years to generate from the start date (default: up to today)")
+    parser.add_argument("--frequency", choices=FREQUENCIES, default="daily", help="Sampling frequency (default: daily)")
+    parser.add_argument("--sites", type=int, help="Number of sub-locations, numbered sites are added as needed")
+    parser.add_argument("--pollutants", type=int, help="Number of pollutants, numbered ones are added as needed")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible data")
+    parser.add_argument("--rebuild-indexes", action="store_true",
+                        help="Drop the measurements indexes during the load and rebuild them after (large datasets)")
+    args = parser.parse_args()
+
+    start_date = datetime.strptime(args.start, "%Y-%m-%d")
+    if args.years:
+        end_date = start_date + pd.DateOffset(years=args.years) - pd.Timedelta(seconds=1)
+    else:
+        end_date = datetime.now()
+
     # Connect to existing database
-    conn = sqlite3.connect('air.db')
+    conn = connect_writer(args.db)
 
     try:
-        # Make sure reference data exists
-        insert_initial_data(conn)
+        # Reference data, measurements, index rebuilds and rollups commit or roll back together
+        conn.execute("BEGIN")
 
-        # Generate measurements for the past year
-        end_date = datetime.now()
-        start_date = datetime(2023, 1, 1)  # Starting from January 1, 2023
+        # Make sure reference data exists
+        insert_benchmark_data(conn, args.sites or 0, args.pollutants or 0)
 
-        generate_measurements(conn, start_date, end_date)
+        start = time.perf_counter()
+        inserted = generate_measurements(conn, start_date, end_date, frequency=args.frequency, seed=args.seed,
+                                         num_sites=args.sites, num_pollutants=args.pollutants,
+                                         rebuild_indexes=args.rebuild_indexes)
 
         # Commit all changes
         conn.commit()
-        print(f"Successfully generated data from {start_date.date()} to {end_date.date()}")
+        elapsed = time.perf_counter() - start
+        print(f"Successfully generated {inserted:,} measurements from {start_date.date()} to {end_date.date()} "
+              f"in {elapsed:.2f}s ({inserted / elapsed:,.0f} rows/s)")
 
         # Print some stats
         cursor = conn.cursor()
@@ -134,8 +219,9 @@ def main():
         print(f"Total number of measurements in database: {count}")
 
     except Exception as e:
-        print(f"An error occurred: {e}")
+        print(f"An error occurred, nothing was loaded: {e}")
         conn.rollback()
+        sys.exit(1)
     finally:
         conn.close()
 
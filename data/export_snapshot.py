@@ -0,0 +1,46 @@
+"""Export the measurements to a memory-mapped snapshot for the app's series store.
+
+Run after ingest so app workers start from the snapshot instead of reading every measurement
+from the db. Workers started before the export switch to it on their next refresh after ingest.
+
+Run from the project root:
+    python -m data.export_snapshot                          (data/air.db -> data/snapshot)
+    python -m data.export_snapshot path/to/air.db path/to/snapshot
+"""
+import sqlite3
+import sys
+import time
+
+from database_helpers import get_data_version
+from series_store import SeriesStore
+
+DEFAULT_DB_PATH = "data/air.db"
+DEFAULT_SNAPSHOT_PATH = "data/snapshot"
+
+
+def export_snapshot(db_path: str = DEFAULT_DB_PATH, snapshot_path: str = DEFAULT_SNAPSHOT_PATH):
+    """Load every measurement from the db and write it out as a snapshot
+
+    Returns:
+        tuple[str, int]: Directory the snapshot was written to and the number of measurements
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        store = SeriesStore()
+        store.refresh(conn, get_data_version(conn))
+        return store.save_snapshot(snapshot_path), store.rows
+    finally:
+        conn.close()
+
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DB_PATH
+    snapshot_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_SNAPSHOT_PATH
+
+    start = time.perf_counter()
+    directory, rows = export_snapshot(db_path, snapshot_path)
+    print(f"Exported {rows:,} measurements to {directory} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""Load London Air Quality Network (LAQN) measurements from the londonair.org.uk API.
+
+Each site/species pair is requested a date window at a time, with many requests in flight at once
+over a pool of reused connections. Responses are parsed as they arrive and streamed into the same
+bulk insert as the CSV ingest, in one transaction that also brings the rollups up to date.
+
+London boroughs become main locations and their monitoring sites sub-locations. Like the CSV
+ingest, loading is incremental: each series only fetches from its latest measurement held on,
+unless --backfill is given.
+
+London data is kept in its own db, london.db, which the site reads when the London dataset is selected
+(create it with 'python db_setup.py london.db').
+
+Run from the data directory, e.g.:
+    python ingest_london_api.py --start 2024-01-01 --end 2025-01-01
+    python ingest_london_api.py --start 2024-01-01 --end 2024-02-01 --base-url http://127.0.0.1:8765/AirQuality
+
+The second form runs against the local stub server (london_api_stub.py).
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, timedelta
+import aiohttp
+from db_connection import connect_writer
+from ingest_wide_csv import insert_measurements, load_lookups, resolve_series_ids
+from rollups import load_watermarks, update_rollups
+
+API_BASE_URL = "https://api.erg.ic.ac.uk/AirQuality"
+SITES_PATH = "/Information/MonitoringSiteSpecies/GroupName=London/Json"
+DATA_PATH = "/Data/SiteSpecies/SiteCode={site}/SpeciesCode={species}/StartDate={start}/EndDate={end}/Json"
+
+# LAQN species codes and the pollutant names they're stored under
+SPECIES_POLLUTANTS = {
+    "NO2": "Nitrogen dioxide",
+    "O3": "Ozone",
+    "PM10": "PM10 Particulate matter",
+    "PM25": "PM2.5 Particulate matter",
+    "SO2": "Sulphur dioxide",
+    "CO": "Carbon monoxide",
+}
+
+# Requests in flight at once
+DEFAULT_CONCURRENCY = 8
+# Days of hourly data per request
+DEFAULT_WINDOW_DAYS = 31
+# Attempts per request after the first, and the base delay between them (doubled each time)
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 0.5
+# Status codes that are worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+REQUEST_TIMEOUT_SECONDS = 60
+
+
+class RetryableStatus(Exception):
+    """The API answered with a status that's worth retrying."""
+
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.retry_after = retry_after
+
+
+async def fetch_json(session, url, semaphore, retries: int = MAX_RETRIES):
+    """GET url and parse the JSON response, retrying with exponential backoff.
+
+    Args:
+        session (aiohttp.ClientSession): Session whose connections are reused between requests
+        url (str): URL to request
+        semaphore (asyncio.BoundedSemaphore): Limits the requests in flight - held for the request
+            only, not while waiting to retry
+        retries (int, optional): Attempts after the first. Defaults to MAX_RETRIES.
+
+    Returns:
+        dict: The parsed response
+
+    Raises:
+        aiohttp.ClientError | asyncio.TimeoutError | RetryableStatus: If the last attempt fails
+    """
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                async with session.get(url) as response:
+                    if response.status in RETRY_STATUSES:
+                        raise RetryableStatus(response.status, response.headers.get("Retry-After"))
+                    response.raise_for_status()
+                    # The API doesn't always label its JSON as JSON
+                    return await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, RetryableStatus) as e:
+            client_error = isinstance(e, aiohttp.ClientResponseError) and 400 <= e.status < 500
+            if attempt == retries or client_error:
+                raise
+            retry_after = getattr(e, "retry_after", None)
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else BACKOFF_SECONDS * 2 ** attempt
+            # Jitter so requests that failed together don't all retry together
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+
+
+def as_list(value):
+    """The API returns a single item as an object rather than a one item list - always give a list."""
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def parse_sites(payload, species_codes=None):
+    """Pull the sites and the species each one measures out of a MonitoringSiteSpecies response
+
+    Args:
+        payload (dict): Parsed response
+        species_codes (set[str], optional): Only keep these species. Defaults to every species in
+            SPECIES_POLLUTANTS.
+
+    Returns:
+        list[dict]: Per site - code, location (borough), sub_location (site name without the borough
+        prefix) and species: a list of (species code, first date, last date or None)
+    """
+    species_codes = species_codes or set(SPECIES_POLLUTANTS)
+    sites = []
+    for site in as_list(payload.get("Sites", {}).get("Site")):
+        location = site["@LocalAuthorityName"]
+        # Site names are "<borough> - <site>"
+        sub_location = site["@SiteName"]
+        if sub_location.startswith(f"{location} - "):
+            sub_location = sub_location[len(location) + 3:]
+
+        species = [
+            (entry["@SpeciesCode"], entry["@DateMeasurementStarted"][:10],
+             entry.get("@DateMeasurementFinished", "")[:10] or None)
+            for entry in as_list(site.get("Species"))
+            if entry["@SpeciesCode"] in species_codes
+        ]
+        if species:
+            sites.append({"code": site["@SiteCode"], "location": location, "sub_location": sub_location,
+                          "species": species})
+    return sites
+
+
+def plan_requests(sites, series_ids, start_date: date, end_date: date, window_days: int = DEFAULT_WINDOW_DAYS,
+                  watermarks=None):
+    """Split each site/species into date windows to request
+
+    Windows are clipped to the dates the species was measured at the site, and start from the
+    day of the series' latest measurement held (watermarks), so re-runs only fetch what's new.
+
+    Args:
+        sites (list[dict]): From parse_sites()
+        series_ids (dict): {(site code, species code): (sub_location_id, pollutant_id)}
+        start_date (date): First day to load
+        end_date (date): Day after the last day to load
+        window_days (int, optional): Days per request. Defaults to DEFAULT_WINDOW_DAYS.
+        watermarks (dict, optional): {(sub_location_id, pollutant_id): latest measured_at held}
+
+    Returns:
+        list[tuple]: (site code, species code, window start, window end, sub_location_id, pollutant_id)
+    """
+    watermarks = watermarks or {}
+    requests = []
+    for site in sites:
+        for species, started, finished in site["species"]:
+            ids = series_ids[(site["code"], species)]
+            first = max(start_date, date.fromisoformat(started))
+            last = min(end_date, date.fromisoformat(finished) + timedelta(days=1)) if finished else end_date
+            if ids in watermarks:
+                first = max(first, date.fromisoformat(watermarks[ids][:10]))
+
+            window_start = first
+            while window_start < last:
+                window_end = min(window_start + timedelta(days=window_days), last)
+                requests.append((site["code"], species, window_start, window_end) + ids)
+                window_start = window_end
+    return requests
+
+
+def parse_measurements(payload, sub_location_id: int, pollutant_id: int, watermark: str = ""):
+    """Turn a SiteSpecies response into measurement tuples, skipping hours with no value
+
+    Args:
+        payload (dict): Parsed response
+        sub_location_id (int): Series' sub-location
+        pollutant_id (int): Series' pollutant
+        watermark (str, optional): Latest measured_at already held - readings at or before it are
+            skipped. Defaults to "".
+
+    Returns:
+        list[tuple]: (sub_location_id, pollutant_id, value, status, measured_at) ready for inserting
+    """
+    rows = []
+    for reading in as_list(payload.get("RawAQData", {}).get("Data")):
+        measured_at = reading["@MeasurementDateGMT"]
+        if measured_at <= watermark:
+            continue  # Already loaded
+        try:
+            value = float(reading["@Value"])
+        except (KeyError, TypeError, ValueError):
+            continue  # "" when there's no reading for the hour
+        rows.append((sub_location_id, pollutant_id, value, "", measured_at))
+    return rows
+
+
+async def ingest_london_api(conn, start_date: date, end_date: date, base_url: str = API_BASE_URL,
+                            concurrency: int = DEFAULT_CONCURRENCY, window_days: int = DEFAULT_WINDOW_DAYS,
+                            site_codes=None, species_codes=None, backfill: bool = False):
+    """Fetch LAQN measurements concurrently and load them into the measurements table
+
+    A fixed set of worker tasks take requests from the plan, fetch and parse them, and hand the
+    rows to a bounded queue. The inserter takes them off the queue and inserts them as they come,
+    so fetching, parsing and inserting overlap and only a few responses are held at a time.
+
+    Args:
+        conn (sqlite3.Connection): Database connection object
+        start_date (date): First day to load
+        end_date (date): Day after the last day to load
+        base_url (str, optional): API root. Defaults to API_BASE_URL.
+        concurrency (int, optional): Requests in flight at once. Defaults to DEFAULT_CONCURRENCY.
+        window_days (int, optional): Days per request. Defaults to DEFAULT_WINDOW_DAYS.
+        site_codes (set[str], optional): Only load these sites. Defaults to every London site.
+        species_codes (set[str], optional): Only load these species. Defaults to SPECIES_POLLUTANTS.
+        backfill (bool, optional): Ignore the latest measurement held for each series and request
+            the whole date range, to fill gaps. Defaults to False.
+
+    Returns:
+        tuple[int, int, list[tuple]]: Number of new measurements inserted, number of requests made
+        and the requests that failed after every retry
+    """
+    semaphore = asyncio.BoundedSemaphore(concurrency)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_SECONDS)
+    # Keep-alive connections, at most one per request in flight
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        sites = parse_sites(await fetch_json(session, base_url + SITES_PATH, semaphore), species_codes)
+        if site_codes:
+            sites = [site for site in sites if site["code"] in site_codes]
+
+        lookups = load_lookups(conn)
+        watermarks = {} if backfill else load_watermarks(conn)
+        inserted = 0
+        failed = []
+        try:
+            series_ids = {
+                (site["code"], species): resolve_series_ids(conn, lookups, site["location"], site["sub_location"],
+                                                            SPECIES_POLLUTANTS[species])
+                for site in sites
+                for species, _, _ in site["species"]
+            }
+            requests = plan_requests(sites, series_ids, start_date, end_date, window_days, watermarks)
+
+            pending = iter(requests)
+            results = asyncio.Queue(maxsize=concurrency * 2)
+
+            async def worker():
+                try:
+                    for request in pending:
+                        site, species, window_start, window_end, sub_location_id, pollutant_id = request
+                        url = base_url + DATA_PATH.format(site=site, species=species,
+                                                          start=window_start.isoformat(), end=window_end.isoformat())
+                        try:
+                            payload = await fetch_json(session, url, semaphore)
+                            rows = parse_measurements(payload, sub_location_id, pollutant_id,
+                                                      watermarks.get((sub_location_id, pollutant_id), ""))
+                        except (aiohttp.ClientError, asyncio.TimeoutError, RetryableStatus, ValueError, KeyError) as e:
+                            print(f"Request failed: {site} {species} {window_start} - {window_end}: {e!r}")
+                            failed.append(request)
+                            continue
+                        await results.put(rows)
+                finally:
+                    # Always tell the inserter this worker is done, even if it stopped on an error
+                    await results.put(None)
+
+            workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(requests)))]
+            finished = 0
+            try:
+                while finished < len(workers):
+                    rows = await results.get()
+                    if rows is None:
+                        finished += 1
+                    elif rows:
+                        inserted += insert_measurements(conn, rows)
+                # Raise anything a worker stopped on
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers:
+                    task.cancel()
+
+            update_rollups(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return inserted, len(requests), failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load London Air Quality Network data into the air quality db")
+    parser.add_argument("--start", type=date.fromisoformat, required=True, help="First day to load (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, default=date.today(),
+                        help="Day after the last day to load (YYYY-MM-DD, default: today)")
+    parser.add_argument("--db", default="london.db", help="Path to the db (default: london.db)")
+    parser.add_argument("--base-url", default=API_BASE_URL, help=f"API root (default: {API_BASE_URL})")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Requests in flight at once (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--window-days", type=int, default=DEFAULT_WINDOW_DAYS,
+                        help=f"Days of data per request (default: {DEFAULT_WINDOW_DAYS})")
+    parser.add_argument("--sites", help="Comma separated site codes to load (default: every London site)")
+    parser.add_argument("--species", help="Comma separated species codes to load (default: "
+                                          f"{','.join(SPECIES_POLLUTANTS)})")
+    parser.add_argument("--backfill", action="store_true",
+                        help="Also request dates before the latest measurement held for each series")
+    args = parser.parse_args()
+
+    conn = connect_writer(args.db)
+    try:
+        start = time.perf_counter()
+        inserted, requests, failed = asyncio.run(ingest_london_api(
+            conn, args.start, args.end, base_url=args.base_url.rstrip("/"), concurrency=args.concurrency,
+            window_days=args.window_days,
+            site_codes=set(args.sites.split(",")) if args.sites else None,
+            species_codes=set(args.species.split(",")) if args.species else None,
+            backfill=args.backfill,
+        ))
+        elapsed = time.perf_counter() - start
+    finally:
+        conn.close()
+
+    print(f"Inserted {inserted:,} measurements from {requests:,} requests in {elapsed:.2f}s "
+          f"({requests / elapsed:,.1f} requests/s)")
+    if failed:
+        print(f"{len(failed)} requests failed - re-run the same dates with --backfill to fill them in")
+
+
+if __name__ == "__main__":
+    main()
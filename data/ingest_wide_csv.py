@@ -0,0 +1,246 @@
+import argparse
+import csv
+import time
+from datetime import datetime
+from itertools import islice
+from db_connection import connect_writer
+from rollups import load_watermarks, update_rollups
+
+
+def parse_header(header):
+    """Work out where the date, value and status columns are in a wide oxonair export
+
+    Value columns are named "<site>/ <pollutant>" and their status columns
+    "<site>/ <pollutant>/ Status". The site name starts with the main location, e.g.
+    "Oxford High Street" is the "High Street" sub-location of "Oxford".
+
+    Returns:
+        tuple[int, list[tuple]]: Index of the Date column, and for each series a tuple of
+        (value index, status index, location, sub-location, pollutant)
+    """
+    date_index = header.index("Date")
+
+    value_columns = {}
+    status_columns = {}
+    for index, name in enumerate(header):
+        parts = [part.strip() for part in name.split("/ ")]
+        if len(parts) == 2:
+            value_columns[(parts[0], parts[1])] = index
+        elif len(parts) == 3 and parts[2] == "Status":
+            status_columns[(parts[0], parts[1])] = index
+
+    series = []
+    for (site, pollutant), value_index in value_columns.items():
+        location, sub_location = site.split(" ", 1)
+        series.append((value_index, status_columns.get((site, pollutant)), location, sub_location, pollutant))
+
+    return date_index, series
+
+
+def load_lookups(conn):
+    """Load the reference tables into dicts mapping names to ids
+
+    Returns:
+        dict: {"locations": {name: id}, "sub_locations": {(location_id, name): id}, "pollutants": {name: id}}
+    """
+    return {
+        "locations": dict((name, location_id) for location_id, name in
+                          conn.execute("SELECT location_id, name FROM locations")),
+        "sub_locations": dict(((location_id, name), sub_location_id) for sub_location_id, location_id, name in
+                              conn.execute("SELECT sub_location_id, location_id, name FROM sub_locations")),
+        "pollutants": dict((name, pollutant_id) for pollutant_id, name in
+                           conn.execute("SELECT pollutant_id, name FROM pollutants")),
+    }
+
+
+def resolve_series_ids(conn, lookups, location, sub_location, pollutant):
+    """Get the (sub_location_id, pollutant_id) for a series, adding any new reference data
+
+    Returns:
+        tuple[int, int]: The sub-location and pollutant ids
+    """
+    if location not in lookups["locations"]:
+        cursor = conn.execute("INSERT INTO locations (name) VALUES (?)", (location,))
+        lookups["locations"][location] = cursor.lastrowid
+    location_id = lookups["locations"][location]
+
+    if (location_id, sub_location) not in lookups["sub_locations"]:
+        cursor = conn.execute("INSERT INTO sub_locations (location_id, name) VALUES (?, ?)",
+                              (location_id, sub_location))
+        lookups["sub_locations"][(location_id, sub_location)] = cursor.lastrowid
+
+    if pollutant not in lookups["pollutants"]:
+        cursor = conn.execute("INSERT INTO pollutants (name) VALUES (?)", (pollutant,))
+        lookups["pollutants"][pollutant] = cursor.lastrowid
+
+    return lookups["sub_locations"][(location_id, sub_location)], lookups["pollutants"][pollutant]
+
+
+def melt_rows(rows, date_index, series, watermarks=None):
+    """Turn wide export rows into long measurement tuples, skipping cells with no data
+
+    Args:
+        rows (list[list[str]]): CSV rows
+        date_index (int): Index of the Date column
+        series (list[tuple]): (value index, status index, sub_location_id, pollutant_id) per series
+        watermarks (dict, optional): Latest measured_at already held for each
+            (sub_location_id, pollutant_id) - cells at or before it are skipped. Defaults to None.
+
+    Yields:
+        tuple: (sub_location_id, pollutant_id, value, status, measured_at) ready for inserting
+    """
+    for row in rows:
+        # Export dates are dd/mm/yyyy, the db holds ISO dates
+        measured_at = datetime.strptime(row[date_index], "%d/%m/%Y").strftime("%Y-%m-%d")
+
+        for value_index, status_index, sub_location_id, pollutant_id in series:
+            if watermarks and measured_at <= watermarks.get((sub_location_id, pollutant_id), ""):
+                continue  # Already loaded
+            try:
+                value = float(row[value_index])
+            except (ValueError, IndexError):
+                continue  # "No data" or missing cell
+            status = row[status_index] if status_index is not None else ""
+            yield sub_location_id, pollutant_id, value, status, measured_at
+
+
+def insert_measurements(conn, rows):
+    """Bulk insert measurement tuples, skipping any measurement already held
+
+    Args:
+        conn (sqlite3.Connection): Database connection object
+        rows (iterable[tuple]): (sub_location_id, pollutant_id, value, status, measured_at) tuples
+
+    Returns:
+        int: Number of new measurements inserted
+    """
+    cursor = conn.executemany('''
+        INSERT INTO measurements
+        (sub_location_id, pollutant_id, value, status, measured_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (sub_location_id, pollutant_id, measured_at) DO NOTHING
+    ''', rows)
+    return cursor.rowcount
+
+
+def drop_measurement_indexes(conn, keep_unique: bool = True):
+    """Drop the indexes on the measurements table so they can be rebuilt after a bulk load
+
+    Args:
+        conn (sqlite3.Connection): Database connection object
+        keep_unique (bool, optional): Keep the unique indexes, which inserts using ON CONFLICT rely on
+            to skip measurements already held. Defaults to True.
+
+    Returns:
+        list[str]: The CREATE INDEX statements for recreating the dropped indexes
+
+    Notes:
+        - Run inside the load's transaction (conn.execute("BEGIN") first), so the drop is rolled
+          back with it if the load fails
+    """
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'measurements' AND sql IS NOT NULL "
+        "AND NOT (? AND sql LIKE 'CREATE UNIQUE%')", (keep_unique,)
+    ).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX "{name}"')
+    return [sql for _, sql in indexes]
+
+
+def ingest_wide_csv(conn, path, chunk_size: int = 1000, rebuild_indexes: bool = False, backfill: bool = False):
+    """Load a wide oxonair CSV export into the measurements table
+
+    The file is read a chunk of rows at a time and melted into long format, with the names
+    resolved to ids through in-memory lookups. Everything is inserted in a single transaction
+    with executemany, and the rollups are brought up to date before committing. A failed load
+    rolls back completely - dropped indexes included.
+
+    Loading is idempotent - only cells after each series' high-water mark are inserted, and any
+    measurement already held is skipped by the unique index, so re-running the same or an
+    overlapping export only adds the new rows.
+
+    Args:
+        conn (sqlite3.Connection): Database connection object
+        path (str): Path to the CSV export
+        chunk_size (int, optional): CSV rows read per chunk. Defaults to 1000.
+        rebuild_indexes (bool, optional): Drop the measurements indexes for the load and rebuild them
+            afterwards, which is much faster for a large backfill than updating them row by row.
+            Defaults to False.
+        backfill (bool, optional): Ignore the high-water marks and offer every cell for inserting, to
+            fill gaps before the latest measurement. Defaults to False.
+
+    Returns:
+        tuple[int, int, float]: Number of new measurements inserted, number of value cells read and
+        seconds spent parsing and inserting rows (excluding index rebuilds and rollups)
+    """
+    inserted = 0
+    cells = 0
+    insert_time = 0.0
+
+    with open(path, mode="r", newline="", encoding="utf-8") as csv_file:
+        reader = csv.reader(csv_file)
+        date_index, series = parse_header(next(reader))
+
+        lookups = load_lookups(conn)
+        watermarks = {} if backfill else load_watermarks(conn)
+        try:
+            # sqlite3 doesn't open a transaction before DDL, so open it here - otherwise each
+            # DROP INDEX commits straight away and a failed load leaves the indexes dropped
+            conn.execute("BEGIN")
+            index_sql = drop_measurement_indexes(conn) if rebuild_indexes else []
+
+            series_ids = [
+                (value_index, status_index) + resolve_series_ids(conn, lookups, location, sub_location, pollutant)
+                for value_index, status_index, location, sub_location, pollutant in series
+            ]
+
+            while True:
+                rows = list(islice(reader, chunk_size))
+                if not rows:
+                    break
+                cells += len(rows) * len(series_ids)
+
+                insert_start = time.perf_counter()
+                inserted += insert_measurements(conn, melt_rows(rows, date_index, series_ids, watermarks))
+                insert_time += time.perf_counter() - insert_start
+
+            for sql in index_sql:
+                conn.execute(sql)
+
+            update_rollups(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return inserted, cells, insert_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a wide oxonair CSV export into the air quality db")
+    parser.add_argument("csv_path", help="Path to the exported CSV file")
+    parser.add_argument("--db", default="air.db", help="Path to the db (default: air.db)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="CSV rows read per chunk (default: 1000)")
+    parser.add_argument("--rebuild-indexes", action="store_true",
+                        help="Drop the measurements indexes during the load and rebuild them after (large backfills)")
+    parser.add_argument("--backfill", action="store_true",
+                        help="Also load cells older than the latest measurement held for each series")
+    args = parser.parse_args()
+
+    conn = connect_writer(args.db)
+    try:
+        start = time.perf_counter()
+        inserted, cells, insert_time = ingest_wide_csv(conn, args.csv_path, chunk_size=args.chunk_size,
+                                                       rebuild_indexes=args.rebuild_indexes, backfill=args.backfill)
+        elapsed = time.perf_counter() - start
+    finally:
+        conn.close()
+
+    print(f"Inserted {inserted:,} measurements from {cells:,} cells in {elapsed:.2f}s "
+          f"({cells / elapsed:,.0f} cells/s, {inserted / elapsed:,.0f} rows/s)")
+    print(f"Parse and insert: {insert_time:.2f}s ({inserted / max(insert_time, 1e-9):,.0f} rows/s), "
+          f"indexes and rollups: {elapsed - insert_time:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
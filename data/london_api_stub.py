@@ -0,0 +1,168 @@
+"""Local stand-in for the londonair.org.uk API, for trying out and timing ingest_london_api.py.
+
+Serves the sample responses in london_api_stub/ - the site list, and hourly readings for some
+site/species pairs, filtered to the dates requested. Responses have the same shape as the real API's.
+
+Options add generated sites (to time a backfill of hundreds of sites), a delay per response, and
+a share of requests that fail with a 503 (to see the retries at work). check_london_ingest.py runs
+the ingest against it.
+
+Run from the data directory, e.g.:
+    python london_api_stub.py
+    python london_api_stub.py --port 8765 --generated-sites 300 --latency 0.2 --fail-rate 0.05
+
+then point the ingest at it (loads london.db, create it first with 'python db_setup.py london.db'):
+    python ingest_london_api.py --start 2024-01-01 --end 2024-02-01 --base-url http://127.0.0.1:8765/AirQuality
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "london_api_stub")
+
+SITES_PATH = "/AirQuality/Information/MonitoringSiteSpecies/GroupName=London/Json"
+DATA_PATTERN = re.compile(r"^/AirQuality/Data/SiteSpecies/SiteCode=(?P<site>[^/]+)/SpeciesCode=(?P<species>[^/]+)"
+                          r"/StartDate=(?P<start>[0-9-]+)/EndDate=(?P<end>[0-9-]+)/Json$")
+
+# Species measured at generated sites, with a typical level to generate readings around
+GENERATED_SPECIES = {"NO2": 35.0, "O3": 45.0, "PM10": 18.0, "PM25": 10.0}
+
+
+def load_stub_responses(stub_dir: str = STUB_DIR):
+    """Load the sample responses
+
+    Returns:
+        tuple[dict, dict]: The site list response, and {(site code, species code): readings} with the
+        readings of each SiteSpecies sample
+    """
+    with open(os.path.join(stub_dir, "MonitoringSiteSpecies.json"), mode="r") as sites_file:
+        sites = json.load(sites_file)
+
+    readings = {}
+    data_dir = os.path.join(stub_dir, "SiteSpecies")
+    for name in sorted(os.listdir(data_dir)):
+        with open(os.path.join(data_dir, name), mode="r") as data_file:
+            data = json.load(data_file)["RawAQData"]
+        readings[(data["@SiteCode"], data["@SpeciesCode"])] = data["Data"]
+    return sites, readings
+
+
+def add_generated_sites(sites, count: int):
+    """Add count generated sites measuring GENERATED_SPECIES to a site list response."""
+    for number in range(1, count + 1):
+        sites["Sites"]["Site"].append({
+            "@LocalAuthorityCode": "0",
+            "@LocalAuthorityName": "Generated",
+            "@SiteCode": f"GEN{number}",
+            "@SiteName": f"Generated - Site {number}",
+            "@SiteType": "Urban Background",
+            "@DateClosed": "",
+            "@DateOpened": "2000-01-01 00:00:00",
+            "Species": [
+                {"@SpeciesCode": species, "@SpeciesDescription": species,
+                 "@DateMeasurementStarted": "2000-01-01 00:00:00", "@DateMeasurementFinished": ""}
+                for species in GENERATED_SPECIES
+            ],
+        })
+
+
+def generated_readings(site: str, species: str, start: date, end: date):
+    """Hourly readings for a generated site - the same site, species and hour always give the same value."""
+    level = GENERATED_SPECIES[species]
+    readings = []
+    day = start
+    while day < end:
+        # Seeded per day rather than per request, so any window over the same days gives the same readings
+        rng = random.Random(zlib.crc32(f"{site}/{species}/{day}".encode()))
+        hour = datetime.combine(day, datetime.min.time())
+        for _ in range(24):
+            # Roughly 1 in 50 hours have no reading, like the real feed
+            value = "" if rng.random() < 0.02 else f"{max(level * rng.lognormvariate(0, 0.4), 0):.1f}"
+            readings.append({"@MeasurementDateGMT": hour.strftime("%Y-%m-%d %H:%M:%S"), "@Value": value})
+            hour += timedelta(hours=1)
+        day += timedelta(days=1)
+    return readings
+
+
+def make_handler(sites, readings, generated: int = 0, latency: float = 0.0, fail_rate: float = 0.0):
+    """Build the request handler class serving the given responses."""
+
+    class StubHandler(BaseHTTPRequestHandler):
+        # HTTP/1.1 so clients can keep connections open between requests
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            if fail_rate and random.random() < fail_rate:
+                self.send_json({"error": "Service unavailable"}, status=503)
+                return
+
+            if self.path == SITES_PATH:
+                self.send_json(sites)
+                return
+
+            match = DATA_PATTERN.match(self.path)
+            if match is None:
+                self.send_json({"error": f"Unknown path: {self.path}"}, status=404)
+                return
+
+            site, species = match["site"], match["species"]
+            start, end = date.fromisoformat(match["start"]), date.fromisoformat(match["end"])
+            if (site, species) in readings:
+                # The end date isn't included, as with the real API
+                data = [reading for reading in readings[(site, species)]
+                        if start.isoformat() <= reading["@MeasurementDateGMT"][:10] < end.isoformat()]
+            elif site.startswith("GEN") and species in GENERATED_SPECIES and int(site[3:]) <= generated:
+                data = generated_readings(site, species, start, end)
+            else:
+                data = []
+            self.send_json({"RawAQData": {"@SiteCode": site, "@SpeciesCode": species, "Data": data}})
+
+        def send_json(self, payload, status: int = 200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep quiet - a backfill makes thousands of requests
+
+    return StubHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve sample londonair.org.uk API responses locally")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument("--generated-sites", type=int, default=0,
+                        help="Add this many generated sites with hourly readings for any date (default: 0)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="Share of requests answered with a 503, e.g. 0.05 (default: 0)")
+    args = parser.parse_args()
+
+    sites, readings = load_stub_responses()
+    add_generated_sites(sites, args.generated_sites)
+    handler = make_handler(sites, readings, args.generated_sites, args.latency, args.fail_rate)
+
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"Serving the London Air API stub on http://{args.host}:{args.port}/AirQuality")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
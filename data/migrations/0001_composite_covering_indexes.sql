@@ -0,0 +1,28 @@
+-- Composite covering indexes for the filtered measurement queries (get_filtered_results)
+-- Each index leads with the columns the filters compare by equality, followed by
+-- (measured_at, measurement_id) so rows come back already in date order with no sort step,
+-- and ends with value and status so the measurements table itself never has to be read.
+
+-- The single-column indexes are replaced by the composite indexes below
+DROP INDEX IF EXISTS idx_measurements_date;
+DROP INDEX IF EXISTS idx_measurements_location;
+DROP INDEX IF EXISTS idx_measurements_pollutant;
+
+-- No filter, or a filter matching several sub-locations (e.g. main location only)
+CREATE INDEX idx_measurements_date
+    ON measurements(measured_at, measurement_id, sub_location_id, pollutant_id, value, status);
+
+-- Sub-location only
+CREATE INDEX idx_measurements_sub_date
+    ON measurements(sub_location_id, measured_at, measurement_id, pollutant_id, value, status);
+
+-- Pollutant only, or pollutant with several sub-locations
+CREATE INDEX idx_measurements_pollutant_date
+    ON measurements(pollutant_id, measured_at, measurement_id, sub_location_id, value, status);
+
+-- Sub-location and pollutant
+CREATE INDEX idx_measurements_sub_pollutant_date
+    ON measurements(sub_location_id, pollutant_id, measured_at, measurement_id, value, status);
+
+-- Sub-location names are looked up on their own, not only together with a location
+CREATE INDEX idx_sub_locations_name ON sub_locations(name);
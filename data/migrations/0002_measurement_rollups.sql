@@ -0,0 +1,44 @@
+-- Pre-aggregated measurements per sub-location, pollutant and day / week / month
+-- Kept up to date on ingest by rollups.update_rollups(), which only aggregates measurements
+-- added since the last update. The sum is stored rather than the mean so new rows can be merged in.
+CREATE TABLE measurement_rollups (
+    period TEXT NOT NULL CHECK (period IN ('day', 'week', 'month')),
+    sub_location_id INTEGER NOT NULL,
+    pollutant_id INTEGER NOT NULL,
+    period_start DATE NOT NULL,
+    min_value REAL NOT NULL,
+    max_value REAL NOT NULL,
+    sum_value REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (period, sub_location_id, pollutant_id, period_start),
+    FOREIGN KEY (sub_location_id) REFERENCES sub_locations(sub_location_id),
+    FOREIGN KEY (pollutant_id) REFERENCES pollutants(pollutant_id)
+) WITHOUT ROWID;
+
+-- Key / value store for db level state, e.g. how far the rollups have got
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+-- Build the rollups for any measurements already in the db
+INSERT INTO measurement_rollups
+SELECT 'day', sub_location_id, pollutant_id, date(measured_at),
+       MIN(value), MAX(value), SUM(value), COUNT(*)
+FROM measurements
+GROUP BY sub_location_id, pollutant_id, date(measured_at);
+
+INSERT INTO measurement_rollups
+SELECT 'week', sub_location_id, pollutant_id, date(measured_at, 'weekday 0', '-6 days'),
+       MIN(value), MAX(value), SUM(value), COUNT(*)
+FROM measurements
+GROUP BY sub_location_id, pollutant_id, date(measured_at, 'weekday 0', '-6 days');
+
+INSERT INTO measurement_rollups
+SELECT 'month', sub_location_id, pollutant_id, date(measured_at, 'start of month'),
+       MIN(value), MAX(value), SUM(value), COUNT(*)
+FROM measurements
+GROUP BY sub_location_id, pollutant_id, date(measured_at, 'start of month');
+
+INSERT INTO meta (key, value)
+SELECT 'rollup_last_measurement_id', COALESCE(MAX(measurement_id), 0) FROM measurements;
@@ -0,0 +1,54 @@
+-- One measurement per sub-location, pollutant and time, so ingest can use
+-- INSERT ... ON CONFLICT DO NOTHING and re-running a load is a no-op
+
+-- Remove any duplicates already loaded, keeping the first copy
+DELETE FROM measurements
+WHERE measurement_id NOT IN (
+    SELECT MIN(measurement_id) FROM measurements
+    GROUP BY sub_location_id, pollutant_id, measured_at
+);
+
+CREATE UNIQUE INDEX idx_measurements_series_unique
+    ON measurements(sub_location_id, pollutant_id, measured_at);
+
+-- Latest measurement held for each series - ingest only needs to load rows after this
+-- Kept up to date by rollups.update_rollups()
+CREATE TABLE series_watermarks (
+    sub_location_id INTEGER NOT NULL,
+    pollutant_id INTEGER NOT NULL,
+    last_measured_at DATE NOT NULL,
+    PRIMARY KEY (sub_location_id, pollutant_id),
+    FOREIGN KEY (sub_location_id) REFERENCES sub_locations(sub_location_id),
+    FOREIGN KEY (pollutant_id) REFERENCES pollutants(pollutant_id)
+) WITHOUT ROWID;
+
+INSERT INTO series_watermarks
+SELECT sub_location_id, pollutant_id, MAX(measured_at)
+FROM measurements
+GROUP BY sub_location_id, pollutant_id;
+
+-- Rebuild the rollups in case any duplicates were removed above
+DELETE FROM measurement_rollups;
+
+INSERT INTO measurement_rollups
+SELECT 'day', sub_location_id, pollutant_id, date(measured_at),
+       MIN(value), MAX(value), SUM(value), COUNT(*)
+FROM measurements
+GROUP BY sub_location_id, pollutant_id, date(measured_at);
+
+INSERT INTO measurement_rollups
+SELECT 'week', sub_location_id, pollutant_id, date(measured_at, 'weekday 0', '-6 days'),
+       MIN(value), MAX(value), SUM(value), COUNT(*)
+FROM measurements
+GROUP BY sub_location_id, pollutant_id, date(measured_at, 'weekday 0', '-6 days');
+
+INSERT INTO measurement_rollups
+SELECT 'month', sub_location_id, pollutant_id, date(measured_at, 'start of month'),
+       MIN(value), MAX(value), SUM(value), COUNT(*)
+FROM measurements
+GROUP BY sub_location_id, pollutant_id, date(measured_at, 'start of month');
+
+INSERT INTO meta (key, value)
+SELECT 'rollup_last_measurement_id', COALESCE(MAX(measurement_id), 0) FROM measurements
+WHERE true
+ON CONFLICT (key) DO UPDATE SET value = excluded.value;
@@ -0,0 +1,116 @@
+from data_version import bump_data_version
+from db_connection import connect_writer
+
+# Rollup periods and the SQLite expression giving the start date of the period for a measurement
+# (or for the start of a day, as the weeks and months are built from the days). Weeks start on a Monday
+ROLLUP_PERIODS = {
+    "day": "date(measured_at)",
+    "week": "date(measured_at, 'weekday 0', '-6 days')",
+    "month": "date(measured_at, 'start of month')",
+}
+
+
+def load_watermarks(conn):
+    """Load the latest measurement time held for each series
+
+    Returns:
+        dict[tuple[int, int], str]: {(sub_location_id, pollutant_id): last measured_at}
+    """
+    return {(sub_location_id, pollutant_id): last_measured_at
+            for sub_location_id, pollutant_id, last_measured_at in
+            conn.execute("SELECT sub_location_id, pollutant_id, last_measured_at FROM series_watermarks")}
+
+
+def update_rollups(conn):
+    """Merge measurements added since the last update into the rollup tables
+
+    Also moves on the per-series high-water marks in series_watermarks.
+
+    Should be called by anything that inserts measurements, after the rows are inserted and in
+    the same transaction. Only rows with a measurement_id above the stored high-water mark are
+    aggregated, so the cost depends on the amount of new data, not the size of the table.
+    The db data version is bumped when there were new rows, so the app's caches are refreshed.
+
+    Returns:
+        int: Number of new measurements merged into the rollups
+
+    Notes:
+        - Relies on measurement_id increasing as rows are added (AUTOINCREMENT)
+        - Updates or deletes of existing measurements are not picked up
+    """
+    last_id = conn.execute(
+        "SELECT value FROM meta WHERE key = 'rollup_last_measurement_id'"
+    ).fetchone()
+    last_id = last_id[0] if last_id else 0
+
+    new_last_id, new_rows = conn.execute(
+        "SELECT MAX(measurement_id), COUNT(*) FROM measurements WHERE measurement_id > ?", (last_id,)
+    ).fetchone()
+    if not new_rows:
+        return 0
+
+    # Aggregate the new rows to days once, the weeks and months are then built from the days
+    # NOT INDEXED keeps SQLite on the rowid range, rather than scanning a whole covering index
+    conn.execute("DROP TABLE IF EXISTS temp.new_day_rollups")
+    conn.execute(f'''
+        CREATE TEMP TABLE new_day_rollups AS
+        SELECT sub_location_id, pollutant_id, {ROLLUP_PERIODS["day"]} AS measured_at,
+               MIN(value) AS min_value, MAX(value) AS max_value, SUM(value) AS sum_value, COUNT(*) AS count,
+               MAX(measured_at) AS last_measured_at
+        FROM measurements NOT INDEXED
+        WHERE measurement_id > ? AND measurement_id <= ?
+        GROUP BY sub_location_id, pollutant_id, {ROLLUP_PERIODS["day"]}
+    ''', (last_id, new_last_id))
+
+    for period, period_start in ROLLUP_PERIODS.items():
+        if period == "day":
+            # Already one row per day, so no need to group again
+            aggregates = "measured_at, min_value, max_value, sum_value, count"
+            group_by = "WHERE true"
+        else:
+            aggregates = f"{period_start}, MIN(min_value), MAX(max_value), SUM(sum_value), SUM(count)"
+            group_by = f"GROUP BY sub_location_id, pollutant_id, {period_start}"
+
+        conn.execute(f'''
+            INSERT INTO measurement_rollups
+                (period, sub_location_id, pollutant_id, period_start, min_value, max_value, sum_value, count)
+            SELECT ?, sub_location_id, pollutant_id, {aggregates}
+            FROM temp.new_day_rollups
+            {group_by}
+            ON CONFLICT (period, sub_location_id, pollutant_id, period_start) DO UPDATE SET
+                min_value = MIN(min_value, excluded.min_value),
+                max_value = MAX(max_value, excluded.max_value),
+                sum_value = sum_value + excluded.sum_value,
+                count = count + excluded.count
+        ''', (period,))
+
+    # Move each series' high-water mark on to its latest new measurement
+    conn.execute('''
+        INSERT INTO series_watermarks (sub_location_id, pollutant_id, last_measured_at)
+        SELECT sub_location_id, pollutant_id, MAX(last_measured_at)
+        FROM temp.new_day_rollups
+        GROUP BY sub_location_id, pollutant_id
+        ON CONFLICT (sub_location_id, pollutant_id) DO UPDATE SET
+            last_measured_at = MAX(last_measured_at, excluded.last_measured_at)
+    ''')
+
+    conn.execute("DROP TABLE temp.new_day_rollups")
+
+    conn.execute('''
+        INSERT INTO meta (key, value) VALUES ('rollup_last_measurement_id', ?)
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value
+    ''', (new_last_id,))
+    bump_data_version(conn)
+
+    return new_rows
+
+
+if __name__ == "__main__":
+    # Bring the rollups up to date - run from the data directory, same as db_setup.py
+    conn = connect_writer("air.db")
+    try:
+        merged = update_rollups(conn)
+        conn.commit()
+        print(f"Rollups updated with {merged} new measurement(s)")
+    finally:
+        conn.close()
@@ -1,38 +1,182 @@
 import csv
-from io import BytesIO, StringIO
-from flask import g
+import os
+from io import BytesIO, RawIOBase, StringIO
+from threading import Lock
+from flask import g, request
 import sqlite3
 import logging
+from metrics import count_rows, stage
 
 logger = logging.getLogger(__name__)
 
+DB_PATH = "data/air.db"
 
-def get_db():
+# One database per region, so each region's tables, indexes and caches only hold its own data and
+# a region can be reloaded without locking the others. Requests pick theirs with DATASET_PARAM.
+DATASETS = {
+    "oxford": DB_PATH,
+    "london": "data/london.db",
+}
+DEFAULT_DATASET = "oxford"
+DATASET_PARAM = "location-data-selection"
+
+# Column headers used for CSV exports
+CSV_HEADERS = ['Location', 'Sub-location', 'Pollutant', 'Value', 'Status', 'Date']
+
+# Download formats - {format: (mimetype, file extension)}
+EXPORT_FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+    "arrow": ("application/vnd.apache.arrow.file", ".arrow"),
+}
+# Rows per Parquet row group / Arrow record batch - each is built from one chunk of the cursor
+ARROW_BATCH_ROWS = 100000
+
+# Settings for the app's connections - the app only reads, ingest writes through its own
+# connection (data/db_connection.py), and the db is in WAL mode so the two don't block each other
+READ_PRAGMAS = (
+    "PRAGMA query_only = ON",
+    "PRAGMA mmap_size = 268435456",  # 256 MB - read pages straight from the OS page cache
+    "PRAGMA cache_size = -32000",    # 32 MB page cache per connection
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Maximum number of idle connections kept for reuse, per dataset
+MAX_IDLE_CONNECTIONS = 8
+
+_idle_connections = {dataset: [] for dataset in DATASETS}
+_pool_lock = Lock()
+
+
+class DatasetConnection(sqlite3.Connection):
+    """sqlite3 connection that knows which dataset's database it is connected to."""
+    dataset = DEFAULT_DATASET
+
+
+def current_dataset():
+    """Get the dataset the current request is for.
+
+    Returns:
+        str: The DATASET_PARAM request parameter if it names a dataset with a database, otherwise
+        DEFAULT_DATASET
+    """
+    dataset = (request.args.get(DATASET_PARAM) or DEFAULT_DATASET).lower()
+    # Fall back to the default until a region's database has been created
+    if dataset not in DATASETS or not os.path.exists(DATASETS[dataset]):
+        return DEFAULT_DATASET
+    return dataset
+
+
+def connect_db(dataset: str = DEFAULT_DATASET):
+    """Open a new read-only connection to a dataset's air quality database.
+
+    Args:
+        dataset (str, optional): Dataset to connect to, a key of DATASETS. Defaults to DEFAULT_DATASET.
+
+    Returns:
+        DatasetConnection: Database connection object with Row factory enabled
+
+    Raises:
+        sqlite3.OperationalError: If the dataset's database hasn't been created
+
+    Notes:
+        - Not tied to the request context, the caller is responsible for closing it
+        - Prefer acquire_db() / release_db(), which reuse connections instead of opening new ones
+        - Can be shared between threads, but only used by one at a time
+    """
+    path = DATASETS[dataset]
+    # sqlite3 would create an empty database - fail instead so the caller can report it
+    if not os.path.exists(path):
+        raise sqlite3.OperationalError(f"No database for the {dataset} dataset at {path}")
+
+    db = sqlite3.connect(path, check_same_thread=False, factory=DatasetConnection)
+    db.dataset = dataset
+    db.row_factory = sqlite3.Row
+    for pragma in READ_PRAGMAS:
+        db.execute(pragma)
+    return db
+
+
+def acquire_db(dataset: str = DEFAULT_DATASET):
+    """Take a read-only connection to a dataset from the pool, opening a new one if none are idle.
+
+    Args:
+        dataset (str, optional): Dataset to connect to, a key of DATASETS. Defaults to DEFAULT_DATASET.
+
+    Returns:
+        DatasetConnection: Database connection object with Row factory enabled
+
+    Notes:
+        - Must be handed back with release_db() once finished with
+        - Used directly where a connection has to outlive the request, e.g. streamed downloads
+    """
+    with _pool_lock:
+        if _idle_connections[dataset]:
+            return _idle_connections[dataset].pop()
+    return connect_db(dataset)
+
+
+def release_db(db):
+    """Return a connection taken with acquire_db() to the pool.
+
+    Any open transaction is rolled back so the next user starts from the latest data. Once
+    MAX_IDLE_CONNECTIONS are idle for the connection's dataset, further connections are closed instead.
+
+    Args:
+        db (DatasetConnection): Database connection object
+    """
+    try:
+        if db.in_transaction:
+            db.rollback()
+        # Connections with other databases attached (see attach_datasets()) aren't reused
+        if len(db.execute("PRAGMA database_list").fetchall()) > 2:
+            db.close()
+            return
+    except sqlite3.Error as e:
+        logger.warning(f"Discarding database connection: {e}")
+        db.close()
+        return
+
+    with _pool_lock:
+        if len(_idle_connections[db.dataset]) < MAX_IDLE_CONNECTIONS:
+            _idle_connections[db.dataset].append(db)
+            return
+    db.close()
+
+
+def get_db(dataset: str = None):
     """Get or create a database connection for the current request.
 
-        Creates a new SQLite connection if one doesn't exist for the current request
-        context, storing it in Flask's g object. Subsequent calls within the same
+        Takes a pooled read-only connection if there isn't one for the dataset in the current
+        request context, storing it in Flask's g object. Subsequent calls within the same
         request context will return the existing connection.
 
+        Args:
+            dataset (str, optional): Dataset to connect to. Defaults to current_dataset(), the
+                dataset selected by the request.
+
         Returns:
-            sqlite3.Connection: Database connection object with Row factory enabled
+            DatasetConnection: Database connection object with Row factory enabled
 
         Notes:
             - Uses Flask's g object for request-scoped connection management
-            - Connects to 'data/air.db' SQLite database
+            - Connects to the dataset's SQLite database in DATASETS (e.g. 'data/air.db' for Oxford)
             - Sets sqlite3.Row as row_factory for dictionary-like row access
+            - Connections are reused across requests, so there is no per-request connection setup
             - Should be used in conjunction with close_db() for proper cleanup
         """
-    if 'db' not in g:
-        g.db = sqlite3.connect("data/air.db")
-        g.db.row_factory = sqlite3.Row
-    return g.db
+    dataset = dataset or current_dataset()
+    if 'dbs' not in g:
+        g.dbs = {}
+    if dataset not in g.dbs:
+        g.dbs[dataset] = acquire_db(dataset)
+    return g.dbs[dataset]
 
 
 def close_db(e=None):
-    """Close the database connection at the end of a request.
+    """Release the database connection at the end of a request.
 
-    Safely removes and closes the database connection stored in Flask's g object.
+    Safely removes the database connections stored in Flask's g object and returns them to the pool.
     Designed to be used as a teardown function for Flask's application context.
 
     Args:
@@ -43,14 +187,110 @@ def close_db(e=None):
         - Should be registered with @app.teardown_appcontext decorator
         - Safely handles cases where no database connection exists
         - Companion function to get_db()
-        - Will close connection even if an error occurred during the request
+        - Will release the connections even if an error occurred during the request
     """
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
+    for db in g.pop('dbs', {}).values():
+        release_db(db)
+
+
+def get_data_version(db):
+    """Get the current data version of the database.
 
+    The version is a counter in the meta table that ingest bumps whenever it changes the data
+    (see data/data_version.py). It is used to tell when cached results are out of date.
 
-def get_filtered_results(db, main_location=None, sub_location=None, pollutant=None, limit: int = 14, sort: str = "DESC"):
+    Args:
+        db (sqlite3.Connection): Database connection object
+
+    Returns:
+        int: Current data version, 0 if ingest has never set one
+    """
+    row = db.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+    return row[0] if row else 0
+
+
+def get_reference_data(db):
+    """Load the location -> sub-location -> pollutant combinations that have measurements.
+
+    Read from the per-series high-water marks (one row per sub-location and pollutant with data),
+    so it is a small query however many measurements are held. Used to fill the filter dropdowns
+    with only the combinations that return results.
+
+    Args:
+        db (sqlite3.Connection): Database connection object
+
+    Returns:
+        dict: {location name: {sub-location name: [pollutant names]}}, each level in id order
+    """
+    rows = db.execute("""
+        SELECT locations.name AS loc_name, sub_locations.name AS sub_name, pollutants.name AS pollutant_name
+        FROM series_watermarks
+        JOIN sub_locations ON sub_locations.sub_location_id = series_watermarks.sub_location_id
+        JOIN locations ON locations.location_id = sub_locations.location_id
+        JOIN pollutants ON pollutants.pollutant_id = series_watermarks.pollutant_id
+        ORDER BY locations.location_id, sub_locations.sub_location_id, pollutants.pollutant_id
+    """)
+
+    reference = {}
+    for row in rows:
+        reference.setdefault(row["loc_name"], {}).setdefault(row["sub_name"], []).append(row["pollutant_name"])
+    return reference
+
+
+def attach_datasets(db):
+    """Attach the other datasets' databases to a connection, for queries across datasets.
+
+    Each database is attached under its dataset name, e.g. london.measurements, while the
+    connection's own dataset stays "main". Datasets without a database yet are skipped.
+
+    Args:
+        db (DatasetConnection): Database connection object, not inside a transaction
+
+    Returns:
+        dict: {dataset: schema name} for every dataset now readable on the connection, the
+        connection's own dataset first
+
+    Notes:
+        - release_db() closes connections with databases attached rather than pooling them
+    """
+    attached = {row["name"] for row in db.execute("PRAGMA database_list")}
+    schemas = {db.dataset: "main"}
+    for dataset, path in DATASETS.items():
+        if dataset == db.dataset or not os.path.exists(path):
+            continue
+        if dataset not in attached:
+            # Schema names can't be bound as parameters - they come from DATASETS, not the request
+            db.execute(f'ATTACH DATABASE ? AS "{dataset}"', (path,))
+        schemas[dataset] = dataset
+    return schemas
+
+
+def get_dataset_summary(db):
+    """Size and date range of every dataset, read in one query across the attached databases.
+
+    Args:
+        db (DatasetConnection): Database connection object, not inside a transaction
+
+    Returns:
+        list[dict]: Per dataset - dataset, series (location/pollutant pairs with data),
+        measurements, first_measured_at and last_measured_at
+    """
+    schemas = attach_datasets(db)
+    # Counts come from the monthly rollups and the ends of the date range from the series
+    # watermarks and the measured_at index, so each part is a small read whatever the dataset size
+    query = " UNION ALL ".join(f"""
+        SELECT
+            ? AS dataset,
+            (SELECT COUNT(*) FROM "{schema}".series_watermarks) AS series,
+            (SELECT COALESCE(SUM(count), 0) FROM "{schema}".measurement_rollups WHERE period = 'month') AS measurements,
+            (SELECT MIN(measured_at) FROM "{schema}".measurements) AS first_measured_at,
+            (SELECT MAX(last_measured_at) FROM "{schema}".series_watermarks) AS last_measured_at
+    """ for schema in schemas.values())
+    return [dict(row) for row in db.execute(query, list(schemas))]
+
+
+def get_filtered_results(db, main_location=None, sub_location=None, pollutant=None, limit: int = 14, sort: str = "DESC",
+                         after: tuple = None, before: tuple = None):
     """Retrieve filtered air quality measurements from the database.
 
     Executes a SQL query to fetch air quality measurements with optional filtering
@@ -64,6 +304,10 @@ def get_filtered_results(db, main_location=None, sub_location=None, pollutant=No
         pollutant (str, optional): Pollutant name to filter by. Defaults to None.
         limit (int, optional): Maximum number of records to return. Defaults to 14.
         sort (str, optional): Sort records in ascending or descending order. Defaults to Descending
+        after (tuple, optional): (measured_at, measurement_id) keyset cursor - only return records
+            that come after this one in the sort order. Defaults to None.
+        before (tuple, optional): (measured_at, measurement_id) keyset cursor - only return the records
+            immediately before this one in the sort order. Defaults to None.
 
     Returns:
         list[sqlite3.Row]: List of measurement records with the following fields:
@@ -73,6 +317,7 @@ def get_filtered_results(db, main_location=None, sub_location=None, pollutant=No
             - value (float): Measurement value
             - status (str): Measurement status
             - measured_at (str): Measurement date
+            - measurement_id (int): Measurement id, used with measured_at as the keyset cursor
 
     Raises:
         sqlite3.Error: If there's an error executing the database query
@@ -82,6 +327,272 @@ def get_filtered_results(db, main_location=None, sub_location=None, pollutant=No
         - Results are ordered by measurement date (newest first)
         - All string matching is exact (case-sensitive)
         - Uses parameterized queries for SQL injection prevention
+        - after/before page from a cursor position using the indexes, so a deep page costs the
+          same as the first one. Results are always returned in the requested sort order.
+    """
+
+    query, params = _build_filtered_query(db, main_location, sub_location, pollutant, limit, sort, after, before)
+
+    try:
+        # Execute the query with the query and params and return for handing to the web page
+        with stage("sql_execute"):
+            cursor = db.execute(query, params)
+        with stage("sql_fetch"):
+            rows = cursor.fetchall()
+        count_rows(len(rows))
+        if before is not None:
+            # Rows before the cursor are read backwards from it, so flip them back into sort order
+            rows.reverse()
+        return rows
+
+    except sqlite3.Error as e:
+        logger.error(f"Database error in get_filtered_results: {e}")
+        raise
+
+
+def get_filtered_page(db, main_location=None, sub_location=None, pollutant=None, limit: int = 14,
+                      sort: str = "DESC", after: tuple = None, before: tuple = None, store=None):
+    """Retrieve one page of filtered air quality measurements with cursors for the pages either side.
+
+    Wraps get_filtered_results() (or the in-memory store's equivalent), fetching one extra record
+    to find out if there is another page in the direction of travel.
+
+    Args:
+        db (sqlite3.Connection): Database connection object
+        main_location (str, optional): Main location name to filter by. Defaults to None.
+        sub_location (str, optional): Sub-location name to filter by. Defaults to None.
+        pollutant (str, optional): Pollutant name to filter by. Defaults to None.
+        limit (int, optional): Number of records per page. Defaults to 14.
+        sort (str, optional): Sort records in ascending or descending order. Defaults to Descending
+        after (tuple, optional): Cursor of the last record on the previous page. Defaults to None.
+        before (tuple, optional): Cursor of the first record on the next page. Defaults to None.
+        store (SeriesStore, optional): Loaded in-memory store to read from instead of the db.
+            Defaults to None.
+
+    Returns:
+        tuple: (rows, prev_cursor, next_cursor) where rows is the list of records (sqlite3.Row or dict) for
+        the page and the cursors are strings (see encode_cursor()), or None if there is no page
+        in that direction
+    """
+    if store is not None:
+        with stage("store_query"):
+            rows = store.get_filtered_results(main_location, sub_location, pollutant, limit + 1, sort, after, before)
+        count_rows(len(rows), "store_query")
+    else:
+        rows = get_filtered_results(db, main_location, sub_location, pollutant, limit + 1, sort, after, before)
+    has_more = len(rows) > limit
+
+    if before is not None:
+        # The extra record is the furthest from the cursor, which is the first one once reversed
+        rows = rows[1:] if has_more else rows
+        has_prev, has_next = has_more, True
+    else:
+        rows = rows[:limit]
+        has_prev, has_next = after is not None, has_more
+
+    prev_cursor = encode_cursor(rows[0]) if has_prev and rows else None
+    next_cursor = encode_cursor(rows[-1]) if has_next and rows else None
+
+    return rows, prev_cursor, next_cursor
+
+
+def encode_cursor(row):
+    """Encode a measurement row's position as a keyset cursor string for use in URLs.
+
+    Returns:
+        str: Cursor in the format "{measured_at}_{measurement_id}"
+    """
+    return f"{row['measured_at']}_{row['measurement_id']}"
+
+
+def decode_cursor(cursor):
+    """Decode a keyset cursor string created by encode_cursor().
+
+    Returns:
+        tuple[str, int] | None: (measured_at, measurement_id), or None if the cursor is missing or invalid
+    """
+    if not cursor:
+        return None
+    try:
+        measured_at, measurement_id = cursor.rsplit("_", 1)
+        return measured_at, int(measurement_id)
+    except ValueError:
+        return None
+
+
+def iter_filtered_results(db, main_location=None, sub_location=None, pollutant=None, limit: int = None,
+                          sort: str = "DESC", chunk_size: int = 1000):
+    """Stream filtered air quality measurements from the database in chunks.
+
+    Runs the same query as get_filtered_results() but, instead of loading every row into
+    memory, walks the cursor with fetchmany() so only one chunk of rows is held at a time.
+
+    Args:
+        db (sqlite3.Connection): Database connection object
+        main_location (str, optional): Main location name to filter by. Defaults to None.
+        sub_location (str, optional): Sub-location name to filter by. Defaults to None.
+        pollutant (str, optional): Pollutant name to filter by. Defaults to None.
+        limit (int, optional): Maximum number of records to return. Defaults to None (no limit).
+        sort (str, optional): Sort records in ascending or descending order. Defaults to Descending
+        chunk_size (int, optional): Number of rows fetched from the cursor per chunk. Defaults to 1000.
+
+    Returns:
+        generator[list[sqlite3.Row]]: Generator yielding lists of at most chunk_size rows,
+        with the same fields as get_filtered_results()
+
+    Raises:
+        sqlite3.Error: If there's an error executing the database query
+
+    Notes:
+        - The query is executed straight away so errors are raised to the caller before
+          any streaming starts, only the fetching is deferred
+        - The connection must stay open until the generator has been consumed
+    """
+    query, params = _build_filtered_query(db, main_location, sub_location, pollutant, limit, sort)
+
+    try:
+        with stage("sql_execute"):
+            cursor = db.execute(query, params)
+    except sqlite3.Error as e:
+        logger.error(f"Database error in iter_filtered_results: {e}")
+        raise
+
+    def chunks():
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+    return chunks()
+
+
+def count_filtered_results(db, main_location=None, sub_location=None, pollutant=None):
+    """Count the air quality measurements matching the filters, e.g. to show an export's progress.
+
+    Args:
+        db (sqlite3.Connection): Database connection object
+        main_location (str, optional): Main location name to filter by. Defaults to None.
+        sub_location (str, optional): Sub-location name to filter by. Defaults to None.
+        pollutant (str, optional): Pollutant name to filter by. Defaults to None.
+
+    Returns:
+        int: Number of rows iter_filtered_results() returns for the same filters, with no limit
+
+    Raises:
+        sqlite3.Error: If there's an error executing the database query
+    """
+    query = "SELECT COUNT(*) FROM measurements WHERE 1=1"
+    params = []
+    sub_location_ids, pollutant_ids = _resolve_filter_ids(db, main_location, sub_location, pollutant)
+    for column, ids in (("sub_location_id", sub_location_ids), ("pollutant_id", pollutant_ids)):
+        if ids is None:
+            continue
+        if not ids:
+            return 0
+        # No ORDER BY to keep, so an IN list can use the indexes here
+        query += f" AND {column} IN ({', '.join('?' * len(ids))})"
+        params.extend(ids)
+
+    try:
+        with stage("sql_execute"):
+            return db.execute(query, params).fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"Database error in count_filtered_results: {e}")
+        raise
+
+
+def iter_series(db, main_location=None, sub_location=None, pollutant=None):
+    """Read the matching measurements one location/pollutant series at a time, in date order.
+
+    Args:
+        db (sqlite3.Connection): Database connection object
+        main_location (str, optional): Main location name to filter by. Defaults to None.
+        sub_location (str, optional): Sub-location name to filter by. Defaults to None.
+        pollutant (str, optional): Pollutant name to filter by. Defaults to None.
+
+    Returns:
+        generator[tuple]: (location name, sub-location name, pollutant name, measured_at list,
+        value list) for each series with data, ordered by sub-location and pollutant id
+
+    Notes:
+        - Each series is read from the unique (sub_location_id, pollutant_id, measured_at) index,
+          so the rows come back in date order without a sort
+    """
+    sub_location_ids, pollutant_ids = _resolve_filter_ids(db, main_location, sub_location, pollutant)
+
+    query = """
+            SELECT w.sub_location_id, w.pollutant_id, locations.name, sub_locations.name, pollutants.name
+            FROM series_watermarks w
+            JOIN sub_locations ON sub_locations.sub_location_id = w.sub_location_id
+            JOIN locations ON locations.location_id = sub_locations.location_id
+            JOIN pollutants ON pollutants.pollutant_id = w.pollutant_id
+            WHERE 1=1
+    """
+    params = []
+    for column, ids in (("w.sub_location_id", sub_location_ids), ("w.pollutant_id", pollutant_ids)):
+        if ids is None:
+            continue
+        query += f" AND {column} IN ({', '.join('?' * len(ids))})" if ids else " AND 0"
+        params.extend(ids)
+    query += " ORDER BY w.sub_location_id, w.pollutant_id"
+
+    for sub_location_id, pollutant_id, loc_name, sub_name, pollutant_name in db.execute(query, params).fetchall():
+        rows = db.execute("""
+            SELECT measured_at, value
+            FROM measurements
+            WHERE sub_location_id = ? AND pollutant_id = ?
+            ORDER BY measured_at
+        """, (sub_location_id, pollutant_id)).fetchall()
+        measured_at, values = zip(*rows) if rows else ((), ())
+        yield loc_name, sub_name, pollutant_name, list(measured_at), list(values)
+
+
+def _resolve_filter_ids(db, main_location=None, sub_location=None, pollutant=None):
+    """Resolve the location and pollutant filter names to their ids.
+
+    Returns:
+        tuple[list[int] | None, list[int] | None]: The matching sub-location ids and pollutant ids,
+        None where the filter wasn't set. An empty list means the filter matched nothing.
+    """
+    sub_location_ids = None
+    if (main_location and main_location.strip()) or (sub_location and sub_location.strip()):
+        query = """
+                SELECT sub_locations.sub_location_id
+                FROM sub_locations
+                JOIN locations ON locations.location_id = sub_locations.location_id
+                WHERE 1=1
+        """
+        params = []
+        if main_location and main_location.strip():
+            query += " AND locations.name = ?"
+            params.append(main_location)
+        if sub_location and sub_location.strip():
+            query += " AND sub_locations.name = ?"
+            params.append(sub_location)
+        sub_location_ids = [row[0] for row in db.execute(query, params)]
+
+    pollutant_ids = None
+    if pollutant and pollutant.strip():
+        pollutant_ids = [row[0] for row in db.execute(
+            "SELECT pollutant_id FROM pollutants WHERE name = ?", (pollutant,)
+        )]
+
+    return sub_location_ids, pollutant_ids
+
+
+def _build_filtered_query(db, main_location=None, sub_location=None, pollutant=None, limit: int = None,
+                          sort: str = "DESC", after: tuple = None, before: tuple = None):
+    """Build the SQL and parameters shared by the filtered measurement queries.
+
+    The filter names are resolved to ids up front (small indexed lookups) so the measurements
+    table is only ever filtered on its own id columns, which lets SQLite read the rows in date
+    order straight from one of the composite indexes rather than sorting them.
+
+    A before cursor reverses the sort order of the query, the caller has to reverse the rows back.
+
+    Returns:
+        tuple[str, list]: The SQL query string and the list of parameters to bind to it
     """
 
     query = '''
@@ -91,7 +602,8 @@ def get_filtered_results(db, main_location=None, sub_location=None, pollutant=No
                 pollutants.name as pollutant_name,
                 value,
                 status,
-                measured_at
+                measured_at,
+                measurements.measurement_id
             FROM measurements
             JOIN sub_locations ON sub_locations.sub_location_id = measurements.sub_location_id
             JOIN locations ON locations.location_id = sub_locations.location_id
@@ -101,29 +613,43 @@ def get_filtered_results(db, main_location=None, sub_location=None, pollutant=No
 
     # Build parameters list & append variables as needed/present
     params = []
-    if main_location and main_location.strip():
-        query += " AND locations.name = ?"
-        params.append(main_location)
-
-    if sub_location and sub_location.strip():
-        query += " AND sub_locations.name = ?"
-        params.append(sub_location)
-
-    if pollutant and pollutant.strip():
-        query += " AND pollutants.name = ?"
-        params.append(pollutant)
+    sub_location_ids, pollutant_ids = _resolve_filter_ids(db, main_location, sub_location, pollutant)
+
+    for column, ids in (("sub_location_id", sub_location_ids), ("pollutant_id", pollutant_ids)):
+        if ids is None:
+            continue
+        if not ids:
+            # Filter matched nothing so there are no results
+            query += " AND 0"
+        elif len(ids) == 1:
+            query += f" AND measurements.{column} = ?"
+            params.extend(ids)
+        else:
+            # The unary + stops SQLite using an index for an IN list, as that would need a sort
+            # afterwards - walking a date ordered index and filtering is cheaper with a LIMIT
+            query += f" AND +measurements.{column} IN ({', '.join('?' * len(ids))})"
+            params.extend(ids)
+
+    # Sort direction is formatted into the SQL so only allow the two valid values through
+    sort = "ASC" if str(sort).upper() == "ASC" else "DESC"
+
+    # Keyset pagination - continue from the cursor row rather than skipping rows with an OFFSET
+    if after is not None:
+        query += f" AND (measured_at, measurements.measurement_id) {'<' if sort == 'DESC' else '>'} (?, ?)"
+        params.extend(after)
+    elif before is not None:
+        query += f" AND (measured_at, measurements.measurement_id) {'>' if sort == 'DESC' else '<'} (?, ?)"
+        params.extend(before)
+        sort = "ASC" if sort == "DESC" else "DESC"
 
     # add the final line which is to filter in decending order and define num records
-    query += f" ORDER BY measured_at {sort} LIMIT {limit}"
+    # measurement_id breaks ties between rows on the same date so the order is stable
+    query += f" ORDER BY measured_at {sort}, measurements.measurement_id {sort}"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(int(limit))
 
-    try:
-        # Execute the query with the query and params and return for handing to the web page
-        cursor = db.execute(query, params)
-        return cursor.fetchall()
-
-    except sqlite3.Error as e:
-        logger.error(f"Database error in get_filtered_results: {e}")
-        raise
+    return query, params
 
 
 def generate_csv(query_data):
@@ -162,8 +688,7 @@ def generate_csv(query_data):
 
         # Get the header rows from the input
         if query_data:
-            headers = ['Location', 'Sub-location', 'Pollutant', 'Value', 'Status', 'Date']
-            writer.writerow(headers)  # Write the headers to the buffer - first row
+            writer.writerow(CSV_HEADERS)  # Write the headers to the buffer - first row
 
             # For each row in the dataset pull out the data for each column and write to the buffer
             for row in query_data:
@@ -183,3 +708,147 @@ def generate_csv(query_data):
     binary_buffer.seek(0)
 
     return binary_buffer
+
+
+def stream_csv(row_chunks):
+    """Convert chunks of database query results into a stream of encoded CSV data.
+
+    Companion to iter_filtered_results() for serving large exports. The header row is
+    yielded straight away, then each chunk of rows is written to a small reusable buffer,
+    encoded and yielded, so memory use stays flat however many rows are exported.
+
+    Args:
+        row_chunks (iterable[list[sqlite3.Row]]): Chunks of measurement rows, with the same
+            fields as expected by generate_csv()
+
+    Returns:
+        generator[bytes]: UTF-8 encoded CSV data, starting with the header row. Columns are:
+        Location, Sub-location, Pollutant, Value, Status, Date
+
+    Notes:
+        - Suitable for passing directly to a flask.Response for a streamed download
+        - Unlike generate_csv() the header row is always written, even for empty results
+    """
+
+    string_buffer = StringIO(newline="")
+    writer = csv.writer(string_buffer)
+
+    writer.writerow(CSV_HEADERS)
+    yield string_buffer.getvalue().encode("utf-8")
+
+    for rows in row_chunks:
+        # Reset the buffer so only the current chunk is held in memory
+        string_buffer.seek(0)
+        string_buffer.truncate(0)
+
+        writer.writerows(
+            (row['loc_name'], row['sub_name'], row['pollutant_name'], row['value'], row['status'],
+             row['measured_at'])
+            for row in rows
+        )
+        yield string_buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(RawIOBase):
+    """Write-only file object that holds what's written until it's taken with drain()."""
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def stream_arrow(row_chunks, file_format: str = "parquet"):
+    """Convert chunks of database query results into a stream of Parquet or Arrow IPC data.
+
+    Companion to stream_csv() for the typed download formats. Each chunk of rows becomes one
+    Parquet row group / Arrow record batch, which is written and yielded before the next chunk
+    is read, so memory use stays flat however many rows are exported.
+
+    Args:
+        row_chunks (iterable[list[sqlite3.Row]]): Chunks of measurement rows, with the same
+            fields as expected by generate_csv() - see iter_filtered_results()
+        file_format (str, optional): "parquet" or "arrow" (Arrow IPC file, aka Feather v2).
+            Defaults to "parquet".
+
+    Returns:
+        generator[bytes]: The file's bytes. Columns are the CSV_HEADERS, with Location,
+        Sub-location, Pollutant and Status dictionary encoded (categoricals in pandas), Value
+        as float64 and Date as a timestamp
+
+    Raises:
+        ImportError: If pyarrow isn't installed - raised straight away, before any streaming starts
+        ValueError: If file_format isn't "parquet" or "arrow"
+
+    Notes:
+        - The dictionaries only ever grow, so each batch shares the codes of the ones before it and
+          the Arrow writer only has to send the new names (dictionary deltas)
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+
+    dictionary_type = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema([
+        (CSV_HEADERS[0], dictionary_type),
+        (CSV_HEADERS[1], dictionary_type),
+        (CSV_HEADERS[2], dictionary_type),
+        (CSV_HEADERS[3], pa.float64()),
+        (CSV_HEADERS[4], dictionary_type),
+        (CSV_HEADERS[5], pa.timestamp("s")),
+    ])
+
+    sink = _ChunkSink()
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    elif file_format == "arrow":
+        writer = ipc.new_file(sink, schema, options=ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+    else:
+        raise ValueError(f"Unknown export format: {file_format}")
+
+    # {name: code} for each dictionary encoded column - codes are the positions in the dictionary
+    lookups = {column: {} for column in (0, 1, 2, 4)}
+
+    def encode(column, names):
+        lookup = lookups[column]
+        codes = [lookup.setdefault(name, len(lookup)) for name in names]
+        dictionary = pa.array(list(lookup), type=pa.string())
+        return pa.DictionaryArray.from_arrays(pa.array(codes, type=pa.int32()), dictionary)
+
+    def batches():
+        try:
+            for rows in row_chunks:
+                if not rows:
+                    continue
+                loc_names, sub_names, pollutant_names, values, statuses, measured_at = list(zip(*rows))[:6]
+                writer.write_batch(pa.record_batch([
+                    encode(0, loc_names),
+                    encode(1, sub_names),
+                    encode(2, pollutant_names),
+                    pa.array(values, type=pa.float64()),
+                    encode(4, statuses),
+                    pc.cast(pa.array(measured_at, type=pa.string()), pa.timestamp("s")),
+                ], schema=schema))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
+
+    return batches()
@@ -0,0 +1,253 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from database_helpers import ARROW_BATCH_ROWS, EXPORT_FORMATS, acquire_db, count_filtered_results, \
+    iter_filtered_results, release_db, stream_arrow, stream_csv
+
+logger = logging.getLogger(__name__)
+
+# Where export files are written - shared by every worker process of the app, so any of them can
+# report a job's progress and serve its file
+DEFAULT_EXPORT_DIR = os.path.join(tempfile.gettempdir(), "airaware-exports")
+# Exports written at once - each holds a db connection and a cursor for as long as it runs
+DEFAULT_WORKERS = 2
+# Seconds a finished export is kept for reuse / download after it was last asked for
+DEFAULT_MAX_AGE = 3600
+
+# Rows read per chunk of a CSV export - Parquet / Arrow exports read a row group at a time
+CSV_CHUNK_ROWS = 10000
+# Seconds between progress updates of a running export's status file
+PROGRESS_INTERVAL = 1.0
+# A status file left "running" and not updated for this long belongs to an export that died with
+# its process - starting the same export again restarts it
+STALE_AFTER = 60
+
+# Filters an export takes, with the same names as iter_filtered_results()
+EXPORT_FILTERS = ("main_location", "sub_location", "pollutant", "sort")
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def export_id(dataset: str, data_version, filters: dict, file_format: str):
+    """Id of the export of a filter set - the same filters, format and data always give the same id.
+
+    Returns:
+        str: 32 character hex digest
+    """
+    key = json.dumps([dataset, data_version, [filters.get(name) for name in EXPORT_FILTERS], file_format])
+    return hashlib.sha1(key.encode()).hexdigest()[:32]
+
+
+class ExportJobs:
+    """Background exports of filtered measurements, written to files for download once finished.
+
+    An export is identified by its dataset, data version, filters and format (see export_id()), so
+    starting one that is already running or finished returns that export rather than a new one. Each
+    export's file and a JSON status file (status, rows written, total rows) are kept in directory,
+    which lets every worker process of the app report on and serve exports started by the others.
+
+    Args:
+        directory (str, optional): Directory for the export and status files. Defaults to DEFAULT_EXPORT_DIR.
+        workers (int, optional): Exports written at once, the rest queue. Defaults to DEFAULT_WORKERS.
+        max_age (int, optional): Seconds finished exports are kept after last being asked for.
+            Defaults to DEFAULT_MAX_AGE.
+    """
+
+    def __init__(self, directory: str = DEFAULT_EXPORT_DIR, workers: int = DEFAULT_WORKERS,
+                 max_age: int = DEFAULT_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="export")
+        # Status of the exports queued or running in this process, by id
+        self._active = {}
+        self._lock = Lock()
+
+    def start(self, dataset: str, data_version, filters: dict, file_format: str = "csv"):
+        """Start exporting the measurements matching the filters, or reuse the same export.
+
+        Args:
+            dataset (str): Dataset to export, a key of DATASETS
+            data_version (int): Current data version of the dataset (see get_data_version())
+            filters (dict): Any of EXPORT_FILTERS - unset filters are left out
+            file_format (str, optional): "csv", "parquet" or "arrow". Defaults to "csv".
+
+        Returns:
+            dict: The export's status, see status()
+
+        Raises:
+            ValueError: If the format isn't one of EXPORT_FORMATS
+        """
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {file_format}")
+        filters = {name: filters.get(name) or None for name in EXPORT_FILTERS}
+        filters["sort"] = "ASC" if str(filters["sort"]).upper() == "ASC" else "DESC"
+        job_id = export_id(dataset, data_version, filters, file_format)
+
+        with self._lock:
+            status = self._active.get(job_id) or self._read_status(job_id)
+            if self._reusable(status):
+                if status["status"] == "done":
+                    self._touch(status)
+                return self._public(status)
+
+            now = time.time()
+            status = {"id": job_id, "dataset": dataset, "data_version": data_version, "filters": filters,
+                      "format": file_format, "status": "queued", "rows": 0, "total_rows": None, "error": None,
+                      "created_at": now, "updated_at": now}
+            self._active[job_id] = status
+            self._write_status(status)
+
+        self._remove_expired()
+        self._executor.submit(self._run, status)
+        return self._public(status)
+
+    def status(self, job_id: str):
+        """Status of an export.
+
+        Returns:
+            dict | None: id, dataset, format, filters, status ("queued", "running", "done" or "failed"),
+            rows written, total_rows (None until counted), progress (0 to 1) and error (failed exports),
+            or None if there's no such export or its file has expired
+        """
+        if not _JOB_ID.match(job_id):
+            return None
+        with self._lock:
+            status = self._active.get(job_id) or self._read_status(job_id)
+        if status is None or (status["status"] == "done"
+                              and not os.path.exists(self._file_path(job_id, status["format"]))):
+            return None
+        return self._public(status)
+
+    def finished(self, job_id: str):
+        """Status and file path of a finished export, read together so they can't disagree.
+
+        Returns:
+            tuple[dict, str] | None: The export's status (see status()) and the path of its file, or
+            None if it isn't finished (or doesn't exist)
+        """
+        status = self.status(job_id)
+        if status is None or status["status"] != "done":
+            return None
+        self._touch(status)
+        return status, self._file_path(job_id, status["format"])
+
+    def shutdown(self):
+        """Stop taking exports, waiting for the running ones to finish."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _run(self, status):
+        path = self._file_path(status["id"], status["format"])
+        # Unique, so an export restarted by another process doesn't write over this one
+        part_path = f"{path}.{uuid.uuid4().hex}.part"
+        db = None
+        try:
+            status["status"] = "running"
+            self._write_status(status)
+
+            db = acquire_db(status["dataset"])
+            # Count and read the rows from one snapshot of the db, so the progress adds up
+            db.execute("BEGIN")
+            where = {name: status["filters"][name] for name in ("main_location", "sub_location", "pollutant")}
+            status["total_rows"] = count_filtered_results(db, **where)
+
+            if status["format"] == "csv":
+                row_chunks = iter_filtered_results(db, chunk_size=CSV_CHUNK_ROWS, **status["filters"])
+                file_data = stream_csv(self._track_progress(row_chunks, status))
+            else:
+                row_chunks = iter_filtered_results(db, chunk_size=ARROW_BATCH_ROWS, **status["filters"])
+                file_data = stream_arrow(self._track_progress(row_chunks, status), status["format"])
+
+            with open(part_path, "wb") as part_file:
+                for data in file_data:
+                    part_file.write(data)
+            # Appears complete or not at all
+            os.replace(part_path, path)
+            status["status"] = "done"
+        except Exception as e:
+            logger.error(f"Export {status['id']} failed: {e}")
+            status["status"] = "failed"
+            status["error"] = str(e) or type(e).__name__
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        finally:
+            if db is not None:
+                release_db(db)
+            with self._lock:
+                self._write_status(status)
+                self._active.pop(status["id"], None)
+
+    def _reusable(self, status):
+        # Caller holds the lock
+        if status is None:
+            return False
+        if status["status"] == "done":
+            return os.path.exists(self._file_path(status["id"], status["format"]))
+        if status["status"] in ("queued", "running"):
+            return status["id"] in self._active or time.time() - status["updated_at"] < STALE_AFTER
+        return False  # Failed - try again
+
+    def _touch(self, status):
+        # Asked for again - keep the export for another max_age
+        try:
+            os.utime(self._file_path(status["id"], status["format"]))
+            os.utime(self._status_path(status["id"]))
+        except OSError:
+            pass  # Expired in the meantime
+
+    def _track_progress(self, row_chunks, status):
+        last_update = time.time()
+        for rows in row_chunks:
+            status["rows"] += len(rows)
+            if time.time() - last_update >= PROGRESS_INTERVAL:
+                self._write_status(status)
+                last_update = time.time()
+            yield rows
+
+    def _file_path(self, job_id, file_format):
+        return os.path.join(self.directory, job_id + EXPORT_FORMATS[file_format][1])
+
+    def _status_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _read_status(self, job_id):
+        try:
+            with open(self._status_path(job_id), mode="r") as status_file:
+                return json.load(status_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_status(self, status):
+        status["updated_at"] = time.time()
+        temp_path = f"{self._status_path(status['id'])}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, mode="w") as status_file:
+            json.dump(status, status_file)
+        os.replace(temp_path, self._status_path(status["id"]))
+
+    def _remove_expired(self):
+        # Files of exports not asked for within max_age, and parts left by processes that died
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            active = set(self._active)
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name[:32] not in active and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass  # Removed by another process
+
+    @staticmethod
+    def _public(status):
+        total_rows = status["total_rows"]
+        progress = 1.0 if status["status"] == "done" else (
+            min(status["rows"] / total_rows, 1.0) if total_rows else 0.0)
+        return {"id": status["id"], "dataset": status["dataset"], "format": status["format"],
+                "filters": dict(status["filters"]), "status": status["status"], "rows": status["rows"],
+                "total_rows": total_rows, "progress": round(progress, 4), "error": status["error"]}
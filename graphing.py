@@ -1,47 +1,337 @@
-from dash import Dash, html, dcc
-import plotly.express as px
-import plotly
-import plotly.graph_objects as go
+import base64
 import json
-import pandas as pd
-from pprint import pprint
+from datetime import date
+from functools import lru_cache
+import numpy as np
+from metrics import count_rows, stage
 
+try:
+    import orjson
+except ImportError:  # Optional - figures are serialised with the json module without it
+    orjson = None
 
-def build_graph():
-    # Example 1: Simple line chart
-    x = [1, 2, 3, 4, 5]
-    y = [2, 4, 6, 8, 10]
+# plotly and pandas take most of a second to import, so they are imported on the first figure
+# build (or by prewarm()) rather than when the app and data scripts start
+
+# Oldest plotly.js that reads base64 typed arrays ({"dtype": ..., "bdata": ...}) - older bundles get lists
+BINARY_ARRAYS_PLOTLYJS = (2, 28)
+
+# Bars sent to the browser per trace (location x pollutant) are chosen from the plot's width - about
+# one per PIXELS_PER_POINT, as more than that can't be told apart. Longer series are downsampled,
+# zooming in on a narrower date range brings back the full resolution (see points_per_trace()).
+PIXELS_PER_POINT = 3
+# Plot width assumed when the page doesn't give one (the first render of /graphs). Widths given are
+# clamped to MIN..MAX_PLOT_WIDTH and rounded down to PLOT_WIDTH_STEP, so a few figures cover every screen
+DEFAULT_PLOT_WIDTH = 1200
+MIN_PLOT_WIDTH = 300
+MAX_PLOT_WIDTH = 4000
+PLOT_WIDTH_STEP = 100
+# Bars per trace at the default width
+MAX_POINTS_PER_TRACE = DEFAULT_PLOT_WIDTH // PIXELS_PER_POINT
+
+
+def points_per_trace(start_date: str = None, end_date: str = None, plot_width: int = None):
+    """Pick the maximum number of points per trace for a date window and plot width.
+
+    About one point per PIXELS_PER_POINT of plot width, and never more than the days in the window,
+    so a window that fits is shown at full daily resolution whatever the width.
+
+    Args:
+        start_date (str, optional): First date of the window (YYYY-MM-DD). Defaults to None (the first date held).
+        end_date (str, optional): Last date of the window (YYYY-MM-DD). Defaults to None (the last date held).
+        plot_width (int, optional): Width of the plot in pixels. Defaults to None (DEFAULT_PLOT_WIDTH).
+
+    Returns:
+        int: Points per trace, see series_groups()
+    """
+    width = DEFAULT_PLOT_WIDTH if plot_width is None else min(max(plot_width, MIN_PLOT_WIDTH), MAX_PLOT_WIDTH)
+    points = (width - width % PLOT_WIDTH_STEP) // PIXELS_PER_POINT
+    if start_date and end_date:
+        days = (date.fromisoformat(end_date) - date.fromisoformat(start_date)).days + 1
+        points = min(points, max(days, 1))
+    return points
+
+
+def minmax_indices(y, threshold):
+    """Pick the points to keep when downsampling a series by min/max bucketing.
+
+    The series is split into equal buckets and the lowest and highest point of each bucket are
+    kept, along with the first and last points, so peaks and troughs are never dropped.
+
+    Args:
+        y (numpy.ndarray): Series values, in date order
+        threshold (int): Maximum number of points to keep
+
+    Returns:
+        numpy.ndarray: Indices of the points to keep, in ascending order
+    """
+    n = len(y)
+    num_buckets = (threshold - 2) // 2
+    if n <= threshold or num_buckets < 1:
+        return np.arange(n)
+
+    edges = np.linspace(0, n, num_buckets + 1).astype(int)
+    bucket = np.repeat(np.arange(num_buckets), np.diff(edges))
+
+    keep = [np.array([0, n - 1])]
+    for reduce in (np.minimum, np.maximum):
+        # Position of the first point in each bucket matching the bucket's min (or max)
+        extreme = reduce.reduceat(y, edges[:-1])
+        matches = np.flatnonzero(y == extreme[bucket])
+        _, first = np.unique(bucket[matches], return_index=True)
+        keep.append(matches[first])
+
+    return np.unique(np.concatenate(keep))
+
+
+def series_groups(df, threshold: int = MAX_POINTS_PER_TRACE):
+    """Split the graph data into its location/pollutant series, downsampling each to at most threshold points.
+
+    The rows are grouped once, with a stable sort on integer codes, rather than per series.
+
+    Args:
+        df (pandas.DataFrame): Graph data with location, pollutant, value and date columns
+        threshold (int, optional): Maximum points per series. Defaults to MAX_POINTS_PER_TRACE.
+
+    Returns:
+        tuple: (locations, pollutants, groups) - the location and pollutant names in order of first
+        appearance, and a (location code, pollutant code, row positions) tuple per series, ordered by
+        location then pollutant. Row positions are in their original order.
+    """
+    import pandas as pd
+
+    location_codes, locations = pd.factorize(df["location"], sort=False)
+    pollutant_codes, pollutants = pd.factorize(df["pollutant"], sort=False)
+    values = df["value"].to_numpy(dtype=float)
+    dates = df["date"].to_numpy()
+
+    key = location_codes.astype(np.int64) * max(len(pollutants), 1) + pollutant_codes
+    order = np.argsort(key, kind="stable")
+    starts = np.flatnonzero(np.diff(key[order], prepend=-1))
+
+    groups = []
+    for rows in np.split(order, starts[1:]) if len(order) else ():
+        if len(rows) > threshold:
+            # ISO date strings sort in date order
+            by_date = rows[np.argsort(dates[rows], kind="stable")]
+            rows = np.sort(by_date[minmax_indices(values[by_date], threshold)])
+        groups.append((location_codes[rows[0]], pollutant_codes[rows[0]], rows))
+
+    # Names are ordered by where they first appear in the rows that are kept
+    location_first = np.full(len(locations), len(df))
+    pollutant_first = np.full(len(pollutants), len(df))
+    for location, pollutant, rows in groups:
+        location_first[location] = min(location_first[location], rows[0])
+        pollutant_first[pollutant] = min(pollutant_first[pollutant], rows[0])
+    location_order = np.argsort(location_first, kind="stable")
+    pollutant_order = np.argsort(pollutant_first, kind="stable")
+    location_rank = np.argsort(location_order)
+    pollutant_rank = np.argsort(pollutant_order)
+
+    groups = sorted(((location_rank[location], pollutant_rank[pollutant], rows)
+                     for location, pollutant, rows in groups), key=lambda group: group[:2])
+    return np.asarray(locations)[location_order], np.asarray(pollutants)[pollutant_order], groups
+
+
+def query_daily_means(db, start_date: str = None, end_date: str = None):
+    """Query the daily mean of each location/pollutant series from the rollups.
+
+    Returns:
+        list[sqlite3.Row]: Rows with location, pollutant, value and date fields
+    """
+    # Optional date window, used when zooming in on the graph
+    date_filter = ""
+    params = []
+    if start_date:
+        date_filter += " AND r.period_start >= ?"
+        params.append(start_date)
+    if end_date:
+        date_filter += " AND r.period_start <= ?"
+        params.append(end_date)
+
+    # Read the daily rollups (mean per day) rather than every raw measurement
+    with stage("sql_execute"):
+        cursor = db.execute(f"""
+            SELECT 
+                sl.name as location,
+                p.name as pollutant,
+                r.sum_value / r.count as value,
+                r.period_start as date
+            FROM measurement_rollups r
+            JOIN sub_locations sl ON r.sub_location_id = sl.sub_location_id
+            JOIN pollutants p ON r.pollutant_id = p.pollutant_id
+            WHERE r.period = 'day'{date_filter}
+            ORDER BY r.period_start DESC, r.sub_location_id DESC, r.pollutant_id DESC
+        """, params)
+    with stage("sql_fetch"):
+        rows = cursor.fetchall()
+    count_rows(len(rows))
+    return rows
+
+
+def daily_means_frame(rows):
+    """Convert rows from query_daily_means() into a DataFrame.
+
+    Returns:
+        pandas.DataFrame: location, pollutant, value and date columns
+    """
+    import pandas as pd
+
+    return pd.DataFrame([dict(row) for row in rows], columns=["location", "pollutant", "value", "date"])
 
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(x=x, y=y, mode='lines+markers', name='Example Line'))
-    fig.update_layout(
-        title='Simple Line Chart',
-        xaxis_title='X Values',
-        yaxis_title='Y Values',
-        template='plotly_white'
-    )
 
-    # Convert the plot to JSON for embedding
-    graph_json = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+def read_daily_means(db, start_date: str = None, end_date: str = None):
+    """Read the daily mean of each location/pollutant series from the rollups.
 
-    return graph_json
+    Returns:
+        pandas.DataFrame: location, pollutant, value and date columns
+    """
+    rows = query_daily_means(db, start_date, end_date)
+    with stage("dataframe"):
+        return daily_means_frame(rows)
 
 
-def create_interactive_graph(db):
-    # Get data and convert to pandas DataFrame
-    data = db.execute("""
-        SELECT 
-            sl.name as location,
-            p.name as pollutant,
-            m.value,
-            m.measured_at as date
-        FROM measurements m
-        JOIN sub_locations sl ON m.sub_location_id = sl.sub_location_id
-        JOIN pollutants p ON m.pollutant_id = p.pollutant_id
-        ORDER BY m.measured_at DESC
-    """).fetchall()
+def read_graph_data(db, start_date: str = None, end_date: str = None, store=None):
+    """Read the daily mean of each location/pollutant series, from the series store when given.
 
-    df = pd.DataFrame([dict(row) for row in data])
+    Returns:
+        pandas.DataFrame: location, pollutant, value and date columns
+    """
+    if store is None:
+        return read_daily_means(db, start_date, end_date)
+    # Daily means straight from the in-memory store's arrays
+    with stage("store_daily_means"):
+        df = store.daily_means(start_date, end_date)
+    count_rows(len(df), "store_daily_means")
+    return df
+
+
+def create_interactive_graph(db, start_date: str = None, end_date: str = None,
+                             max_points: int = MAX_POINTS_PER_TRACE, store=None):
+    return graph_json(read_graph_data(db, start_date, end_date, store), max_points)
+
+
+def graph_json(df, max_points: int = MAX_POINTS_PER_TRACE):
+    """Build the graph figure JSON from the daily means, see read_graph_data().
+
+    Returns:
+        str: JSON-encoded Plotly figure
+    """
+    # Keep the payload and the browser render down on long date ranges, without losing spikes
+    with stage("downsample"):
+        locations, pollutants, groups = series_groups(df, max_points)
+
+    if not groups:
+        # No data - plotly express adds its own placeholder trace, and is quick with no rows
+        with stage("figure"):
+            fig = build_figure(df)
+        with stage("serialize"):
+            return figure_json(fig)
+
+    with stage("figure"):
+        spec = figure_spec(df, locations, pollutants, groups)
+    with stage("serialize"):
+        return figure_spec_json(spec)
+
+
+def figure_spec(df, locations, pollutants, groups):
+    """Build the graph as a Plotly figure spec, straight from the series arrays.
+
+    Gives the same figure as build_figure(), without plotly.express building and validating
+    every trace - the layout comes from figure_layout() and the traces are written directly.
+
+    Args:
+        df (pandas.DataFrame): Graph data with location, pollutant, value and date columns
+        locations, pollutants, groups: The series, from series_groups() - at least one
+
+    Returns:
+        dict: {"data": traces, "layout": layout}, ready for figure_spec_json()
+    """
+    layout = figure_layout(tuple(str(pollutant) for pollutant in pollutants))
+    colours = layout["template"]["layout"]["colorway"]
+    binary = binary_arrays_supported()
+    values = df["value"].to_numpy(dtype=float)
+    dates = df["date"].to_numpy()
+
+    traces = []
+    legend_shown = set()
+    for location, pollutant, rows in groups:
+        name = str(locations[location])
+        pollutant_name = str(pollutants[pollutant])
+        # Facet rows are numbered from the bottom, the first pollutant is the top row
+        axis = len(pollutants) - pollutant
+        axis_suffix = str(axis) if axis > 1 else ""
+        y = values[rows]
+        traces.append({
+            "hovertemplate": f"location={name}<br>pollutant={pollutant_name}<br>date=%{{x}}<br>value=%{{y}}"
+                             "<extra></extra>",
+            "legendgroup": name,
+            "marker": {"color": colours[location % len(colours)], "pattern": {"shape": ""}},
+            "name": name,
+            "orientation": "v",
+            "showlegend": location not in legend_shown,
+            "textposition": "auto",
+            "x": dates[rows].tolist(),
+            "xaxis": f"x{axis_suffix}",
+            "y": {"dtype": "f8", "bdata": base64.b64encode(y.astype("<f8").tobytes()).decode("ascii")}
+            if binary else y.tolist(),
+            "yaxis": f"y{axis_suffix}",
+            "type": "bar",
+            # Shows only the legend to start with and no data so that options can be selected
+            "visible": "legendonly",
+        })
+        legend_shown.add(location)
+
+    return {"data": traces, "layout": layout}
+
+
+@lru_cache(maxsize=32)
+def figure_layout(pollutants: tuple):
+    """Layout of the graph for these pollutants (facet rows, top to bottom).
+
+    Built by build_figure() from a placeholder row per pollutant, so the styling stays in one place,
+    and cached - the layout doesn't depend on the data, only on which pollutants are shown.
+
+    Returns:
+        dict: JSON-ready layout, template included. Shared between figures, so must not be changed.
+    """
+    import pandas as pd
+    from plotly.utils import PlotlyJSONEncoder
+
+    placeholder = pd.DataFrame({"location": [""] * len(pollutants), "pollutant": list(pollutants),
+                                "value": [0.0] * len(pollutants), "date": ["2000-01-01"] * len(pollutants)})
+    layout = build_figure(placeholder).to_plotly_json()["layout"]
+    return json.loads(json.dumps(layout, cls=PlotlyJSONEncoder))
+
+
+@lru_cache(maxsize=1)
+def binary_arrays_supported():
+    """Whether the plotly.js served with the page (see plotly_js_path()) reads base64 typed arrays."""
+    from plotly.offline import get_plotlyjs_version
+
+    version = tuple(int(part) for part in get_plotlyjs_version().split(".")[:2])
+    return version >= BINARY_ARRAYS_PLOTLYJS
+
+
+def figure_spec_json(spec):
+    """Serialise a figure spec from figure_spec() to JSON, with orjson when it's installed."""
+    if orjson is not None:
+        return orjson.dumps(spec, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+    from plotly.utils import PlotlyJSONEncoder
+
+    return json.dumps(spec, cls=PlotlyJSONEncoder)
+
+
+def build_figure(df):
+    """Build the faceted bar chart of the daily means.
+
+    Args:
+        df (pandas.DataFrame): location, pollutant, value and date columns
+
+    Returns:
+        plotly.graph_objects.Figure: One facet row per pollutant, one colour per location
+    """
+    import plotly.express as px
 
     # Count unique pollutants to know the number of facets when formatting later on
     num_pollutants = len(df['pollutant'].unique())
@@ -98,8 +388,22 @@ def create_interactive_graph(db):
 
     fig.update_yaxes(title_text='(µg/m³)')
 
-    return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+    return fig
+
+
+def figure_json(fig):
+    """Serialise a figure to JSON for embedding in a page."""
+    from plotly.utils import PlotlyJSONEncoder
+
+    return json.dumps(fig, cls=PlotlyJSONEncoder)
+
+
+def prewarm():
+    """Import plotly and pandas and build a small figure, so the first graph request doesn't wait for them.
 
+    Building a figure also loads plotly's default template and validators, which the imports alone don't.
+    """
+    import pandas as pd
 
-if __name__ == '__main__':
-    build_graph()
+    df = pd.DataFrame({"location": ["Prewarm"], "pollutant": ["Prewarm"], "value": [0.0], "date": ["2024-01-01"]})
+    figure_spec_json(figure_spec(df, *series_groups(df)))
@@ -0,0 +1,167 @@
+import gzip
+import hashlib
+import os
+import zlib
+from flask import Response, request, session
+from cache_helpers import DataVersionCache
+
+try:
+    import brotli
+except ImportError:  # Optional - responses fall back to gzip without it
+    brotli = None
+
+# Response types worth compressing - the rest (images, Parquet, ...) are already compressed
+COMPRESSIBLE_MIMETYPES = {"text/html", "text/csv", "text/plain", "text/css", "text/javascript",
+                          "application/json", "application/javascript"}
+# Payloads smaller than this aren't compressed - the saving doesn't cover the overhead
+COMPRESS_MIN_SIZE = 1024
+# Fast settings - large pages and streamed downloads are compressed on every miss
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Compressed bodies of buffered responses, by a hash of the uncompressed body and the encoding
+_compressed_cache = DataVersionCache(max_entries=32)
+
+
+def source_fingerprint(root: str):
+    """Fingerprint of the app's code and templates, so deploying new code changes every ETag.
+
+    Built from the paths and modification times of the .py files in root and the files in
+    root/templates, so every worker process of one deployment gets the same fingerprint.
+
+    Args:
+        root (str): The app's root directory
+
+    Returns:
+        str: Short hex digest
+    """
+    digest = hashlib.sha1()
+    for directory in (root, os.path.join(root, "templates")):
+        for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+            if entry.is_file() and (directory != root or entry.name.endswith(".py")):
+                digest.update(f"{entry.path}:{entry.stat().st_mtime_ns}".encode())
+    return digest.hexdigest()[:12]
+
+
+def init_http_caching(app, get_data_version):
+    """Add conditional requests, Cache-Control and compression to the app's responses.
+
+    For each endpoint named in app.config["HTTP_CACHE_CONTROL"] ({endpoint: Cache-Control value}),
+    GET responses get a weak ETag built from the code fingerprint, the data version, the endpoint,
+    its query parameters and, for private responses, the logged in user. A request whose If-None-Match matches is answered
+    with a 304 before the view runs, so the page isn't queried, rendered or sent again.
+
+    Text responses of COMPRESS_MIN_SIZE or more are compressed with brotli or gzip, whichever the
+    client prefers (brotli needs the brotli package). Streamed responses, e.g. CSV downloads, are
+    compressed as they stream.
+
+    Args:
+        app (flask.Flask): The application
+        get_data_version (callable): Returns the current data version, called inside the request
+    """
+    app.config.setdefault("HTTP_CACHE_CONTROL", {})
+    app.config.setdefault("ETAG_SALT", source_fingerprint(app.root_path))
+
+    @app.before_request
+    def answer_not_modified():
+        cache_control = app.config["HTTP_CACHE_CONTROL"].get(request.endpoint)
+        if cache_control is None or request.method not in ("GET", "HEAD"):
+            return None
+
+        data_version = get_data_version()
+        etag = _response_etag(app.config["ETAG_SALT"], data_version, per_user="private" in cache_control)
+        request.environ["airaware.etag"] = etag
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            _set_cache_headers(response, etag, cache_control)
+            return response
+        return None
+
+    @app.after_request
+    def add_cache_headers(response):
+        etag = request.environ.get("airaware.etag")
+        if etag is not None and response.status_code == 200:
+            _set_cache_headers(response, etag, app.config["HTTP_CACHE_CONTROL"][request.endpoint])
+        return compress_response(response, etag)
+
+
+def compress_response(response, etag: str = None):
+    """Compress a response body with the best encoding the client accepts.
+
+    Args:
+        response (flask.Response): The response
+        etag (str, optional): The response's ETag - buffered responses with one have their compressed
+            body cached. Defaults to None (not cached).
+
+    Returns:
+        flask.Response: The same response, compressed where worthwhile
+    """
+    if (response.status_code != 200 or response.direct_passthrough or request.method == "HEAD"
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(["br", "gzip"] if brotli is not None else ["gzip"])
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        if etag is not None:
+            # Keyed on the body rather than the ETag - the ETag doesn't cover the session, and pages
+            # render its flash messages. The body already reflects the data version, so the cache's
+            # own version is fixed - entries for old data are left to be evicted.
+            key = (hashlib.sha1(data).digest(), encoding)
+            compressed = _compressed_cache.get_or_build(key, 0, lambda: _compress(data, encoding))
+        else:
+            compressed = _compress(data, encoding)
+        response.set_data(compressed)
+
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def _response_etag(salt, data_version, per_user):
+    # Weak, as the compressed and uncompressed bodies share it. Only private pages read the session,
+    # as reading it adds a Vary: Cookie that stops shared caches reusing public responses.
+    user_id = session.get("user_id") if per_user else None
+    params = sorted(request.args.items(multi=True))
+    key = f"{salt}|{data_version}|{request.endpoint}|{params}|{user_id}"
+    return hashlib.sha1(key.encode()).hexdigest()[:32]
+
+
+def _set_cache_headers(response, etag, cache_control):
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = cache_control
+    response.vary.add("Accept-Encoding")
+
+
+def _compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def _compress_stream(chunks, encoding):
+    # Compress each chunk as it's produced, keeping the stream going
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        finish = compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+        finish = compressor.flush
+    try:
+        for chunk in chunks:
+            chunk = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+            data = compressor.process(chunk) if encoding == "br" else compressor.compress(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
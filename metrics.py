@@ -0,0 +1,246 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock, local
+from flask import g, has_request_context, request, template_rendered, before_render_template
+
+# Upper bounds (seconds) of the latency histogram buckets - 1 ms up to 10 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prometheus text exposition format - the full Content-Type header, charset included
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Prometheus style histogram - counts of observations per bucket, with their sum, per label set.
+
+    Args:
+        name (str): Metric name
+        documentation (str): Help text
+        labels (tuple[str]): Label names, values are given in the same order to observe()
+        buckets (tuple[float], optional): Bucket upper bounds, ascending. Defaults to LATENCY_BUCKETS.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *label_values):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._series.get(label_values)
+            if counts is None:
+                # One count per bucket, then the +Inf bucket, then the sum
+                counts = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bucket] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {label_values: list(counts) for label_values, counts in self._series.items()}
+        for label_values, counts in sorted(series.items()):
+            labels = _format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {counts[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Prometheus style counter - a running total per label set.
+
+    Args:
+        name (str): Metric name, ending in _total
+        documentation (str): Help text
+        labels (tuple[str]): Label names, values are given in the same order to inc()
+    """
+
+    def __init__(self, name: str, documentation: str, labels: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._series = {}
+        self._lock = Lock()
+
+    def inc(self, amount, *label_values):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = dict(self._series)
+        for label_values, total in sorted(series.items()):
+            lines.append(f"{self.name}{{{_format_labels(self.labels, label_values)}}} {total}")
+        return lines
+
+
+request_duration = Histogram("airaware_request_duration_seconds", "Time to handle a request, by endpoint",
+                             ("endpoint", "method", "status"))
+stage_duration = Histogram("airaware_stage_duration_seconds", "Time spent in each stage of a request",
+                           ("endpoint", "stage"))
+rows_total = Counter("airaware_rows_total", "Rows read from the database or series store", ("endpoint", "stage"))
+response_bytes_total = Counter("airaware_response_bytes_total", "Response body bytes sent, after compression",
+                               ("endpoint",))
+render_rejections_total = Counter("airaware_render_rejections_total",
+                                  "Renders refused by the render pool, busy (queue full) or timeout", ("reason",))
+METRICS = (request_duration, stage_duration, rows_total, response_bytes_total, render_rejections_total)
+
+# Stages timed outside a request while collect_stages() is running, e.g. in a render process
+_collecting = local()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage of the current request, e.g. with stage("sql_execute"): ...
+
+    The time is added to the stage histogram for the request's endpoint and, if enabled, the
+    request's Server-Timing header. Outside a request (scripts, benchmarks) the stage isn't recorded.
+
+    Args:
+        name (str): Stage name - sql_execute, sql_fetch, dataframe, figure, serialize, render, ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def record_stage(name: str, seconds: float):
+    """Record a stage timed by the caller - see stage()."""
+    if not has_request_context():
+        collected = getattr(_collecting, "value", None)
+        if collected is not None:
+            collected["stages"][name] = collected["stages"].get(name, 0.0) + seconds
+        return
+    endpoint = request.endpoint or "unmatched"
+    stage_duration.observe(seconds, endpoint, name)
+    stages = g.get("metrics_stages")
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + seconds
+
+
+def count_rows(count: int, stage_name: str = "sql_fetch"):
+    """Add to the rows read by the current request's endpoint."""
+    if has_request_context():
+        rows_total.inc(count, request.endpoint or "unmatched", stage_name)
+        return
+    collected = getattr(_collecting, "value", None)
+    if collected is not None:
+        collected["rows"][stage_name] = collected["rows"].get(stage_name, 0) + count
+
+
+@contextmanager
+def collect_stages():
+    """Collect the stages timed and rows counted outside a request, e.g. in a render process, so
+    they can be sent back and recorded against the request with record_stages().
+
+    Yields:
+        dict: {"stages": {name: seconds}, "rows": {stage name: count}}, filled in as the block runs
+    """
+    collected = {"stages": {}, "rows": {}}
+    _collecting.value = collected
+    try:
+        yield collected
+    finally:
+        _collecting.value = None
+
+
+def record_stages(collected: dict):
+    """Record stages collected by collect_stages() against the current request."""
+    for name, seconds in collected["stages"].items():
+        record_stage(name, seconds)
+    for stage_name, count in collected["rows"].items():
+        count_rows(count, stage_name)
+
+
+def init_metrics(app):
+    """Time every request and the stages inside it, and count the bytes each endpoint sends.
+
+    Call before init_http_caching(), so the bytes counted are the compressed ones. Rendering a
+    template is recorded as the "render" stage. With app.config["SERVER_TIMING"] set, responses get a
+    Server-Timing header with the time of each stage, which browser dev tools show against the request.
+
+    Metrics are kept per process - with several workers, each one's /metrics shows its own requests.
+
+    Args:
+        app (flask.Flask): The application
+    """
+    app.config.setdefault("SERVER_TIMING", False)
+
+    @app.before_request
+    def start_timing():
+        g.metrics_start = time.perf_counter()
+        g.metrics_stages = {}
+
+    @before_render_template.connect_via(app)
+    def start_render(sender, template, context, **extra):
+        g.metrics_render_start = time.perf_counter()
+
+    @template_rendered.connect_via(app)
+    def end_render(sender, template, context, **extra):
+        start = g.pop("metrics_render_start", None)
+        if start is not None:
+            record_stage("render", time.perf_counter() - start)
+
+    @app.after_request
+    def record_request(response):
+        start = g.get("metrics_start")
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or "unmatched"
+        request_duration.observe(elapsed, endpoint, request.method, str(response.status_code))
+
+        if app.config["SERVER_TIMING"]:
+            timings = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in g.metrics_stages.items()]
+            timings.append(f"total;dur={elapsed * 1000:.2f}")
+            response.headers["Server-Timing"] = ", ".join(timings)
+
+        if response.is_streamed and not response.direct_passthrough:
+            # Counted as the stream is sent
+            response.response = _count_stream(response.response, endpoint)
+        elif not response.is_streamed:
+            response_bytes_total.inc(response.content_length or 0, endpoint)
+        return response
+
+
+def render_metrics():
+    """Every metric in the Prometheus text format.
+
+    Returns:
+        str: The exposition text, served by /metrics
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(names, values):
+    return ",".join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values))
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _count_stream(chunks, endpoint):
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        response_bytes_total.inc(sent, endpoint)
+        if hasattr(chunks, "close"):
+            chunks.close()
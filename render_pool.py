@@ -0,0 +1,167 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from threading import Lock
+from database_helpers import acquire_db, release_db
+from graphing import MAX_POINTS_PER_TRACE, graph_json, read_daily_means
+from metrics import collect_stages, render_rejections_total
+from table_helpers import basic_table
+
+# Renders in flight (queued or running, across all the processes) before new ones are turned away,
+# so a burst of graph requests can't pile up without limit
+DEFAULT_MAX_PENDING = 16
+# Seconds a request waits for its render before giving up - the render carries on, and a retry of
+# the same render joins it rather than starting another
+DEFAULT_TIMEOUT = 30.0
+
+
+class RenderPoolBusy(RuntimeError):
+    """Too many renders are already in flight - the request should be retried later."""
+
+
+class RenderTimeout(TimeoutError):
+    """The render didn't finish within the pool's timeout."""
+
+
+class RenderPool:
+    """Process pool for the CPU heavy figure and table builds, so they don't hold the GIL of the
+    worker serving the lightweight pages.
+
+    Renders are identified by a key - a request for a render that is already in flight waits for
+    that one instead of starting another. Once max_pending renders are in flight new ones are
+    refused with RenderPoolBusy, and a request that waits longer than timeout gets RenderTimeout.
+
+    The processes are started with spawn, as forking a threaded server can copy held locks and open
+    db connections into the child. They start on the first render.
+
+    Args:
+        workers (int, optional): Number of processes. Defaults to the number of CPUs.
+        max_pending (int, optional): Renders in flight before new ones are refused. Defaults to DEFAULT_MAX_PENDING.
+        timeout (float, optional): Seconds to wait for a render. Defaults to DEFAULT_TIMEOUT.
+        initializer (callable, optional): Run in each process as it starts, e.g. graphing.prewarm
+    """
+
+    def __init__(self, workers: int = None, max_pending: int = DEFAULT_MAX_PENDING,
+                 timeout: float = DEFAULT_TIMEOUT, initializer=None):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.initializer = initializer
+        self._executor = None
+        self._pending = {}
+        self._lock = Lock()
+
+    @property
+    def enabled(self):
+        """False when the pool has no processes - callers render in the request thread instead."""
+        return self.workers > 0
+
+    def render(self, key, fn, *args):
+        """Run fn(*args) in the pool and wait for its result, joining a render of the same key in flight.
+
+        Args:
+            key (hashable): Identifies the render - everything its result depends on
+            fn (callable): Module level function, so it can be sent to the process
+            *args: Picklable arguments to fn
+
+        Returns:
+            The result of fn(*args)
+
+        Raises:
+            RenderPoolBusy: If max_pending renders are already in flight
+            RenderTimeout: If the render doesn't finish within the timeout
+        """
+        future = self._submit(key, fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            render_rejections_total.inc(1, "timeout")
+            raise RenderTimeout(f"Render {key!r} took longer than {self.timeout:g}s") from None
+
+    def pending(self):
+        """Number of renders in flight."""
+        with self._lock:
+            return len(self._pending)
+
+    def shutdown(self):
+        """Stop the processes, cancelling queued renders."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, key, fn, *args):
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            if len(self._pending) >= self.max_pending:
+                render_rejections_total.inc(1, "busy")
+                raise RenderPoolBusy(f"{len(self._pending)} renders already in flight")
+
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"),
+                                                     initializer=self.initializer)
+            executor = self._executor
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # A process died - start a new pool for this and later renders
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = self._executor = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"),
+                                                                initializer=self.initializer)
+                future = executor.submit(fn, *args)
+            self._pending[key] = future
+
+        future.add_done_callback(lambda done: self._finished(key, done, executor))
+        return future
+
+    def _finished(self, key, future, executor):
+        broken = not future.cancelled() and isinstance(future.exception(), BrokenProcessPool)
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+            if broken and self._executor is executor:
+                # A process died - the next render starts a new pool
+                self._executor = None
+        if broken:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def render_graph(dataset: str, start_date: str = None, end_date: str = None, daily_means=None,
+                 max_points: int = MAX_POINTS_PER_TRACE):
+    """Build the graph figure JSON for a dataset, in a render process - see graphing.graph_json().
+
+    The daily means are best read by the caller from its series store and passed in, so the render
+    processes don't each hold a copy of the measurements. Without them they're read from the rollups.
+
+    Args:
+        dataset (str): Dataset to graph, a key of DATASETS
+        start_date (str, optional): First date to include. Defaults to None (the first date held).
+        end_date (str, optional): Last date to include. Defaults to None (the last date held).
+        daily_means (pandas.DataFrame, optional): The daily means to graph, see graphing.read_graph_data().
+            Defaults to None (read from the dataset's rollups).
+        max_points (int, optional): Maximum points per trace. Defaults to MAX_POINTS_PER_TRACE.
+
+    Returns:
+        tuple[str, dict]: JSON-encoded Plotly figure, and the stages timed building it (see
+        metrics.collect_stages()) for the caller to record with metrics.record_stages()
+    """
+    with collect_stages() as stages:
+        if daily_means is None:
+            db = acquire_db(dataset)
+            try:
+                daily_means = read_daily_means(db, start_date, end_date)
+            finally:
+                release_db(db)
+        return graph_json(daily_means, max_points), stages
+
+
+def render_table(location_name: str = "Oxford"):
+    """Build the empty, styled Plotly table JSON for the table page, in a render process - see basic_table().
+
+    Returns:
+        str: JSON-encoded Plotly table figure with no rows
+    """
+    return basic_table(data=[], location_name=location_name).to_json()
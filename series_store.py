@@ -0,0 +1,640 @@
+import json
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from threading import Lock
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows - snapshot writes by several processes at once aren't serialised
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# pandas is imported where it's used - loading a snapshot and answering queries don't need it, so
+# workers starting from a snapshot don't pay for the import until the first graph
+
+# Rows are read from the db in chunks of this many when loading the store
+LOAD_CHUNK_SIZE = 100000
+
+# Each row's position in the sort order is one int64 key: the measured_at code in the high bits
+# and the measurement id in the low 32 bits, so keys sort by (measured_at, measurement_id)
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+# Filters matching at least this share of the series scan the columns outwards from the cursor;
+# narrower filters merge the matching series' own row lists instead
+SCAN_SERIES_FRACTION = 1 / 16
+
+# Arrays written to a snapshot, one .npy file each, alongside an index.json with the rest
+SNAPSHOT_ARRAYS = ("keys", "series", "values", "status", "times", "series_sub", "series_pollutant",
+                   "series_order", "series_bounds")
+# File in the snapshot directory naming the current version's sub-directory
+SNAPSHOT_POINTER = "CURRENT"
+# File in the snapshot directory locked while a snapshot is written
+SNAPSHOT_LOCK = "LOCK"
+
+
+class _StoreData:
+    """One immutable snapshot of the store's arrays - replaced as a whole on refresh.
+
+    Measurement columns, in (measured_at, measurement_id) order:
+        keys (int64): measured_at code << ID_BITS | measurement_id
+        series (int32): Index into the series arrays
+        values (float64): Measurement value
+        status (int16): Index into status_names
+
+    Lookup tables:
+        times (str array): Sorted distinct measured_at strings, indexed by the key's high bits
+        status_names (list[str]): Distinct status strings
+        series_sub / series_pollutant (int64 arrays): sub_location_id and pollutant_id of each series
+        series_order (intp array): Row positions grouped by series, each series' rows ascending
+        series_bounds (intp array): Where each series' rows end in series_order (exclusive)
+        series_rows (list[numpy.ndarray]): Views of series_order with each series' rows
+        time_values (datetime64 array): times parsed to datetimes, built on first use
+        sub_locations (dict): {sub_location_id: (location name, sub-location name)}
+        pollutants (dict): {pollutant_id: pollutant name}
+    """
+
+    def __init__(self, keys, series, values, status, times, status_names, series_sub, series_pollutant,
+                 sub_locations, pollutants, last_measurement_id, data_version, series_order=None,
+                 series_bounds=None):
+        self.keys = keys
+        self.series = series
+        self.values = values
+        self.status = status
+        self.times = times
+        self.status_names = status_names
+        self.series_sub = series_sub
+        self.series_pollutant = series_pollutant
+        self.sub_locations = sub_locations
+        self.pollutants = pollutants
+        self.last_measurement_id = last_measurement_id
+        self.data_version = data_version
+
+        if series_order is None:
+            # Positions of each series' rows - a stable sort keeps them in date order
+            series_order = np.argsort(series, kind="stable")
+            series_bounds = np.cumsum(np.bincount(series, minlength=len(series_sub)))
+        self.series_order = series_order
+        self.series_bounds = series_bounds
+        self.series_rows = np.split(series_order, series_bounds[:-1])
+        self._time_values = None
+
+    @property
+    def time_values(self):
+        # times parsed to datetime64, on first use - only the distinct times are parsed
+        if self._time_values is None:
+            import pandas as pd
+
+            times = pd.to_datetime(pd.Series(self.times, dtype=str), format="ISO8601")
+            self._time_values = times.to_numpy(dtype="datetime64[s]")
+        return self._time_values
+
+
+class SeriesStore:
+    """In-memory columnar copy of the measurements, for serving reads without SQL.
+
+    Holds NumPy arrays rather than row objects (around 30 bytes per measurement), with the
+    locations, pollutants, statuses and times integer coded. Filtering, keyset paging and the
+    daily aggregates for the graphs are vectorised array operations.
+
+    Call refresh() with the current data version before reading. After ingest, the store switches
+    to a newer snapshot if one has been exported; otherwise new measurements that all come after the
+    ones held are appended, and anything else (e.g. a backfill) reloads the store.
+
+    The arrays can be saved as a snapshot (save_snapshot(), see data/export_snapshot.py) and opened
+    with mmap, which makes a cold start near-instant and lets every worker process share one copy
+    of the data through the OS page cache. A store opened from a snapshot keeps it up to date itself:
+    the first process to refresh after ingest writes the new snapshot, and the rest open it.
+    """
+
+    def __init__(self):
+        self._data = None
+        self._lock = Lock()
+
+    @property
+    def loaded(self):
+        """True once the store has been loaded from the db."""
+        return self._data is not None
+
+    @property
+    def rows(self):
+        """Number of measurements held."""
+        return len(self._data.keys) if self._data is not None else 0
+
+    def refresh(self, db, data_version, snapshot_path: str = None):
+        """Bring the store up to date with the db if the data version has changed.
+
+        Args:
+            db (sqlite3.Connection): Database connection object
+            data_version (int): Current data version (see get_data_version())
+            snapshot_path (str, optional): Snapshot directory to start from when the store is empty,
+                and to switch to when a newer one has been exported since (e.g. after ingest). A snapshot
+                from an older data version than the db is topped up from the db and written back as a
+                new snapshot, so the arrays stay memory-mapped and shared. Defaults to None.
+        """
+        data = self._data
+        if data is not None and data.data_version == data_version:
+            return
+
+        with self._lock:
+            data = self._data
+            if data is not None and data.data_version == data_version:
+                return  # Another thread refreshed it while we waited
+            # Read everything from one consistent snapshot of the db
+            db.execute("BEGIN")
+            try:
+                if snapshot_path:
+                    data = self._current_snapshot(db, snapshot_path, data, data_version)
+                if data is None:
+                    self._data = self._load(db, data_version)
+                elif data.data_version == data_version:
+                    self._data = data
+                else:
+                    self._data = self._load_new(db, data, data_version) or self._load(db, data_version)
+            finally:
+                db.rollback()
+
+    def get_filtered_results(self, main_location=None, sub_location=None, pollutant=None, limit: int = 14,
+                             sort: str = "DESC", after: tuple = None, before: tuple = None):
+        """Filter, sort and page the measurements - same arguments and results as
+        database_helpers.get_filtered_results(), with the rows returned as dicts.
+
+        Returns:
+            list[dict]: Records with loc_name, sub_name, pollutant_name, value, status, measured_at
+            and measurement_id, in the requested sort order
+        """
+        data = self._data
+        descending = str(sort).upper() != "ASC"
+        limit = len(data.keys) if limit is None else limit
+
+        # Range of positions either side of the cursor - rows before lo sort before the cursor,
+        # rows from hi on sort after it
+        cursor = before if before is not None else after
+        lo, hi = self._cursor_bounds(data, cursor) if cursor is not None else (len(data.keys), 0)
+
+        # A descending page, or an ascending page read back from a before cursor, is taken from the
+        # rows preceding the cursor, closest first
+        from_below = descending != (before is not None)
+
+        series = self._matching_series(data, main_location, sub_location, pollutant)
+        if series is None:
+            positions = np.arange(max(lo - limit, 0), lo) if from_below else np.arange(hi, min(hi + limit, len(data.keys)))
+        elif len(series) == 0:
+            # Nothing matches (or the store is empty)
+            positions = np.empty(0, dtype=np.intp)
+        elif len(series) >= SCAN_SERIES_FRACTION * len(data.series_sub):
+            positions = self._scan_positions(data, series, lo, hi, limit, from_below)
+        else:
+            parts = []
+            for index in series:
+                rows = data.series_rows[index]
+                if from_below:
+                    end = np.searchsorted(rows, lo)
+                    parts.append(rows[max(end - limit, 0):end])
+                else:
+                    start = np.searchsorted(rows, hi)
+                    parts.append(rows[start:start + limit])
+            positions = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.intp)
+            positions = positions[-limit:] if from_below else positions[:limit]
+
+        if descending:
+            positions = positions[::-1]
+        return self._rows(data, positions)
+
+    def daily_means(self, start_date: str = None, end_date: str = None):
+        """Daily mean of each series - the store's equivalent of the 'day' measurement rollups.
+
+        Args:
+            start_date (str, optional): First date to include (YYYY-MM-DD). Defaults to None.
+            end_date (str, optional): Last date to include (YYYY-MM-DD). Defaults to None.
+
+        Returns:
+            pandas.DataFrame: location, pollutant, value and date columns, ordered by date, then
+            sub-location and pollutant id (all descending) like the rollup query in graphing.py
+        """
+        import pandas as pd
+
+        data = self._data
+
+        # Map each distinct time to its day, then each row to a (series, day) cell
+        days, time_day = np.unique(np.asarray(data.times, dtype="U10"), return_inverse=True)
+        row_day = time_day[data.keys >> ID_BITS]
+        cell = data.series.astype(np.int64) * len(days) + row_day
+        size = len(data.series_sub) * len(days)
+        sums = np.bincount(cell, weights=data.values, minlength=size)
+        counts = np.bincount(cell, minlength=size)
+
+        series, day = np.nonzero(counts.reshape(len(data.series_sub), len(days)))
+        keep = np.ones(len(day), dtype=bool)
+        if start_date:
+            keep &= days[day] >= start_date
+        if end_date:
+            keep &= days[day] <= end_date
+        series, day = series[keep], day[keep]
+
+        # lexsort sorts by the last key first
+        order = np.lexsort((-data.series_pollutant[series], -data.series_sub[series], -day))
+        series, day = series[order], day[order]
+        cells = series * len(days) + day
+
+        return pd.DataFrame({
+            "location": [data.sub_locations[sub][1] for sub in data.series_sub[series]],
+            "pollutant": [data.pollutants[pollutant] for pollutant in data.series_pollutant[series]],
+            "value": sums[cells] / counts[cells],
+            "date": days[day].tolist(),
+        }, columns=["location", "pollutant", "value", "date"])
+
+    def iter_series(self, main_location=None, sub_location=None, pollutant=None):
+        """Matching measurements one series at a time - the store's equivalent of
+        database_helpers.iter_series(), with the columns as arrays.
+
+        Returns:
+            generator[tuple]: (location name, sub-location name, pollutant name, measured_at
+            datetime64 array, value array) for each series, ordered by sub-location and pollutant id
+        """
+        data = self._data
+        series = self._matching_series(data, main_location, sub_location, pollutant)
+        if series is None:
+            series = np.arange(len(data.series_sub))
+        series = series[np.lexsort((data.series_pollutant[series], data.series_sub[series]))]
+
+        for index in series.tolist():
+            rows = data.series_rows[index]
+            if not len(rows):
+                continue
+            loc_name, sub_name = data.sub_locations[int(data.series_sub[index])]
+            yield (loc_name, sub_name, data.pollutants[int(data.series_pollutant[index])],
+                   data.time_values[data.keys[rows] >> ID_BITS], data.values[rows])
+
+    def save_snapshot(self, path: str):
+        """Write the store's arrays to a snapshot under path, for opening with mmap.
+
+        Each array is written to its own .npy file in a directory for the data version, and the
+        CURRENT pointer file is then swapped over to it, so readers never see a half written
+        snapshot. Older versions are removed, keeping the previous one for readers still opening it.
+
+        Args:
+            path (str): Snapshot directory
+
+        Returns:
+            str: Directory the snapshot was written to
+        """
+        with _snapshot_lock(path):
+            return self._write_snapshot(path)
+
+    def _write_snapshot(self, path):
+        # Caller holds the snapshot lock
+        data = self._data
+        name = f"v{data.data_version}"
+        target = os.path.join(path, name)
+        staging = f"{target}.tmp-{os.getpid()}"
+        os.makedirs(staging, exist_ok=True)
+
+        for array in SNAPSHOT_ARRAYS:
+            np.save(os.path.join(staging, f"{array}.npy"), np.ascontiguousarray(getattr(data, array)))
+        with open(os.path.join(staging, "index.json"), mode="w") as index_file:
+            json.dump({
+                "data_version": data.data_version,
+                "last_measurement_id": data.last_measurement_id,
+                "rows": len(data.keys),
+                "status_names": data.status_names,
+            }, index_file)
+
+        shutil.rmtree(target, ignore_errors=True)
+        os.rename(staging, target)
+
+        previous = self._snapshot_name(path)
+        pointer = os.path.join(path, SNAPSHOT_POINTER)
+        with open(f"{pointer}.tmp-{os.getpid()}", mode="w") as pointer_file:
+            pointer_file.write(name)
+        os.replace(f"{pointer}.tmp-{os.getpid()}", pointer)
+
+        for entry in os.listdir(path):
+            if entry.startswith("v") and entry not in (name, previous) and ".tmp-" not in entry:
+                shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+        return target
+
+    def nbytes(self):
+        """Approximate memory held by the store's arrays, in bytes."""
+        data = self._data
+        if data is None:
+            return 0
+        return (data.keys.nbytes + data.series.nbytes + data.values.nbytes + data.status.nbytes
+                + data.times.nbytes + sum(rows.nbytes for rows in data.series_rows))
+
+    @staticmethod
+    def _cursor_bounds(data, cursor):
+        # Rows before lo sort before the cursor and rows from hi on sort after it
+        measured_at, measurement_id = cursor
+        code = np.searchsorted(data.times, measured_at)
+        if code < len(data.times) and data.times[code] == measured_at:
+            key = (int(code) << ID_BITS) | min(max(int(measurement_id), 0), ID_MASK)
+            return (int(np.searchsorted(data.keys, key, side="left")),
+                    int(np.searchsorted(data.keys, key, side="right")))
+        # The cursor time isn't held - every row from this time code on sorts after it
+        position = int(np.searchsorted(data.keys, int(code) << ID_BITS))
+        return position, position
+
+    @staticmethod
+    def _scan_positions(data, series, lo, hi, limit, from_below):
+        # Walk out from the cursor a block at a time, keeping the rows of the matching series
+        allowed = np.zeros(len(data.series_sub), dtype=bool)
+        allowed[series] = True
+        block = max(limit * len(data.series_sub) // len(series), 1024)
+
+        found = []
+        count = 0
+        if from_below:
+            end = lo
+            while count < limit and end > 0:
+                start = max(end - block, 0)
+                matches = start + np.flatnonzero(allowed[data.series[start:end]])
+                found.insert(0, matches)
+                count += len(matches)
+                end = start
+                block *= 2
+            return np.concatenate(found)[-limit:] if found else np.empty(0, dtype=np.intp)
+
+        start = hi
+        while count < limit and start < len(data.keys):
+            end = min(start + block, len(data.keys))
+            matches = start + np.flatnonzero(allowed[data.series[start:end]])
+            found.append(matches)
+            count += len(matches)
+            start = end
+            block *= 2
+        return np.concatenate(found)[:limit] if found else np.empty(0, dtype=np.intp)
+
+    @staticmethod
+    def _matching_series(data, main_location=None, sub_location=None, pollutant=None):
+        # Indices of the series that match the filters, None if no filter is set - same rules as
+        # database_helpers._resolve_filter_ids()
+        main_location = main_location if main_location and main_location.strip() else None
+        sub_location = sub_location if sub_location and sub_location.strip() else None
+        pollutant = pollutant if pollutant and pollutant.strip() else None
+        if main_location is None and sub_location is None and pollutant is None:
+            return None
+
+        keep = np.ones(len(data.series_sub), dtype=bool)
+        if main_location is not None or sub_location is not None:
+            sub_ids = [sub_id for sub_id, (loc_name, sub_name) in data.sub_locations.items()
+                       if main_location in (None, loc_name) and sub_location in (None, sub_name)]
+            keep &= np.isin(data.series_sub, sub_ids)
+        if pollutant is not None:
+            pollutant_ids = [pollutant_id for pollutant_id, name in data.pollutants.items() if name == pollutant]
+            keep &= np.isin(data.series_pollutant, pollutant_ids)
+        return np.flatnonzero(keep)
+
+    @staticmethod
+    def _rows(data, positions):
+        # Build the result records for the rows at positions
+        keys = data.keys[positions]
+        rows = []
+        for key, series, value, status in zip(keys.tolist(), data.series[positions].tolist(),
+                                              data.values[positions].tolist(), data.status[positions].tolist()):
+            loc_name, sub_name = data.sub_locations[int(data.series_sub[series])]
+            rows.append({
+                "loc_name": loc_name,
+                "sub_name": sub_name,
+                "pollutant_name": data.pollutants[int(data.series_pollutant[series])],
+                "value": value,
+                "status": data.status_names[status],
+                "measured_at": str(data.times[key >> ID_BITS]),
+                "measurement_id": key & ID_MASK,
+            })
+        return rows
+
+    @staticmethod
+    def _read_coded_measurements(db):
+        # Read every measurement as integer coded column arrays - the coding is done by SQLite so
+        # only numbers cross into Python, which is several times quicker than reading the strings
+        times = np.asarray([row[0] for row in db.execute(
+            "SELECT DISTINCT measured_at FROM measurements ORDER BY measured_at")], dtype=str)
+        status_names = [row[0] for row in db.execute(
+            "SELECT DISTINCT status FROM measurements ORDER BY status")]
+
+        # Plain tuples rather than the connection's row factory - cheaper to create
+        cursor = db.cursor()
+        cursor.row_factory = None
+        cursor.execute(f"""
+            WITH times AS (
+                SELECT measured_at, row_number() OVER (ORDER BY measured_at) - 1 AS code
+                FROM (SELECT DISTINCT measured_at FROM measurements)
+            ), statuses AS (
+                SELECT status, row_number() OVER (ORDER BY status) - 1 AS code
+                FROM (SELECT DISTINCT status FROM measurements)
+            )
+            SELECT (times.code << {ID_BITS}) | measurement_id, (sub_location_id << 32) | pollutant_id,
+                   value, statuses.code
+            FROM measurements
+            JOIN times USING (measured_at)
+            JOIN statuses USING (status)
+        """)
+
+        row_type = np.dtype([("key", np.int64), ("series", np.int64), ("value", np.float64), ("status", np.int16)])
+        chunks = [np.empty(0, dtype=row_type)]
+        while True:
+            rows = cursor.fetchmany(LOAD_CHUNK_SIZE)
+            if not rows:
+                break
+            chunks.append(np.fromiter(rows, dtype=row_type, count=len(rows)))
+
+        table = np.concatenate(chunks)
+        columns = [np.ascontiguousarray(table[name]) for name in row_type.names]
+        return columns, times, status_names
+
+    @staticmethod
+    def _read_measurements(db, after_id: int = 0):
+        # Read the measurements added after after_id as column arrays, in (measured_at, id) order
+        cursor = db.execute("""
+            SELECT measurement_id, sub_location_id, pollutant_id, value, status, measured_at
+            FROM measurements
+            WHERE measurement_id > ?
+            ORDER BY measured_at, measurement_id
+        """, (after_id,))
+
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(LOAD_CHUNK_SIZE)
+            if not rows:
+                break
+            chunks.append(list(zip(*rows)))
+
+        if not chunks:
+            return None
+        columns = [np.concatenate([np.asarray(chunk[index]) for chunk in chunks]) for index in range(3)]
+        values = np.concatenate([np.asarray(chunk[3], dtype=np.float64) for chunk in chunks])
+        status = [status for chunk in chunks for status in chunk[4]]
+        measured_at = [measured_at for chunk in chunks for measured_at in chunk[5]]
+        return columns[0].astype(np.int64), columns[1].astype(np.int64), columns[2].astype(np.int64), \
+            values, status, measured_at
+
+    @staticmethod
+    def _snapshot_name(path):
+        # Name of the current snapshot version directory, None if there isn't one
+        try:
+            with open(os.path.join(path, SNAPSHOT_POINTER), mode="r") as pointer_file:
+                return pointer_file.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _current_snapshot(self, db, path, data, data_version):
+        # The held data, or the snapshot if one newer than it has been exported (e.g. after ingest).
+        # Topping up a memory-mapped snapshot would copy its arrays into this process, so one that is
+        # behind the db is topped up once, written back as a new snapshot and opened again - other
+        # processes then open that rather than topping up copies of their own.
+        newer_than = data.data_version if data is not None else None
+        snapshot = self._open_snapshot(db, path, data_version, newer_than)
+        if snapshot is not None:
+            data = snapshot
+        if data is None or data.data_version == data_version or not isinstance(data.keys, np.memmap):
+            return data
+
+        with _snapshot_lock(path):
+            # Another process may have written it while this one waited
+            snapshot = self._open_snapshot(db, path, data_version, newer_than=data.data_version)
+            if snapshot is not None:
+                data = snapshot
+            if data.data_version == data_version:
+                return data
+            self._data = self._load_new(db, data, data_version) or self._load(db, data_version)
+            try:
+                self._write_snapshot(path)
+            except OSError as e:
+                logger.warning(f"Snapshot not updated, keeping the store in this process's memory: {e}")
+                return self._data
+            return self._open_snapshot(db, path, data_version, newer_than=data.data_version) or self._data
+
+    def _open_snapshot(self, db, path, data_version, newer_than=None):
+        # Open the current snapshot with its arrays memory-mapped. Returns None if there is no
+        # snapshot, it is from a newer data version than the db (e.g. the db was restored), or it
+        # is no newer than the data version newer_than (the data already held).
+        name = self._snapshot_name(path)
+        if name is None:
+            return None
+        directory = os.path.join(path, name)
+        with open(os.path.join(directory, "index.json"), mode="r") as index_file:
+            index = json.load(index_file)
+        if index["data_version"] > data_version:
+            return None
+        if newer_than is not None and index["data_version"] <= newer_than:
+            return None
+
+        arrays = {array: np.load(os.path.join(directory, f"{array}.npy"), mmap_mode="r")
+                  for array in SNAPSHOT_ARRAYS}
+        sub_locations, pollutants = self._read_reference(db)
+        return _StoreData(
+            status_names=index["status_names"],
+            sub_locations=sub_locations,
+            pollutants=pollutants,
+            last_measurement_id=index["last_measurement_id"],
+            data_version=index["data_version"],
+            **arrays,
+        )
+
+    @staticmethod
+    def _read_reference(db):
+        # {sub_location_id: (location name, sub-location name)} and {pollutant_id: name}
+        sub_locations = {row[0]: (row[1], row[2]) for row in db.execute("""
+            SELECT sub_locations.sub_location_id, locations.name, sub_locations.name
+            FROM sub_locations
+            JOIN locations ON locations.location_id = sub_locations.location_id
+        """)}
+        pollutants = {row[0]: row[1] for row in db.execute("SELECT pollutant_id, name FROM pollutants")}
+        return sub_locations, pollutants
+
+    def _load(self, db, data_version):
+        # Load every measurement into a new snapshot
+        import pandas as pd
+
+        sub_locations, pollutants = self._read_reference(db)
+        (keys, series_keys, values, status), times, status_names = self._read_coded_measurements(db)
+
+        # Rows arrive in whatever order SQLite finds easiest - put them in key order
+        order = np.argsort(keys, kind="stable")
+        keys, series_keys, values, status = keys[order], series_keys[order], values[order], status[order]
+        series_codes, series_keys = pd.factorize(series_keys)
+        series_keys = np.asarray(series_keys, dtype=np.int64)
+
+        return _StoreData(
+            keys=keys,
+            series=series_codes.astype(np.int32),
+            values=values,
+            status=status,
+            times=times,
+            status_names=status_names,
+            series_sub=series_keys >> 32,
+            series_pollutant=series_keys & 0xFFFFFFFF,
+            sub_locations=sub_locations,
+            pollutants=pollutants,
+            last_measurement_id=int((keys & ID_MASK).max()) if len(keys) else 0,
+            data_version=data_version,
+        )
+
+    def _load_new(self, db, data, data_version):
+        # Append the measurements added since the snapshot was loaded. Returns the new snapshot, or
+        # None if they don't all sort after the rows held and a full reload is needed.
+        import pandas as pd
+
+        sub_locations, pollutants = self._read_reference(db)
+        measurements = self._read_measurements(db, data.last_measurement_id)
+        if measurements is None:
+            return _StoreData(data.keys, data.series, data.values, data.status, data.times, data.status_names,
+                              data.series_sub, data.series_pollutant, sub_locations, pollutants,
+                              data.last_measurement_id, data_version, data.series_order, data.series_bounds)
+
+        ids, sub_ids, pollutant_ids, values, status, measured_at = measurements
+        if len(data.times) and measured_at[0] < data.times[-1]:
+            return None
+
+        # New times all sort after the held ones, so existing codes stay valid
+        new_times = np.asarray(pd.unique(pd.Series(measured_at)), dtype=str)
+        if len(data.times) and new_times[0] == data.times[-1]:
+            new_times = new_times[1:]
+        times = np.concatenate([data.times, new_times])
+        time_codes = np.searchsorted(times, measured_at)
+
+        # Extend the status and series tables with any new entries, keeping the existing codes
+        status_names = pd.Index(data.status_names).append(
+            pd.Index(pd.unique(pd.Series(status))).difference(data.status_names, sort=False))
+        status_codes = status_names.get_indexer(status).astype(np.int16)
+
+        series_keys = pd.Index(data.series_sub << 32 | data.series_pollutant)
+        new_series_keys = sub_ids << 32 | pollutant_ids
+        series_keys = series_keys.append(pd.Index(pd.unique(new_series_keys)).difference(series_keys, sort=False))
+        series_codes = series_keys.get_indexer(new_series_keys).astype(np.int32)
+        series_keys = np.asarray(series_keys, dtype=np.int64)
+
+        return _StoreData(
+            keys=np.concatenate([data.keys, time_codes.astype(np.int64) << ID_BITS | ids]),
+            series=np.concatenate([data.series, series_codes]),
+            values=np.concatenate([data.values, values]),
+            status=np.concatenate([data.status, status_codes]),
+            times=times,
+            status_names=list(status_names),
+            series_sub=series_keys >> 32,
+            series_pollutant=series_keys & 0xFFFFFFFF,
+            sub_locations=sub_locations,
+            pollutants=pollutants,
+            last_measurement_id=int(ids.max()),
+            data_version=data_version,
+        )
+
+
+@contextmanager
+def _snapshot_lock(path):
+    # Serialise writing the snapshot at path between processes
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, SNAPSHOT_LOCK), mode="a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
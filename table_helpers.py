@@ -1,5 +1,37 @@
-import pandas as pd
-import plotly.graph_objects as go
+import os
+from functools import lru_cache
+from importlib.metadata import version
+from importlib.util import find_spec
+
+# pandas and plotly are imported by basic_table() when a table is first built, not when the app starts
+
+# Columns shown in the table, in order
+TABLE_COLUMNS = ["loc_name", "sub_name", "pollutant_name", "value", "status", "measured_at"]
+
+
+def table_columns(data):
+    """Convert database query results into column-oriented lists for a Plotly table.
+
+    Args:
+        data (list[sqlite3.Row]): Database query results with the fields in TABLE_COLUMNS
+
+    Returns:
+        list[list]: One list of values per column, in TABLE_COLUMNS order
+    """
+    return [[row[column] for row in data] for column in TABLE_COLUMNS]
+
+
+@lru_cache(maxsize=1)
+def plotly_js_path():
+    """Return the path of the plotly.js bundle shipped with the installed plotly package."""
+    # Found without importing plotly
+    return os.path.join(find_spec("plotly").submodule_search_locations[0], "package_data", "plotly.min.js")
+
+
+@lru_cache(maxsize=1)
+def plotly_js_version():
+    """Return the installed plotly version, used to version the plotly.js URL for caching."""
+    return version("plotly")
 
 
 def basic_table(data, location_name: str = "Oxford"):
@@ -29,12 +61,14 @@ def basic_table(data, location_name: str = "Oxford"):
 
     Notes:
         - Automatically converts measured_at column to datetime format
-        - Column headers are derived from DataFrame columns
-        - All columns from input data are displayed in the table
+        - Column headers are taken from TABLE_COLUMNS
+        - Empty data gives a table with just the headers, for filling in later
     """
+    import pandas as pd
+    import plotly.graph_objects as go
 
     # Convert the raw db data into a df for easy use
-    df = pd.DataFrame(dict(row) for row in data)
+    df = pd.DataFrame((dict(row) for row in data), columns=TABLE_COLUMNS)
     df["measured_at"] = pd.to_datetime(df["measured_at"])
 
     # Create the table using the go object